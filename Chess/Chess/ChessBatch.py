@@ -0,0 +1,173 @@
+"""
+Пакетный анализ позиций в нескольких процессах
+Позиции читаются потоком, раздаются пулу процессов, результаты возвращаются в порядке входа
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import ChessEngine
+from . import ChessPositions
+from . import ChessSearch
+from . import ChessTransposition
+
+TASKS = ("moves", "perft", "search")
+DEFAULT_CHUNK_SIZE = 16  # позиций в одном задании - меньше накладных расходов на передачу между процессами
+
+# состояние процесса-исполнителя: свой GameState и своя таблица транспозиций, создаются один раз
+_worker = {}
+
+
+def _initWorker(backend, tt_size_mb):
+    _worker["game_state"] = ChessEngine.GameState(backend)
+    _worker["tt"] = ChessTransposition.TranspositionTable(tt_size_mb) if tt_size_mb else None
+
+
+def analyzePosition(game_state, fen, task, depth, time_ms, tt=None):
+    """
+    Анализ одной позиции на уже созданном game_state, возвращает словарь с результатом
+    """
+    game_state.loadFen(fen)
+    result = {"fen": fen, "task": task}
+    if task == "moves":
+        moves = game_state.getValidMoves()
+        result["moves"] = [move.getUciNotation() for move in moves]
+        result["nodes"] = len(moves)
+    elif task == "perft":
+        result["depth"] = depth
+        result["nodes"] = game_state.perft(depth)
+    elif task == "search":
+        # таблица общая для всех позиций процесса: записи прошлых позиций вытесняются по поколению
+        search = ChessSearch.best_move(game_state, time_ms, max_depth=depth, tt=tt)
+        result["move"] = search.move.getUciNotation() if search.move else None
+        result["score"] = search.score
+        result["depth"] = search.depth
+        result["nodes"] = search.nodes
+        result["pv"] = [move.getUciNotation() for move in search.pv]
+    else:
+        raise ValueError("Неизвестная задача: " + str(task))
+    return result
+
+
+def _analyzeChunk(chunk, task, depth, time_ms):
+    """
+    Выполняется в процессе-исполнителе: анализ пачки позиций - (fen, операции) или строк FEN/EPD без разбора
+    """
+    results = []
+    for position in chunk:
+        start = time.perf_counter()
+        fen, operations = (position, {}) if isinstance(position, str) else position
+        try:
+            if isinstance(position, str):  # строка разбирается здесь, чтобы ошибка разбора стала записью в пакете
+                fen, operations = ChessPositions.parseEpd(position)
+            result = analyzePosition(_worker["game_state"], fen, task, depth, time_ms, _worker["tt"])
+        except Exception as error:  # некорректная строка или позиция не должна останавливать весь пакет
+            result = {"fen": fen, "task": task, "error": "{}: {}".format(type(error).__name__, error)}
+        result["seconds"] = round(time.perf_counter() - start, 6)
+        if "id" in operations:
+            result["id"] = operations["id"]
+        results.append(result)
+    return results
+
+
+def _chunks(positions, chunk_size):
+    chunk = []
+    for position in positions:
+        chunk.append(position)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def analyzeBatch(positions, task="moves", depth=1, time_ms=None, workers=None, backend="array",
+                 chunk_size=DEFAULT_CHUNK_SIZE, max_in_flight=None, tt_size_mb=16, progress=None):
+    """
+    Генератор результатов анализа для потока позиций (fen, операции) - например, из ChessPositions.readPositions,
+    или строк FEN/EPD из ChessPositions.readLines - тогда некорректная строка даёт запись с ошибкой.
+    Результаты идут в том же порядке, что и позиции. В работе одновременно не больше max_in_flight пачек,
+    поэтому поток позиций читается по мере обработки, а не целиком.
+    progress(количество позиций, прошло секунд) вызывается после каждой пачки
+    """
+    if task not in TASKS:
+        raise ValueError("Неизвестная задача: " + str(task))
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    tt_size_mb = tt_size_mb if task == "search" else 0
+    start = time.perf_counter()
+    index = 0
+
+    def collect(future):
+        nonlocal index
+        for result in future.result():
+            result["index"] = index
+            index += 1
+            yield result
+        if progress is not None:
+            progress(index, time.perf_counter() - start)
+
+    with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(backend, tt_size_mb)) as executor:
+        in_flight = collections.deque()
+        for chunk in _chunks(positions, chunk_size):
+            in_flight.append(executor.submit(_analyzeChunk, chunk, task, depth, time_ms))
+            if len(in_flight) >= max_in_flight:  # очередь заполнена - ждём самую старую пачку, чтобы сохранить порядок
+                yield from collect(in_flight.popleft())
+        while in_flight:
+            yield from collect(in_flight.popleft())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный анализ позиций в нескольких процессах")
+    parser.add_argument("file", help="файл FEN/EPD (можно .gz)")
+    parser.add_argument("--task", choices=TASKS, default="moves",
+                        help="moves - легальные ходы, perft - количество узлов, search - лучший ход")
+    parser.add_argument("-d", "--depth", type=int, default=None, help="глубина perft или поиска")
+    parser.add_argument("--time-ms", type=int, default=None, help="время поиска на позицию в миллисекундах")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="количество процессов (по умолчанию - ядра)")
+    parser.add_argument("--backend", choices=("array", "bitboard"), default="array",
+                        help="представление доски и генератор ходов")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="позиций в одном задании")
+    parser.add_argument("--in-flight", type=int, default=None, help="максимум заданий в работе одновременно")
+    parser.add_argument("-o", "--output", metavar="FILE", help="записать результаты в FILE (JSON Lines) вместо stdout")
+    parser.add_argument("--quiet", action="store_true", help="не печатать прогресс")
+    args = parser.parse_args(argv)
+
+    if args.depth is None:
+        args.depth = 1 if args.task == "perft" else ChessSearch.MAX_PLY
+    if args.task == "search" and args.time_ms is None and args.depth == ChessSearch.MAX_PLY:
+        parser.error("для search нужна --time-ms или --depth")
+
+    def report(done, seconds):
+        if not args.quiet:
+            print("\rпозиций: {}, {:.1f} с, {:.0f} поз/с".format(done, seconds, done / seconds if seconds else 0),
+                  end="", file=sys.stderr)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    start = time.perf_counter()
+    count = nodes = errors = 0
+    try:
+        for result in analyzeBatch(ChessPositions.readLines(args.file), args.task, args.depth, args.time_ms,
+                                   args.workers, args.backend, args.chunk_size, args.in_flight, progress=report):
+            out.write(json.dumps(result) + "\n")
+            count += 1
+            nodes += result.get("nodes", 0)
+            errors += "error" in result
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - start
+    if not args.quiet:
+        print(file=sys.stderr)
+        print("Всего: {} позиций за {:.3f} с, {:.1f} поз/с, {} узлов, {} узлов/с, ошибок: {}".format(
+            count, seconds, count / seconds if seconds else 0, nodes, int(nodes / seconds) if seconds else 0, errors),
+            file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+Пакетная оценка позиций на NumPy
+Позиции кодируются в непрерывный массив uint8 (N x 64 или N x 12 x 8 x 8), материал, таблицы полей и
+подвижность считаются для всего пакета сразу, без цикла по клеткам в Python.
+NumPy - необязательная зависимость: нужна только этому модулю
+"""
+import argparse
+import random
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError as error:
+    raise ImportError("Для ChessBatchEval нужен numpy: pip install numpy") from error
+
+from . import ChessEngine
+from . import ChessEvaluation
+from . import ChessPositions
+
+SENTINEL = 64  # клетка "за доской" в таблицах шагов
+MOBILITY_WEIGHT = 2  # сотых пешки за каждый ход коня, слона, ладьи или ферзя
+
+
+def _squareTable(values):
+    """
+    Таблица 13 x 64 по кодам фигур ChessEngine.PIECES, строка 0 (пустая клетка) - нули
+    """
+    table = np.zeros((len(ChessEngine.PIECES), 64), dtype=np.int64)
+    for code, piece in enumerate(ChessEngine.PIECES[1:], 1):
+        table[code] = np.array(values[piece], dtype=np.int64).reshape(64)
+    return table
+
+
+PST_MG_TABLE = _squareTable(ChessEvaluation.PST_MG)
+PST_EG_TABLE = _squareTable(ChessEvaluation.PST_EG)
+PHASE_TABLE = np.array([ChessEvaluation.PHASE[piece] for piece in ChessEngine.PIECES], dtype=np.int64)
+SQUARE_INDEX = np.arange(64)
+
+# фигура -> символ FEN, пустая клетка - точка; цифры FEN раскрываются в точки перед переводом в коды
+FEN_CHARS = {piece: piece[1].upper() if piece[0] == "w" else piece[1].lower() for piece in ChessEngine.PIECES[1:]}
+FEN_CHARS["--"] = "."
+FEN_CODES = np.zeros(256, dtype=np.uint8)  # символ -> код фигуры ChessEngine.PIECE_CODES
+for piece, char in FEN_CHARS.items():
+    FEN_CODES[ord(char)] = ChessEngine.PIECE_CODES[piece]
+FEN_EXPAND = str.maketrans({str(n): "." * n for n in range(1, 9)} | {"/": ""})
+
+
+def _jumpMatrix(offsets):
+    """
+    Матрица 64 x 64: 1, если с клетки-строки фигура прыжком попадает на клетку-столбец
+    """
+    matrix = np.zeros((64, 64), dtype=np.float32)
+    for row in range(8):
+        for col in range(8):
+            for d_row, d_col in offsets:
+                if 0 <= row + d_row <= 7 and 0 <= col + d_col <= 7:
+                    matrix[row * 8 + col, (row + d_row) * 8 + col + d_col] = 1
+    return matrix
+
+
+def _sourceTable(d_row, d_col):
+    """
+    Для каждой клетки - клетка, из которой шаг (d_row, d_col) ведёт в неё, или SENTINEL
+    """
+    table = np.full(65, SENTINEL, dtype=np.intp)
+    for row in range(8):
+        for col in range(8):
+            if 0 <= row - d_row <= 7 and 0 <= col - d_col <= 7:
+                table[row * 8 + col] = (row - d_row) * 8 + col - d_col
+    return table
+
+
+KNIGHT_MATRIX = _jumpMatrix(ChessEngine.KNIGHT_OFFSETS)
+RAY_SOURCES = [_sourceTable(d_row, d_col) for d_row, d_col in ChessEngine.DIRECTIONS]
+
+
+def encodeBoards(positions):
+    """
+    Пакет позиций (GameState или строки FEN) -> (доски N x 64 uint8 с кодами фигур, ход белых N bool).
+    Клетка - row * 8 + col, как в упакованных ходах
+    """
+    chunks = []
+    white_to_move = []
+    for position in positions:
+        if isinstance(position, str):
+            fields = position.split()
+            chunks.append(fields[0].translate(FEN_EXPAND).encode("ascii"))
+            white_to_move.append(len(fields) < 2 or fields[1] == "w")
+        else:
+            chunks.append("".join([FEN_CHARS[piece] for row in position.board for piece in row]).encode("ascii"))
+            white_to_move.append(position.white_to_move)
+    raw = np.frombuffer(b"".join(chunks), dtype=np.uint8).reshape(len(chunks), 64)
+    return FEN_CODES[raw], np.array(white_to_move, dtype=bool)
+
+
+def toPlanes(boards):
+    """
+    N x 64 коды -> N x 12 x 8 x 8 uint8: по плоскости на каждую фигуру каждого цвета (порядок ChessEngine.PIECES)
+    """
+    planes = boards[:, None, :] == np.arange(1, len(ChessEngine.PIECES), dtype=np.uint8)[None, :, None]
+    return planes.reshape(len(boards), len(ChessEngine.PIECES) - 1, 8, 8).astype(np.uint8)
+
+
+def evaluatePst(boards, white_to_move):
+    """
+    Материал и таблицы полей со смешиванием по стадии игры - то же, что GameState.evaluate(), для всего пакета.
+    Оценка с точки зрения стороны, которая ходит
+    """
+    mg = PST_MG_TABLE[boards, SQUARE_INDEX].sum(axis=1)
+    eg = PST_EG_TABLE[boards, SQUARE_INDEX].sum(axis=1)
+    phase = np.minimum(PHASE_TABLE[boards].sum(axis=1), ChessEvaluation.MAX_PHASE)
+    score = (mg * phase + eg * (ChessEvaluation.MAX_PHASE - phase)) // ChessEvaluation.MAX_PHASE
+    return np.where(white_to_move, score, -score)
+
+
+def mobility(boards):
+    """
+    Подвижность (белые минус черные): псевдолегальные ходы коней, слонов, ладей и ферзей без учёта шахов и связок.
+    Лучи дальнобойных фигур продвигаются на шаг за раз сразу по всему пакету
+    """
+    count = len(boards)
+    padded = np.zeros((count, 65), dtype=np.uint8)  # столбец 64 - "за доской", всегда пуст и недоступен
+    padded[:, :64] = boards
+    empty = padded == 0
+    empty[:, SENTINEL] = False
+    codes = ChessEngine.PIECE_CODES
+    result = np.zeros(count, dtype=np.int64)
+    for color, sign in (("w", 1), ("b", -1)):
+        own = (padded >= codes[color + "p"]) & (padded <= codes[color + "K"])
+        reachable = ~own
+        reachable[:, SENTINEL] = False
+        knights = (padded[:, :64] == codes[color + "N"]).astype(np.float32)
+        moves = ((knights @ KNIGHT_MATRIX) * reachable[:, :64]).sum(axis=1)
+        queens = padded == codes[color + "Q"]
+        orthogonal = (padded == codes[color + "R"]) | queens
+        diagonal = (padded == codes[color + "B"]) | queens
+        for direction, source in enumerate(RAY_SOURCES):
+            frontier = orthogonal if direction < 4 else diagonal
+            for _ in range(7):
+                frontier = frontier[:, source]
+                moves = moves + (frontier & reachable).sum(axis=1)
+                frontier = frontier & empty  # за занятую клетку луч не идёт
+                if not frontier.any():
+                    break
+        result += sign * moves.astype(np.int64)
+    return result
+
+
+def evaluateBatch(boards, white_to_move, mobility_weight=MOBILITY_WEIGHT):
+    """
+    Оценка пакета с точки зрения стороны, которая ходит: таблицы полей плюс подвижность
+    """
+    score = evaluatePst(boards, white_to_move)
+    if mobility_weight:
+        bonus = mobility(boards) * mobility_weight
+        score = score + np.where(white_to_move, bonus, -bonus)
+    return score
+
+
+def randomFens(count, seed=0, max_plies=80):
+    """
+    Позиции из случайных партий - для замеров, когда нет файла с позициями
+    """
+    rng = random.Random(seed)
+    game_state = ChessEngine.GameState()
+    fens = []
+    while len(fens) < count:
+        game_state.loadFen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+        for _ in range(rng.randint(1, max_plies)):
+            moves = game_state.getValidMoveCodes()
+            if not moves:
+                break
+            game_state.makeMove(rng.choice(moves))
+        fens.append(game_state.to_fen())
+    return fens
+
+
+def benchmark(fens):
+    """
+    Позиций в секунду: цикл по позициям (GameState.evaluate и полный пересчёт по доске) против пакета.
+    Возвращает строки отчёта и количество расхождений пакетной оценки с GameState.evaluate()
+    """
+    rows = []
+
+    start = time.perf_counter()
+    game_states = [ChessEngine.GameState.from_fen(fen) for fen in fens]
+    rows.append(("загрузка GameState из FEN", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    loop_scores = [game_state.evaluate() for game_state in game_states]
+    rows.append(("цикл: GameState.evaluate()", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    rebuilt_scores = [ChessEvaluation.taper(*ChessEvaluation.computeEvaluation(game_state.board))
+                      * (1 if game_state.white_to_move else -1) for game_state in game_states]
+    rows.append(("цикл: пересчёт по доске", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    boards, white_to_move = encodeBoards(fens)
+    rows.append(("пакет: кодирование FEN", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    encodeBoards(game_states)
+    rows.append(("пакет: кодирование GameState", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    batch_scores = evaluatePst(boards, white_to_move)
+    rows.append(("пакет: таблицы полей", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    evaluateBatch(boards, white_to_move)
+    rows.append(("пакет: таблицы полей + подвижность", time.perf_counter() - start))
+
+    # пакет и пересчёт по доске сверяются с инкрементальной оценкой GameState
+    mismatches = int((batch_scores != np.array(loop_scores)).sum()) + sum(
+        rebuilt != score for rebuilt, score in zip(rebuilt_scores, loop_scores))
+    return rows, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер пакетной оценки позиций на NumPy")
+    parser.add_argument("file", nargs="?", help="файл FEN/EPD; без него - позиции из случайных партий")
+    parser.add_argument("-n", "--count", type=int, default=20000, help="сколько позиций взять")
+    args = parser.parse_args(argv)
+
+    if args.file:
+        fens = []
+        game_state = ChessEngine.GameState()
+        for fen, _ in ChessPositions.readPositions(args.file):
+            try:
+                game_state.loadFen(fen)  # некорректные позиции пропускаем, как ChessBatch
+            except ValueError as error:
+                print(error, file=sys.stderr)
+                continue
+            fens.append(fen)
+            if len(fens) >= args.count:
+                break
+    else:
+        fens = randomFens(args.count)
+    rows, mismatches = benchmark(fens)
+    print("Позиций: {}".format(len(fens)))
+    for name, seconds in rows:
+        print("{:<40} {:8.3f} с {:>12.0f} поз/с".format(name, seconds, len(fens) / seconds if seconds else 0))
+    print("Расхождений с GameState.evaluate(): {}".format(mismatches))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
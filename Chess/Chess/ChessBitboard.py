@@ -0,0 +1,491 @@
+"""
+Битборды - альтернативное представление доски и генератор ходов
+Каждая фигура каждого цвета хранится 64-битным числом, клетка (row, col) - бит row * 8 + col
+"""
+from . import ChessEngine
+from .ChessEngine import (PIECE_CODES, TO_SHIFT, FLAGS_SHIFT, MOVED_SHIFT, CAPTURED_SHIFT, ENPASSANT_FLAG, CASTLE_FLAG,
+                         PROMOTION_FLAG, WHITE_KINGSIDE, BLACK_KINGSIDE, WHITE_QUEENSIDE, BLACK_QUEENSIDE,
+                         TACTICAL_MOVES, QUIET_MOVES, ALL_MOVES)
+
+SQUARES = [(square // 8, square % 8) for square in range(64)]  # номер клетки -> (row, col)
+FULL = (1 << 64) - 1
+
+
+def _jumpAttacks(offsets):
+    attacks = []
+    for row, col in SQUARES:
+        bitboard = 0
+        for d_row, d_col in offsets:
+            if 0 <= row + d_row <= 7 and 0 <= col + d_col <= 7:
+                bitboard |= 1 << ((row + d_row) * 8 + col + d_col)
+        attacks.append(bitboard)
+    return attacks
+
+
+KNIGHT_ATTACKS = _jumpAttacks(ChessEngine.KNIGHT_OFFSETS)
+KING_ATTACKS = _jumpAttacks(ChessEngine.KING_OFFSETS)
+# белая пешка бьёт вверх по доске (row - 1), черная - вниз (row + 1)
+PAWN_ATTACKS = (_jumpAttacks(((-1, -1), (-1, 1))), _jumpAttacks(((1, -1), (1, 1))))
+
+
+def _rayMask(square, direction, occupied=0):
+    """
+    Клетки луча из square до края доски или до первой занятой клетки включительно
+    """
+    row, col = SQUARES[square]
+    bitboard = 0
+    row, col = row + direction[0], col + direction[1]
+    while 0 <= row <= 7 and 0 <= col <= 7:
+        bit = 1 << (row * 8 + col)
+        bitboard |= bit
+        if occupied & bit:
+            break
+        row, col = row + direction[0], col + direction[1]
+    return bitboard
+
+
+def _subsets(mask):
+    """
+    Все подмножества битов маски (carry-rippler)
+    """
+    subset = 0
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if subset == 0:
+            return
+
+
+def _lineTables(direction_pairs):
+    """
+    Атаки дальнобойной фигуры по линиям: для каждой клетки и каждой линии (пары противоположных направлений)
+    маска линии и словарь "занятость линии -> атакованные клетки".
+    Словарь играет роль magic-хеша: одно обращение вместо прохода по лучу
+    """
+    masks = []
+    tables = []
+    for square in range(64):
+        square_masks = []
+        square_tables = []
+        for first, second in direction_pairs:
+            mask = _rayMask(square, first) | _rayMask(square, second)
+            table = {}
+            for occupied in _subsets(mask):
+                table[occupied] = _rayMask(square, first, occupied) | _rayMask(square, second, occupied)
+            square_masks.append(mask)
+            square_tables.append(table)
+        masks.append(tuple(square_masks))
+        tables.append(tuple(square_tables))
+    return masks, tables
+
+
+ROOK_MASKS, ROOK_TABLES = _lineTables((((0, -1), (0, 1)), ((-1, 0), (1, 0))))
+BISHOP_MASKS, BISHOP_TABLES = _lineTables((((-1, -1), (1, 1)), ((-1, 1), (1, -1))))
+ROOK_RAYS = [masks[0] | masks[1] for masks in ROOK_MASKS]  # атаки ладьи на пустой доске
+BISHOP_RAYS = [masks[0] | masks[1] for masks in BISHOP_MASKS]
+
+
+def rookAttacks(square, occupied):
+    masks = ROOK_MASKS[square]
+    tables = ROOK_TABLES[square]
+    return tables[0][occupied & masks[0]] | tables[1][occupied & masks[1]]
+
+
+def bishopAttacks(square, occupied):
+    masks = BISHOP_MASKS[square]
+    tables = BISHOP_TABLES[square]
+    return tables[0][occupied & masks[0]] | tables[1][occupied & masks[1]]
+
+
+def _betweenAndLines():
+    """
+    BETWEEN[a][b] - клетки строго между a и b, LINE[a][b] - вся линия через a и b (0, если они не на одной линии)
+    """
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for a in range(64):
+        for d_row, d_col in ChessEngine.DIRECTIONS:
+            full_line = _rayMask(a, (d_row, d_col)) | _rayMask(a, (-d_row, -d_col)) | (1 << a)
+            bitboard = _rayMask(a, (d_row, d_col))
+            while bitboard:
+                bit = bitboard & -bitboard
+                bitboard ^= bit
+                b = bit.bit_length() - 1
+                between[a][b] = _rayMask(a, (d_row, d_col), bit) ^ bit
+                line[a][b] = full_line
+    return between, line
+
+
+BETWEEN, LINE = _betweenAndLines()
+
+# клетки, которые должны быть свободны и не атакованы при рокировке: (король, куда, ладья, пустые, безопасные)
+CASTLING = {
+    WHITE_KINGSIDE: (60, 62, 63, (1 << 61) | (1 << 62), (61, 62)),
+    WHITE_QUEENSIDE: (60, 58, 56, (1 << 57) | (1 << 58) | (1 << 59), (59, 58)),
+    BLACK_KINGSIDE: (4, 6, 7, (1 << 5) | (1 << 6), (5, 6)),
+    BLACK_QUEENSIDE: (4, 2, 0, (1 << 1) | (1 << 2) | (1 << 3), (3, 2)),
+}
+CASTLING_SIDES = ((WHITE_KINGSIDE, WHITE_QUEENSIDE), (BLACK_KINGSIDE, BLACK_QUEENSIDE))  # по цвету
+PROMOTION_RANKS = (0xFF, 0xFF << 56)
+NOT_FILE_A = FULL ^ sum(1 << (row * 8) for row in range(8))
+NOT_FILE_H = FULL ^ sum(1 << (row * 8 + 7) for row in range(8))
+DOUBLE_PUSH_RANKS = (0xFF << 32, 0xFF << 24)  # горизонтали, куда пешка попадает двойным ходом
+
+# битборды хранятся списком: сначала 6 белых фигур, потом 6 черных, смещение цвета - 0 или 6.
+# Порядок тот же, что в ChessEngine.PIECES: индекс битборда = код фигуры в упакованном ходе - 1
+PIECE_INDEX = {color + piece: offset + i for color, offset in (("w", 0), ("b", 6)) for i, piece in enumerate("pNBRQK")}
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PROMOTION_PIECES = (QUEEN, ROOK, BISHOP, KNIGHT)  # в порядке Move.promotion_choices
+
+
+class BitboardGameState(ChessEngine.GameState):
+    """
+    Тот же GameState, но ходы генерируются по битбордам.
+    board продолжает обновляться, поэтому интерфейс и отрисовка не меняются
+    """
+
+    def __init__(self, backend="bitboard"):
+        super().__init__(backend)
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]  # занятые клетки белых и черных
+        self.syncState()
+
+    def syncState(self):
+        super().syncState()
+        self.syncBitboards()
+
+    def restore(self, data, offset=0):
+        super().restore(data, offset)
+        self.syncBitboards()
+
+    def syncBitboards(self):
+        """
+        Битборды заново по board
+        """
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        for square, (row, col) in enumerate(SQUARES):
+            piece = self.board[row][col]
+            if piece != "--":
+                self.bitboards[PIECE_INDEX[piece]] |= 1 << square
+                self.occupancy[piece[0] == "b"] |= 1 << square
+
+    def makeMove(self, move):
+        code = move if type(move) is int else move.code
+        super().makeMove(code)
+        self.toggleMove(code)
+
+    def undoMove(self):
+        if self.ply != 0:
+            code = self.lastMove()
+            super().undoMove()
+            self.toggleMove(code)
+
+    def toggleMove(self, code):
+        """
+        Применяет упакованный ход к битбордам через XOR: повторный вызов с тем же ходом его отменяет
+        """
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        moved = (code >> MOVED_SHIFT & 15) - 1
+        color = moved >= 6
+        start_square, end_square, flags = code & 63, code >> TO_SHIFT & 63, code >> FLAGS_SHIFT & 15
+        start = 1 << start_square
+        end = 1 << end_square
+        if flags >= PROMOTION_FLAG:
+            bitboards[moved] ^= start
+            bitboards[moved - PAWN + PROMOTION_PIECES[flags - PROMOTION_FLAG]] ^= end
+        else:
+            bitboards[moved] ^= start | end
+        occupancy[color] ^= start | end
+        captured_piece = code >> CAPTURED_SHIFT & 15
+        if captured_piece:
+            if flags == ENPASSANT_FLAG:
+                captured = 1 << ((start_square & ~7) + (end_square & 7))
+            else:
+                captured = end
+            bitboards[captured_piece - 1] ^= captured
+            occupancy[not color] ^= captured
+        if flags == CASTLE_FLAG:
+            row = end_square & ~7
+            if end_square - start_square == 2:  # сторона короля
+                rook = (1 << (row + 7)) | (1 << (row + 5))
+            else:  # сторона ферзя
+                rook = (1 << row) | (1 << (row + 3))
+            bitboards[moved - KING + ROOK] ^= rook
+            occupancy[color] ^= rook
+
+    def attackersTo(self, square, occupied, them):
+        """
+        Битборд фигур противника (them - смещение его цвета, 0 или 6), атакующих клетку при занятости occupied
+        """
+        bitboards = self.bitboards
+        queens = bitboards[them + QUEEN]
+        masks = ROOK_MASKS[square]
+        tables = ROOK_TABLES[square]
+        attackers = (tables[0][occupied & masks[0]] | tables[1][occupied & masks[1]]) & (bitboards[them + ROOK] | queens)
+        masks = BISHOP_MASKS[square]
+        tables = BISHOP_TABLES[square]
+        attackers |= (tables[0][occupied & masks[0]] | tables[1][occupied & masks[1]]) & (
+                bitboards[them + BISHOP] | queens)
+        # пешка противника бьёт клетку, если с этой клетки пешка нашего цвета била бы её
+        return (attackers | (KNIGHT_ATTACKS[square] & bitboards[them + KNIGHT])
+                | (KING_ATTACKS[square] & bitboards[them + KING])
+                | (PAWN_ATTACKS[them == 0][square] & bitboards[them + PAWN]))
+
+    def isSquareAttacked(self, row, col, attacker_color):
+        occupied = self.occupancy[0] | self.occupancy[1]
+        return self.attackersTo(row * 8 + col, occupied, 0 if attacker_color == "w" else 6) != 0
+
+    def generateValidMoveCodes(self):
+        """
+        Все легальные ходы: связки и шахи учитываются битбордами, поэтому фильтровать ходы после генерации не нужно
+        """
+        move_sets, special_moves = self.generateMoveSets()
+        moves = self.encodeMoveSets(move_sets, special_moves, ALL_MOVES)
+        self.updateGameOver(len(moves))
+        return moves
+
+    def generateMoveStages(self):
+        """
+        Наборы ходов строятся один раз, а в числа переводятся по порциям: взятия и превращения, потом тихие ходы
+        """
+        move_sets, special_moves = self.generateMoveSets()
+        tactical = self.encodeMoveSets(move_sets, special_moves, TACTICAL_MOVES)
+        yield tactical
+        quiet = self.encodeMoveSets(move_sets, special_moves, QUIET_MOVES)
+        self.updateGameOver(len(tactical) + len(quiet))
+        yield quiet
+
+    def encodeMoveSets(self, move_sets, special_moves, kinds):
+        """
+        Наборы ходов из generateMoveSets -> упакованные ходы вида kinds (TACTICAL_MOVES, QUIET_MOVES или ALL_MOVES)
+        """
+        board = self.board
+        promotion_rank = PROMOTION_RANKS[not self.white_to_move]
+        pawn = PIECE_CODES["wp" if self.white_to_move else "bp"] << MOVED_SHIFT
+        enemies = self.occupancy[self.white_to_move]
+        if kinds == ALL_MOVES:
+            piece_mask = pawn_mask = FULL
+        elif kinds == TACTICAL_MOVES:
+            piece_mask, pawn_mask = enemies, enemies | promotion_rank
+        else:
+            piece_mask, pawn_mask = FULL ^ enemies, FULL ^ (enemies | promotion_rank)
+        moves = []
+        for square, targets, pawn_shift in move_sets:
+            targets &= piece_mask if pawn_shift is None else pawn_mask
+            if pawn_shift is None:
+                start = square | PIECE_CODES[board[square >> 3][square & 7]] << MOVED_SHIFT
+            else:
+                start = square | pawn
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                end_square = target.bit_length() - 1
+                if pawn_shift:  # набор ходов всех пешек с одинаковым сдвигом
+                    start = end_square + pawn_shift | pawn
+                code = start | end_square << TO_SHIFT | PIECE_CODES[board[end_square >> 3][end_square & 7]] << CAPTURED_SHIFT
+                if pawn_shift is not None and target & promotion_rank:
+                    for i in range(len(ChessEngine.Move.promotion_choices)):
+                        moves.append(code | (PROMOTION_FLAG + i) << FLAGS_SHIFT)
+                else:
+                    moves.append(code)
+        for start, end, is_enpassant_move in special_moves:
+            if not kinds & (TACTICAL_MOVES if is_enpassant_move else QUIET_MOVES):
+                continue
+            if is_enpassant_move:
+                moves.append(start | end << TO_SHIFT | ENPASSANT_FLAG << FLAGS_SHIFT | pawn
+                             | PIECE_CODES["bp" if self.white_to_move else "wp"] << CAPTURED_SHIFT)
+            else:
+                moves.append(start | end << TO_SHIFT | CASTLE_FLAG << FLAGS_SHIFT
+                             | PIECE_CODES[board[start >> 3][start & 7]] << MOVED_SHIFT)
+        return moves
+
+    def countValidMoves(self):
+        """
+        Количество легальных ходов без создания объектов Move - считаем биты в наборах ходов
+        """
+        move_sets, special_moves = self.generateMoveSets()
+        promotion_rank = PROMOTION_RANKS[not self.white_to_move]
+        count = len(special_moves)
+        for _, targets, pawn_shift in move_sets:
+            count += targets.bit_count()
+            if pawn_shift is not None:
+                count += 3 * (targets & promotion_rank).bit_count()  # каждое превращение - 4 хода
+        self.updateGameOver(count)
+        return count
+
+    def generateMoveSets(self):
+        """
+        Легальные ходы в виде наборов: список (клетка, битборд целевых клеток, сдвиг пешки) и
+        список особых ходов (откуда, куда, взятие на проходе - иначе рокировка).
+        Сдвиг пешки: None - не пешка, 0 - одна пешка с клетки, иначе набор ходов всех пешек,
+        где клетка хода = клетка назначения + сдвиг
+        """
+        bitboards = self.bitboards
+        color = not self.white_to_move  # 0 - белые, 1 - черные
+        us = 6 * color
+        them = 6 - us
+        allies = self.occupancy[color]
+        enemies = self.occupancy[not color]
+        occupied = allies | enemies
+        king_bit = bitboards[us + KING]
+        king = king_bit.bit_length() - 1
+        move_sets = []
+        special_moves = []
+
+        checkers = self.attackersTo(king, occupied, them)
+        self.in_check = checkers != 0
+
+        # ходы короля: проверяем поле без короля на доске, чтобы он не закрывал луч шахующей фигуры
+        occupied_without_king = occupied ^ king_bit
+        targets = KING_ATTACKS[king] & ~allies
+        king_targets = 0
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            if not self.attackersTo(bit.bit_length() - 1, occupied_without_king, them):
+                king_targets |= bit
+        if king_targets:
+            move_sets.append((king, king_targets, None))
+
+        if checkers & (checkers - 1) == 0:  # при двойном шахе ходит только король
+            if checkers:
+                # либо съесть шахующую фигуру, либо закрыться от неё
+                target_mask = checkers | BETWEEN[king][checkers.bit_length() - 1]
+            else:
+                target_mask = FULL
+            self.generatePieceMoves(color, king, occupied, allies, enemies, target_mask, move_sets, special_moves)
+            if not checkers:
+                self.generateCastleMoves(color, king, occupied, special_moves)
+        return move_sets, special_moves
+
+    def pinnedPieces(self, them, king, occupied, allies):
+        """
+        Битборд связанных фигур стороны, которая ходит
+        """
+        bitboards = self.bitboards
+        queens = bitboards[them + QUEEN]
+        snipers = ((ROOK_RAYS[king] & (bitboards[them + ROOK] | queens))
+                   | (BISHOP_RAYS[king] & (bitboards[them + BISHOP] | queens)))
+        pinned = 0
+        between = BETWEEN[king]
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            blockers = between[bit.bit_length() - 1] & occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & allies:
+                pinned |= blockers
+        return pinned
+
+    def generatePieceMoves(self, color, king, occupied, allies, enemies, target_mask, move_sets, special_moves):
+        """
+        Ходы всех фигур, кроме короля, с учётом связок и маски допустимых полей (target_mask при шахе)
+        """
+        bitboards = self.bitboards
+        us = 6 * color
+        them = 6 - us
+        pinned = self.pinnedPieces(them, king, occupied, allies)
+        line = LINE[king]
+        not_allies = ~allies & target_mask
+
+        knights = bitboards[us + KNIGHT] & ~pinned  # связанный конь не ходит
+        while knights:
+            bit = knights & -knights
+            knights ^= bit
+            square = bit.bit_length() - 1
+            targets = KNIGHT_ATTACKS[square] & not_allies
+            if targets:
+                move_sets.append((square, targets, None))
+
+        queens = bitboards[us + QUEEN]
+        for pieces, masks_table, tables_table in ((bitboards[us + BISHOP] | queens, BISHOP_MASKS, BISHOP_TABLES),
+                                                  (bitboards[us + ROOK] | queens, ROOK_MASKS, ROOK_TABLES)):
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                square = bit.bit_length() - 1
+                masks = masks_table[square]
+                tables = tables_table[square]
+                targets = (tables[0][occupied & masks[0]] | tables[1][occupied & masks[1]]) & not_allies
+                if bit & pinned:
+                    targets &= line[square]
+                if targets:
+                    move_sets.append((square, targets, None))
+
+        pawns = bitboards[us + PAWN]
+        empty = ~occupied & FULL
+        target_enemies = enemies & target_mask
+        # несвязанные пешки ходят все сразу: сдвиг битборда на горизонталь вперёд или по диагонали
+        free_pawns = pawns & ~pinned
+        if color == 0:
+            single_pushes = (free_pawns >> 8) & empty
+            double_pushes = (single_pushes >> 8) & empty & DOUBLE_PUSH_RANKS[0]
+            pawn_sets = ((single_pushes & target_mask, 8), (double_pushes & target_mask, 16),
+                         (((free_pawns & NOT_FILE_A) >> 9) & target_enemies, 9),
+                         (((free_pawns & NOT_FILE_H) >> 7) & target_enemies, 7))
+        else:
+            single_pushes = (free_pawns << 8) & empty
+            double_pushes = (single_pushes << 8) & empty & DOUBLE_PUSH_RANKS[1]
+            pawn_sets = ((single_pushes & target_mask, -8), (double_pushes & target_mask, -16),
+                         (((free_pawns & NOT_FILE_A) << 7) & target_enemies, -7),
+                         (((free_pawns & NOT_FILE_H) << 9) & target_enemies, -9))
+        for targets, shift in pawn_sets:
+            if targets:
+                move_sets.append((-1, targets, shift))
+
+        pawn_attacks = PAWN_ATTACKS[color]
+        pinned_pawns = pawns & pinned
+        while pinned_pawns:  # связанная пешка может ходить только вдоль линии связки
+            bit = pinned_pawns & -pinned_pawns
+            pinned_pawns ^= bit
+            square = bit.bit_length() - 1
+            one = (bit >> 8) if color == 0 else (bit << 8)
+            targets = 0
+            if one & empty:
+                targets = one
+                two = (one >> 8) if color == 0 else (one << 8)
+                if two & empty & DOUBLE_PUSH_RANKS[color]:
+                    targets |= two
+            targets = (targets | (pawn_attacks[square] & enemies)) & target_mask & line[square]
+            if targets:
+                move_sets.append((square, targets, 0))
+
+        if self.enpassant_possible:
+            enpassant_square = self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+            enpassant_bit = 1 << enpassant_square
+            # пешки, которые могут взять на проходе - те, которых "била бы" пешка противника с этой клетки
+            candidates = PAWN_ATTACKS[not color][enpassant_square] & pawns
+            while candidates:
+                bit = candidates & -candidates
+                candidates ^= bit
+                square = bit.bit_length() - 1
+                if bit & pinned and not enpassant_bit & line[square]:
+                    continue
+                captured = 1 << ((square & ~7) + self.enpassant_possible[1])
+                # взятие на проходе допустимо, если закрывает шах или съедает шахующую пешку
+                if (enpassant_bit | captured) & target_mask and self.enpassantIsLegal(
+                        them, king, occupied ^ bit ^ captured ^ enpassant_bit):
+                    special_moves.append((square, enpassant_square, True))
+
+    def enpassantIsLegal(self, them, king, occupied):
+        """
+        После взятия на проходе с доски уходят сразу две пешки - проверяем, не открылся ли король
+        """
+        bitboards = self.bitboards
+        queens = bitboards[them + QUEEN]
+        return not ((rookAttacks(king, occupied) & (bitboards[them + ROOK] | queens))
+                    or (bishopAttacks(king, occupied) & (bitboards[them + BISHOP] | queens)))
+
+    def generateCastleMoves(self, color, king, occupied, special_moves):
+        for side in CASTLING_SIDES[color]:
+            if not self.castling_rights & side:
+                continue
+            king_square, end_square, rook_square, must_be_empty, must_be_safe = CASTLING[side]
+            if king != king_square or not self.bitboards[6 * color + ROOK] & (1 << rook_square):
+                continue
+            if occupied & must_be_empty:
+                continue
+            if any(self.attackersTo(square, occupied, 6 - 6 * color) for square in must_be_safe):
+                continue
+            special_moves.append((king, end_square, False))
@@ -2,10 +2,133 @@
 Хранение всей информации о текущем статусе игры
 Определение возможных ходов
 """
+import random
+import struct
+
+from . import ChessEvaluation
+from .ChessEvaluation import PST_MG, PST_EG, PHASE
+
+# направления лучей: первые 4 - по вертикали и горизонтали, последние 4 - по диагонали
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def _buildRays():
+    """
+    Для каждой клетки и каждого направления - клетки луча до края доски
+    """
+    rays = [[None] * 8 for _ in range(8)]
+    for row in range(8):
+        for col in range(8):
+            square_rays = []
+            for d_row, d_col in DIRECTIONS:
+                ray = []
+                end_row, end_col = row + d_row, col + d_col
+                while 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                    ray.append((end_row, end_col))
+                    end_row, end_col = end_row + d_row, end_col + d_col
+                square_rays.append(tuple(ray))
+            rays[row][col] = tuple(square_rays)
+    return rays
+
+
+def _buildJumps(offsets):
+    """
+    Для каждой клетки - клетки, на которые можно попасть прыжком (конь, король)
+    """
+    return [[tuple((row + d_row, col + d_col) for d_row, d_col in offsets
+                   if 0 <= row + d_row <= 7 and 0 <= col + d_col <= 7) for col in range(8)] for row in range(8)]
+
+
+RAYS = _buildRays()
+KNIGHT_SQUARES = _buildJumps(KNIGHT_OFFSETS)
+KING_SQUARES = _buildJumps(KING_OFFSETS)
+
+
+def _buildZobristKeys():
+    """
+    Случайные 64-битные числа для хеша позиции (Zobrist): по одному на каждую фигуру на каждой клетке,
+    на ход черных, на каждый набор прав рокировки и на вертикаль взятия на проходе.
+    Seed фиксирован, чтобы ключи совпадали между запусками и процессами
+    """
+    rng = random.Random(2023)
+    pieces = {color + piece: [[rng.getrandbits(64) for _ in range(8)] for _ in range(8)]
+              for color in "wb" for piece in "pNBRQK"}
+    black_to_move = rng.getrandbits(64)
+    castling = [rng.getrandbits(64) for _ in range(16)]
+    enpassant = [rng.getrandbits(64) for _ in range(8)]
+    return pieces, black_to_move, castling, enpassant
+
+
+ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE, ZOBRIST_CASTLING, ZOBRIST_ENPASSANT = _buildZobristKeys()
+
+# Упакованный ход - одно целое число вместо объекта Move:
+# откуда (6 бит) | куда (6) | флаги (4) | ходившая фигура (4) | взятая фигура (4).
+# Клетка - row * 8 + col, фигура - индекс в PIECES (0 - пустая клетка)
+PIECES = ("--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+PIECE_CODES = {piece: i for i, piece in enumerate(PIECES)}
+TO_SHIFT, FLAGS_SHIFT, MOVED_SHIFT, CAPTURED_SHIFT = 6, 12, 16, 20
+# флаги: взятие на проходе, рокировка, превращение (PROMOTION_FLAG + индекс фигуры в Move.promotion_choices)
+ENPASSANT_FLAG, CASTLE_FLAG, PROMOTION_FLAG = 1, 2, 4
+# стоимость фигур для размена (see) по коду фигуры; король дороже всего - им бьют последним
+SEE_PIECE_VALUES = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 20000}
+SEE_VALUES = tuple(SEE_PIECE_VALUES[piece[1]] if piece != "--" else 0 for piece in PIECES)
+# виды ходов для поэтапной генерации: взятия и превращения, тихие ходы (включая рокировку)
+TACTICAL_MOVES, QUIET_MOVES = 1, 2
+ALL_MOVES = TACTICAL_MOVES | QUIET_MOVES
+
+# права рокировки - 4 бита одного числа (это же индекс в ZOBRIST_CASTLING)
+WHITE_KINGSIDE, BLACK_KINGSIDE, WHITE_QUEENSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+ALL_CASTLING = 15
+# какие права остаются после хода с клетки или на клетку: король или ладья ушли со своего места, ладью взяли
+CASTLING_MASKS = [ALL_CASTLING] * 64
+CASTLING_MASKS[60] ^= WHITE_KINGSIDE | WHITE_QUEENSIDE
+CASTLING_MASKS[63] ^= WHITE_KINGSIDE
+CASTLING_MASKS[56] ^= WHITE_QUEENSIDE
+CASTLING_MASKS[4] ^= BLACK_KINGSIDE | BLACK_QUEENSIDE
+CASTLING_MASKS[7] ^= BLACK_KINGSIDE
+CASTLING_MASKS[0] ^= BLACK_QUEENSIDE
+# где стоят король и ладья, пока право рокировки не потеряно: (строка, столбец, фигура)
+CASTLING_PIECES = {WHITE_KINGSIDE: ((7, 4, "wK"), (7, 7, "wR")), WHITE_QUEENSIDE: ((7, 4, "wK"), (7, 0, "wR")),
+                   BLACK_KINGSIDE: ((0, 4, "bK"), (0, 7, "bR")), BLACK_QUEENSIDE: ((0, 4, "bK"), (0, 0, "bR"))}
+
+# стек отмены: запись на каждый сделанный полуход, в ней состояние до хода:
+# ход, взятие на проходе, права рокировки, счётчик полуходов, хеш, оценка (миттельшпиль, эндшпиль, стадия).
+# Записи создаются заранее и переиспользуются, стек растёт только удвоением
+UNDO_MOVE, UNDO_ENPASSANT, UNDO_CASTLING, UNDO_HALFMOVE, UNDO_KEY, UNDO_MG, UNDO_EG, UNDO_PHASE = range(8)
+UNDO_RECORD_SIZE = 8
+UNDO_STACK_SIZE = 64  # начальный размер - хватает на поиск; дольше партия - стек удваивается
+
+# снимок позиции (GameState.snapshot): код фигуры на каждую клетку, ход белых (бит 0) и права рокировки (биты 1-4),
+# клетка взятия на проходе (NO_SQUARE - нет), клетки королей, счётчики ходов, хеш, оценка и стадия игры
+SNAPSHOT = struct.Struct("<64sBBBBHHQhhB")
+SNAPSHOT_SIZE = SNAPSHOT.size
+NO_SQUARE = 64
+
+
+def encodeMove(start_row, start_col, end_row, end_col, board, flags=0):
+    """
+    Упакованный ход, фигуры берутся с доски до хода
+    """
+    return (start_row * 8 + start_col | (end_row * 8 + end_col) << TO_SHIFT | flags << FLAGS_SHIFT
+            | PIECE_CODES[board[start_row][start_col]] << MOVED_SHIFT
+            | PIECE_CODES[board[end_row][end_col]] << CAPTURED_SHIFT)
 
 
 class GameState:
-    def __init__(self):
+    def __new__(cls, backend="array"):
+        """
+        backend - представление доски и генератор ходов: "array" (двумерный массив) или "bitboard" (битборды)
+        """
+        if backend == "bitboard" and cls is GameState:
+            from . import ChessBitboard
+            cls = ChessBitboard.BitboardGameState
+        elif backend not in ("array", "bitboard"):
+            raise ValueError("Неизвестный backend: " + str(backend))
+        return super().__new__(cls)
+
+    def __init__(self, backend="array"):
         """
         Доска - 8 на 8 двумерный массив, каждый элемент в котором состоит из двух букв.
         Первая буква отвечает за цвет, где b - black, w - white.
@@ -25,144 +148,551 @@ class GameState:
         self.moveFunctions = {"p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves,
                               "B": self.getBishopMoves, "Q": self.getQueenMoves, "K": self.getKingMoves}
         self.white_to_move = True # флаг, отвечающий за цвет текущего хода
-        self.move_log = [] # сюда записываем ходы
+        self.undo_stack = [[0] * UNDO_RECORD_SIZE for _ in range(UNDO_STACK_SIZE)] # см. UNDO_RECORD_SIZE
+        self.ply = 0 # сколько записей стека отмены занято - полуходов, сделанных с начала партии
         self.white_king_location = (7, 4) # локация белого короля
         self.black_king_location = (0, 4) # локация черного короля
         self.checkmate = False # мат
         self.stalemate = False # пат
+        self.threefold_repetition = False # ничья: позиция повторилась трижды
+        self.fifty_move_rule = False # ничья: 50 ходов без взятий и ходов пешкой
         self.in_check = False # шах
         self.pins = [] # связки
         self.checks = [] # шахи
+        self.move_kinds = ALL_MOVES # какие ходы добавляют функции фигур (TACTICAL_MOVES, QUIET_MOVES)
         self.enpassant_possible = ()  # координаты, где enpassant (взятие на проходе) возможен
-        self.enpassant_possible_log = [self.enpassant_possible] # лог координат
-        self.current_castling_rights = CastleRights(True, True, True, True) # права на рокировку
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)] # лог рокировок
+        self.castling_rights = ALL_CASTLING # права на рокировку, биты WHITE_KINGSIDE и т.д.
+        self.halfmove_clock = 0  # полуходы с последнего взятия или хода пешкой (правило 50 ходов)
+        self.fullmove_number = 1  # номер хода, увеличивается после хода черных
+        self.zobrist_key = self.computeZobristKey() # хеш позиции
+        # оценка: суммы таблиц полей миттельшпиля и эндшпиля (с точки зрения белых) и стадия игры
+        self.mg_score, self.eg_score, self.phase = ChessEvaluation.computeEvaluation(self.board)
+        self.move_cache = None  # необязательный кеш легальных ходов по хешу позиции (ChessMoveCache.MoveCache)
+        self.backend = backend
+
+    def syncState(self):
+        """
+        Пересчёт производных данных после прямого изменения board (например, при загрузке позиции)
+        """
+        for row in range(8):
+            for col in range(8):
+                if self.board[row][col] == "wK":
+                    self.white_king_location = (row, col)
+                elif self.board[row][col] == "bK":
+                    self.black_king_location = (row, col)
+        self.zobrist_key = self.computeZobristKey()
+        self.mg_score, self.eg_score, self.phase = ChessEvaluation.computeEvaluation(self.board)
+
+    @property
+    def move_log(self):
+        """
+        Сделанные ходы упакованными числами (см. encodeMove) - собираются из стека отмены при обращении
+        """
+        return [self.undo_stack[i][UNDO_MOVE] for i in range(self.ply)]
+
+    def lastMove(self):
+        """
+        Последний сделанный ход упакованным числом или None
+        """
+        return self.undo_stack[self.ply - 1][UNDO_MOVE] if self.ply else None
+
+    @classmethod
+    def from_fen(cls, fen, backend="array"):
+        """
+        Статус игры из строки FEN
+        """
+        game_state = cls(backend)
+        game_state.loadFen(fen)
+        return game_state
+
+    def loadFen(self, fen):
+        """
+        Расставляет позицию из строки FEN, история ходов при этом очищается.
+        Счётчики полуходов и ходов необязательны (как в EPD). Любое некорректное поле - ValueError.
+        Права рокировки без короля или ладьи на своём месте отбрасываются
+        """
+        fields = fen.split()
+        if not 4 <= len(fields) <= 6 or fields[1] not in ("w", "b"):
+            raise ValueError("Некорректный FEN: " + fen)
+        board = []
+        for rank in fields[0].split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char.upper() in "PNBRQK":
+                    color = "w" if char.isupper() else "b"
+                    piece = char.upper() if char.upper() != "P" else "p"
+                    row.append(color + piece)
+                else:
+                    raise ValueError("Некорректный FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("Некорректный FEN: " + fen)
+            board.append(row)
+        if len(board) != 8 or sum(row.count("wK") for row in board) != 1 or sum(
+                row.count("bK") for row in board) != 1:
+            raise ValueError("Некорректный FEN: " + fen)
+
+        white_to_move = fields[1] == "w"
+        castling = fields[2]
+        if castling != "-" and (len(set(castling)) != len(castling) or not set(castling) <= set("KQkq")):
+            raise ValueError("Некорректный FEN: " + fen)
+        castling_rights = 0
+        for char, right in (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE), ("k", BLACK_KINGSIDE),
+                            ("q", BLACK_QUEENSIDE)):
+            if char in castling and all(board[row][col] == piece for row, col, piece in CASTLING_PIECES[right]):
+                castling_rights |= right
+        # поле взятия на проходе - за пешкой соперника, только что пошедшей на два поля: 6-я или 3-я горизонталь
+        enpassant = fields[3]
+        if enpassant == "-":
+            enpassant_possible = ()
+        elif (len(enpassant) == 2 and enpassant[0] in Move.files_to_cols
+              and enpassant[1] == ("6" if white_to_move else "3")):
+            enpassant_possible = (Move.ranks_to_rows[enpassant[1]], Move.files_to_cols[enpassant[0]])
+        else:
+            raise ValueError("Некорректный FEN: " + fen)
+        if any(not (field.isascii() and field.isdigit()) for field in fields[4:]):
+            raise ValueError("Некорректный FEN: " + fen)
+
+        self.board = board
+        self.white_to_move = white_to_move
+        self.castling_rights = castling_rights
+        self.enpassant_possible = enpassant_possible
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        self.ply = 0
+        self.checkmate = self.stalemate = self.in_check = False
+        self.threefold_repetition = self.fifty_move_rule = False
+        self.syncState()
+
+    def to_fen(self):
+        """
+        Текущая позиция строкой FEN
+        """
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1].upper() if piece[0] == "w" else piece[1].lower()
+            ranks.append(rank + (str(empty) if empty else ""))
+        castling = "".join(char for char, right in (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE),
+                                                    ("k", BLACK_KINGSIDE), ("q", BLACK_QUEENSIDE))
+                           if self.castling_rights & right)
+        if self.enpassant_possible:
+            enpassant = Move.cols_to_files[self.enpassant_possible[1]] + Move.rows_to_ranks[self.enpassant_possible[0]]
+        else:
+            enpassant = "-"
+        return " ".join(("/".join(ranks), "w" if self.white_to_move else "b", castling or "-", enpassant,
+                         str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def snapshot(self):
+        """
+        Позиция целиком в SNAPSHOT_SIZE байтах, без истории ходов - для передачи в другие процессы
+        """
+        buffer = bytearray(SNAPSHOT_SIZE)
+        self.snapshotInto(buffer)
+        return bytes(buffer)
+
+    def snapshotInto(self, buffer, offset=0):
+        """
+        Снимок позиции прямо в буфер (bytearray, memoryview общей памяти) начиная с offset
+        """
+        board = bytes([PIECE_CODES[piece] for row in self.board for piece in row])
+        enpassant = self.enpassant_possible[0] * 8 + self.enpassant_possible[1] if self.enpassant_possible else NO_SQUARE
+        white_king = self.white_king_location[0] * 8 + self.white_king_location[1]
+        black_king = self.black_king_location[0] * 8 + self.black_king_location[1]
+        SNAPSHOT.pack_into(buffer, offset, board, self.white_to_move | self.castling_rights << 1, enpassant,
+                           white_king, black_king, self.halfmove_clock, self.fullmove_number, self.zobrist_key,
+                           self.mg_score, self.eg_score, self.phase)
+
+    def restore(self, data, offset=0):
+        """
+        Позиция из снимка snapshot(). data - bytes, bytearray или memoryview (например, общая память с пачкой
+        снимков подряд): снимок читается с offset без копирования буфера. История ходов очищается
+        """
+        (board, flags, enpassant, white_king, black_king, self.halfmove_clock, self.fullmove_number,
+         self.zobrist_key, self.mg_score, self.eg_score, self.phase) = SNAPSHOT.unpack_from(data, offset)
+        for row in range(8):
+            self.board[row][:] = [PIECES[code] for code in board[row * 8:row * 8 + 8]]
+        self.white_to_move = bool(flags & 1)
+        self.castling_rights = flags >> 1
+        self.enpassant_possible = (enpassant >> 3, enpassant & 7) if enpassant != NO_SQUARE else ()
+        self.white_king_location = (white_king >> 3, white_king & 7)
+        self.black_king_location = (black_king >> 3, black_king & 7)
+        self.ply = 0
+        self.checkmate = self.stalemate = self.in_check = False
+        self.threefold_repetition = self.fifty_move_rule = False
+
+    @classmethod
+    def from_snapshot(cls, data, backend="array", offset=0):
+        """
+        Статус игры из снимка snapshot()
+        """
+        game_state = cls(backend)
+        game_state.restore(data, offset)
+        return game_state
+
+    def __reduce__(self):
+        """
+        pickle передаёт только снимок позиции, без связанных методов moveFunctions и стека отмены
+        """
+        return type(self).from_snapshot, (self.snapshot(), self.backend)
+
+    def computeZobristKey(self):
+        """
+        Хеш позиции, посчитанный заново по всей доске
+        """
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][row][col]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ ZOBRIST_CASTLING[self.castling_rights] ^ self.enpassantKey()
+
+    def evaluate(self):
+        """
+        Оценка позиции с точки зрения стороны, которая ходит: материал и таблицы полей, смешанные по стадии игры.
+        Суммы обновляются в makeMove/undoMove, поэтому доска не просматривается
+        """
+        score = ChessEvaluation.taper(self.mg_score, self.eg_score, self.phase)
+        return score if self.white_to_move else -score
+
+    def checkEvaluation(self):
+        """
+        Совпадает ли инкрементальная оценка с полным пересчётом по доске
+        """
+        return (self.mg_score, self.eg_score, self.phase) == ChessEvaluation.computeEvaluation(self.board)
+
+    def enpassantKey(self):
+        """
+        Вклад взятия на проходе в хеш: учитывается, только если взять на проходе есть чем
+        """
+        if not self.enpassant_possible:
+            return 0
+        row, col = self.enpassant_possible
+        pawn = "wp" if self.white_to_move else "bp"
+        pawn_row = row + 1 if self.white_to_move else row - 1
+        if (col > 0 and self.board[pawn_row][col - 1] == pawn) or (col < 7 and self.board[pawn_row][col + 1] == pawn):
+            return ZOBRIST_ENPASSANT[col]
+        return 0
 
     def makeMove(self, move):
         """
-        Функция, отвечающая за ходы в игре
+        Функция, отвечающая за ходы в игре. move - объект Move или упакованный ход (int)
         """
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
-        self.move_log.append(move)  # запоминаем ход, чтобы была возможность позже отменить его
+        code = move if type(move) is int else move.code
+        start, end, flags = code & 63, code >> TO_SHIFT & 63, code >> FLAGS_SHIFT & 15
+        start_row, start_col, end_row, end_col = start >> 3, start & 7, end >> 3, end & 7
+        piece_moved = PIECES[code >> MOVED_SHIFT & 15]
+        piece_captured = PIECES[code >> CAPTURED_SHIFT & 15]
+        board = self.board
+
+        # запоминаем состояние до хода, чтобы была возможность позже отменить его
+        if self.ply == len(self.undo_stack):
+            self.undo_stack.extend([[0] * UNDO_RECORD_SIZE for _ in range(self.ply)])
+        record = self.undo_stack[self.ply]
+        record[UNDO_MOVE] = code
+        record[UNDO_ENPASSANT] = self.enpassant_possible
+        record[UNDO_CASTLING] = self.castling_rights
+        record[UNDO_HALFMOVE] = self.halfmove_clock
+        record[UNDO_KEY] = self.zobrist_key
+        record[UNDO_MG] = self.mg_score
+        record[UNDO_EG] = self.eg_score
+        record[UNDO_PHASE] = self.phase
+        self.ply += 1
+
+        # убираем из хеша старые права рокировки и взятие на проходе и фигуру с начальной клетки
+        key = self.zobrist_key ^ ZOBRIST_CASTLING[self.castling_rights] ^ self.enpassantKey()
+        key ^= ZOBRIST_PIECES[piece_moved][start_row][start_col]
+        # и из оценки тоже
+        mg = self.mg_score - PST_MG[piece_moved][start_row][start_col]
+        eg = self.eg_score - PST_EG[piece_moved][start_row][start_col]
+        phase = self.phase
+        if piece_captured != "--":
+            captured_row = start_row if flags == ENPASSANT_FLAG else end_row
+            key ^= ZOBRIST_PIECES[piece_captured][captured_row][end_col]
+            mg -= PST_MG[piece_captured][captured_row][end_col]
+            eg -= PST_EG[piece_captured][captured_row][end_col]
+            phase -= PHASE[piece_captured]
+
+        board[start_row][start_col] = "--"
+        board[end_row][end_col] = piece_moved
         self.white_to_move = not self.white_to_move  # смена хода
         # обновление локации короля, если она изменилась
-        if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+        if piece_moved == "wK":
+            self.white_king_location = (end_row, end_col)
+        elif piece_moved == "bK":
+            self.black_king_location = (end_row, end_col)
 
-        # превращение пешки (пока что только в ферзя)
-        if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+        # превращение пешки
+        if flags >= PROMOTION_FLAG:
+            board[end_row][end_col] = piece_moved[0] + Move.promotion_choices[flags - PROMOTION_FLAG]
 
         # enpassant
-        if move.is_enpassant_move:
-            self.board[move.start_row][move.end_col] = "--"  # съесть пешку
+        if flags == ENPASSANT_FLAG:
+            board[start_row][end_col] = "--"  # съесть пешку
 
         # обновление enpassant_possible
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:  # только если пешка прошла 2 клетки
-            self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+        if piece_moved[1] == "p" and abs(start_row - end_row) == 2:  # только если пешка прошла 2 клетки
+            self.enpassant_possible = ((start_row + end_row) // 2, start_col)
         else:
             self.enpassant_possible = ()
 
         # рокировка (castling)
-        if move.is_castle_move:
-            if move.end_col - move.start_col == 2:  # сторона короля
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][
-                    move.end_col + 1]  # перемещает ладью на новую клетку
-                self.board[move.end_row][move.end_col + 1] = '--'  # удаляем ладью
+        if flags == CASTLE_FLAG:
+            if end_col - start_col == 2:  # сторона короля
+                board[end_row][end_col - 1] = board[end_row][end_col + 1]  # перемещает ладью на новую клетку
+                board[end_row][end_col + 1] = '--'  # удаляем ладью
+                rook_cols = (7, 5)
             else:  # сторона ферзя
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][
-                    move.end_col - 2]  # перемещает ладью на новую клетку
-                self.board[move.end_row][move.end_col - 2] = '--'  # удаляем ладью
+                board[end_row][end_col + 1] = board[end_row][end_col - 2]  # перемещает ладью на новую клетку
+                board[end_row][end_col - 2] = '--'  # удаляем ладью
+                rook_cols = (0, 3)
+            rook = piece_moved[0] + "R"
+            key ^= ZOBRIST_PIECES[rook][end_row][rook_cols[0]] ^ ZOBRIST_PIECES[rook][end_row][rook_cols[1]]
+            mg += PST_MG[rook][end_row][rook_cols[1]] - PST_MG[rook][end_row][rook_cols[0]]
+            eg += PST_EG[rook][end_row][rook_cols[1]] - PST_EG[rook][end_row][rook_cols[0]]
 
-        self.enpassant_possible_log.append(self.enpassant_possible)
+        # счётчики: правило 50 ходов сбрасывается взятием и ходом пешки
+        if piece_captured != "--" or piece_moved[1] == "p":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if piece_moved[0] == "b":
+            self.fullmove_number += 1
 
-        # обновление возможности рокировки, если это ход короля или ладьи
-        self.updateCastleRights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                   self.current_castling_rights.wqs, self.current_castling_rights.bqs))
+        # обновление возможности рокировки, если это ход короля или ладьи или взятие ладьи
+        self.castling_rights &= CASTLING_MASKS[start] & CASTLING_MASKS[end]
+
+        # добавляем в хеш фигуру на конечной клетке, смену хода и новые права рокировки и взятие на проходе
+        piece_placed = board[end_row][end_col]  # после превращения - новая фигура
+        key ^= ZOBRIST_PIECES[piece_placed][end_row][end_col]
+        key ^= ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CASTLING[self.castling_rights] ^ self.enpassantKey()
+        self.zobrist_key = key
+        self.mg_score = mg + PST_MG[piece_placed][end_row][end_col]
+        self.eg_score = eg + PST_EG[piece_placed][end_row][end_col]
+        self.phase = phase + PHASE[piece_placed] - PHASE[piece_moved]
 
     def undoMove(self):
         """
         Отмена последнего хода
         """
-        if len(self.move_log) != 0:  # удостоверимся, что есть ход, который можно отменить
-            move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+        if self.ply != 0:  # удостоверимся, что есть ход, который можно отменить
+            self.ply -= 1
+            (code, self.enpassant_possible, self.castling_rights, self.halfmove_clock, self.zobrist_key,
+             self.mg_score, self.eg_score, self.phase) = self.undo_stack[self.ply]
+            start, end, flags = code & 63, code >> TO_SHIFT & 63, code >> FLAGS_SHIFT & 15
+            start_row, start_col, end_row, end_col = start >> 3, start & 7, end >> 3, end & 7
+            piece_moved = PIECES[code >> MOVED_SHIFT & 15]
+            piece_captured = PIECES[code >> CAPTURED_SHIFT & 15]
+            board = self.board
+            board[start_row][start_col] = piece_moved
+            board[end_row][end_col] = piece_captured
             self.white_to_move = not self.white_to_move  # смена игроков
             #
-            if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+            if piece_moved == "wK":
+                self.white_king_location = (start_row, start_col)
+            elif piece_moved == "bK":
+                self.black_king_location = (start_row, start_col)
             # отмена enpassant
-            if move.is_enpassant_move:
-                self.board[move.end_row][move.end_col] = "--"
-                self.board[move.start_row][move.end_col] = move.piece_captured
-
-            self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1]
-
-            self.castle_rights_log.pop()  # убираем обновление статуса рокировки хода, который мы отменяем
-            self.current_castling_rights = self.castle_rights_log[
-                -1]  # возвращение статуса предыдущего хода
+            if flags == ENPASSANT_FLAG:
+                board[end_row][end_col] = "--"
+                board[start_row][end_col] = piece_captured
+            if piece_moved[0] == "b":
+                self.fullmove_number -= 1
             # отмена рокировки
-            if move.is_castle_move:
-                if move.end_col - move.start_col == 2:  # сторона короля
-                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 1]
-                    self.board[move.end_row][move.end_col - 1] = '--'
+            if flags == CASTLE_FLAG:
+                if end_col - start_col == 2:  # сторона короля
+                    board[end_row][end_col + 1] = board[end_row][end_col - 1]
+                    board[end_row][end_col - 1] = '--'
                 else:  # сторона ферзя
-                    self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
-                    self.board[move.end_row][move.end_col + 1] = '--'
+                    board[end_row][end_col - 2] = board[end_row][end_col + 1]
+                    board[end_row][end_col + 1] = '--'
             self.checkmate = False
             self.stalemate = False
+            self.threefold_repetition = False
+            self.fifty_move_rule = False
 
-    def updateCastleRights(self, move):
-        """
-        Обновление статуса возможности рокировки
-        """
-        if move.piece_captured == "wR":
-            if move.end_col == 0:  # левая лаья
-                self.current_castling_rights.wqs = False
-            elif move.end_col == 7:  # правая ладья
-                self.current_castling_rights.wks = False
-        elif move.piece_captured == "bR":
-            if move.end_col == 0:  # левая ладья
-                self.current_castling_rights.bqs = False
-            elif move.end_col == 7:  # правая ладья
-                self.current_castling_rights.bks = False
-
-        if move.piece_moved == 'wK':
-            self.current_castling_rights.wqs = False
-            self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_rights.bqs = False
-            self.current_castling_rights.bks = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # левая ладья
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7:  # правая ладья
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # левая ладья
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7:  # правая ладья
-                    self.current_castling_rights.bks = False
+    def perft(self, depth):
+        """
+        Количество позиций, достижимых из текущей за depth полуходов
+        """
+        if depth == 0:
+            return 1
+        if depth == 1:
+            return self.countValidMoves()
+        moves = self.getValidMoveCodes()
+        nodes = 0
+        for move in moves:
+            self.makeMove(move)
+            nodes += self.perft(depth - 1)
+            self.undoMove()
+        return nodes
 
     def getValidMoves(self):
         """
-        Все ходы учитывая шах
+        Все ходы учитывая шах, объектами Move - для интерфейса и отображения.
+        С кешем (move_cache) возвращается неизменяемый кортеж, общий для всех обращений к позиции
+        """
+        if self.move_cache is None:
+            return [Move.fromCode(code) for code in self.getValidMoveCodes()]
+        entry = self.cachedMoves()
+        self.updateDrawFlags()
+        if entry[2] is None:
+            entry[2] = tuple(Move.fromCode(code) for code in entry[0])
+        return entry[2]
+
+    def getValidMoveCodes(self):
+        """
+        Все ходы учитывая шах, упакованными числами (см. encodeMove). С кешем - кортеж
+        """
+        moves = self.generateValidMoveCodes() if self.move_cache is None else self.cachedMoves()[0]
+        self.updateDrawFlags()
+        return moves
+
+    def updateDrawFlags(self):
+        """
+        Ничьи по правилам: троекратное повторение и 50 ходов. Мат последним ходом важнее правила 50 ходов
+        """
+        self.threefold_repetition = self.isRepetition(3)
+        self.fifty_move_rule = self.halfmove_clock >= 100 and not self.checkmate
+
+    def isRepetition(self, times=3):
+        """
+        Встречалась ли текущая позиция times раз (считая её саму). Хеши просматриваются только до последнего
+        взятия или хода пешкой - раньше позиция повториться не могла - и через один, когда ходила та же сторона
+        """
+        undo_stack = self.undo_stack
+        key = self.zobrist_key
+        count = 1
+        for i in range(self.ply - 2, max(self.ply - self.halfmove_clock, 0) - 1, -2):
+            if undo_stack[i][UNDO_KEY] == key:
+                count += 1
+                if count >= times:
+                    return True
+        return False
+
+    def cachedMoves(self):
+        """
+        Запись кеша для текущей позиции: [ходы числами, шах, ходы объектами Move или None].
+        Позиции нет в кеше - генерируем ходы, есть - восстанавливаем флаги шаха, мата и пата
+        """
+        entry = self.move_cache.get(self.zobrist_key)
+        if entry is None:
+            entry = [tuple(self.generateValidMoveCodes()), self.in_check, None]
+            self.move_cache.put(self.zobrist_key, entry)
+        else:
+            self.in_check = entry[1]
+            self.checkmate = not entry[0] and entry[1]
+            self.stalemate = not entry[0] and not entry[1]
+        return entry
+
+    def generateValidMoveCodes(self):
+        """
+        Генерация всех ходов учитывая шах, без кеша
+        """
+        self.in_check, pins, checks = self.checkForPinsAndChecks()
+        moves = self.legalMoveCodes(pins, checks, ALL_MOVES)
+        self.updateGameOver(len(moves))
+        return moves
+
+    def generateMoveStages(self):
+        """
+        Генератор двух порций легальных ходов без кеша: взятия и превращения, потом тихие ходы.
+        Связки и шахи считаются один раз, тихие ходы - только если генератор продолжат
+        """
+        self.in_check, pins, checks = self.checkForPinsAndChecks()
+        tactical = self.legalMoveCodes(pins, checks, TACTICAL_MOVES)
+        yield tactical
+        quiet = self.legalMoveCodes(pins, checks, QUIET_MOVES)
+        self.updateGameOver(len(tactical) + len(quiet))
+        yield quiet
+
+    def moveStages(self):
+        """
+        Порции ходов (см. generateMoveStages); с кешем - готовый список ходов позиции, разделённый на порции
+        """
+        if self.move_cache is None:
+            return self.generateMoveStages()
+        tactical = []
+        quiet = []
+        for code in self.cachedMoves()[0]:
+            if code >> CAPTURED_SHIFT & 15 or code >> FLAGS_SHIFT & 15 >= PROMOTION_FLAG:
+                tactical.append(code)
+            else:
+                quiet.append(code)
+        return iter((tactical, quiet))
+
+    def stagedMoves(self, hash_move=0, killers=(), key=None):
+        """
+        Легальные ходы по очереди: ход из таблицы транспозиций, взятия и превращения, киллеры, остальные тихие ходы
+        и в конце взятия с отрицательным key (проигрывающие размены). Каждая порция генерируется, только когда
+        до неё дошла очередь - после отсечения на ходе из таблицы или на взятии генератор просто бросают.
+        key(ход) - порядок внутри порции, по убыванию
+        """
+        if hash_move and self.moveMatchesBoard(hash_move):
+            yield hash_move
+        stages = self.moveStages()
+        tactical = next(stages)
+        losing = []
+        if key is not None:
+            for score, move in sorted([(key(move), move) for move in tactical], reverse=True):
+                if score < 0:
+                    losing.append(move)
+                elif move != hash_move:
+                    yield move
+        else:
+            for move in tactical:
+                if move != hash_move:
+                    yield move
+        quiet = next(stages)
+        for killer in killers:
+            if killer and killer != hash_move and killer in quiet:
+                yield killer
+        for move in sorted(quiet, key=key, reverse=True) if key is not None else quiet:
+            if move != hash_move and move not in killers:
+                yield move
+        for move in losing:
+            if move != hash_move:
+                yield move
+
+    def moveMatchesBoard(self, code):
+        """
+        Стоят ли на доске фигуры, записанные в упакованном ходе, и ходит ли сторона, чья это фигура.
+        Для хода из таблицы транспозиций этого хватает: ключ там хранится целиком, ход записан в этой же позиции
+        """
+        start, end, flags = code & 63, code >> TO_SHIFT & 63, code >> FLAGS_SHIFT & 15
+        piece_moved = PIECES[code >> MOVED_SHIFT & 15]
+        if piece_moved == "--" or (piece_moved[0] == "w") != self.white_to_move:
+            return False
+        if self.board[start >> 3][start & 7] != piece_moved:
+            return False
+        if flags == ENPASSANT_FLAG:
+            return (end >> 3, end & 7) == self.enpassant_possible
+        return self.board[end >> 3][end & 7] == PIECES[code >> CAPTURED_SHIFT & 15]
+
+    def updateGameOver(self, move_count):
+        self.checkmate = move_count == 0 and self.in_check
+        self.stalemate = move_count == 0 and not self.in_check
+
+    def legalMoveCodes(self, pins, checks, kinds):
+        """
+        Легальные ходы вида kinds (TACTICAL_MOVES, QUIET_MOVES или ALL_MOVES) при уже найденных связках и шахах
         """
-        temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                          self.current_castling_rights.wqs, self.current_castling_rights.bqs)
         moves = []
-        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        self.pins = list(pins)  # функции фигур убирают из списка обработанные связки
+        self.checks = checks
+        self.move_kinds = kinds
 
         if self.white_to_move:
             king_row = self.white_king_location[0]
@@ -170,52 +700,111 @@ class GameState:
         else:
             king_row = self.black_king_location[0]
             king_col = self.black_king_location[1]
-        if self.in_check:
-            if len(self.checks) == 1:  # только 1 шах, блокировка или избегание
-                moves = self.getAllPossibleMoves()
-                # чтобы заблокировать шах, нужно поместить фигуру между ними
-                check = self.checks[0]  # информация по шахам
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = []  # squares that pieces can move to
-                # если конь, то его нужно съесть либо увести фигуру
-                if piece_checking[1] == "N":
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i,
-                                        king_col + check[3] * i)  # check[2] и check[3] направление шаха
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[
-                            1] == check_col: # когда ты доходишь до фигуры и ставишь шах
-                            break
-                # избавляемся от всех ходов, что не убирают шах
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].piece_moved[1] != "K":  # если ходит не король, то это либо блок, либо съесть фигуру, которая ставит шах
-                        if not (moves[i].end_row,
-                                moves[i].end_col) in valid_squares:  # ход не блокирует или ест фигуру
-                            moves.remove(moves[i])
+        if checks:
+            if len(self.checks) == 1:  # только 1 шах: уйти королём, съесть шахующую фигуру или закрыться
+                self.getKingMoves(king_row, king_col, moves)
+                self.getEvasionMoves(king_row, king_col, self.checks[0], moves)
             else:  # двойная проверка, король должен ходить
                 self.getKingMoves(king_row, king_col, moves)
         else:  # нет шаха - все ходы в порядке
             moves = self.getAllPossibleMoves()
-            if self.white_to_move:
-                self.getCastleMoves(self.white_king_location[0], self.white_king_location[1], moves)
-            else:
-                self.getCastleMoves(self.black_king_location[0], self.black_king_location[1], moves)
+            if kinds & QUIET_MOVES:
+                self.getCastleMoves(king_row, king_col, moves)
+        self.move_kinds = ALL_MOVES
+        return moves
 
-        if len(moves) == 0:
-            if self.inCheck():
-                self.checkmate = True
-            else:
-                self.stalemate = True
+    def getEvasionMoves(self, king_row, king_col, check, moves):
+        """
+        Ходы не королём при одиночном шахе: взятие шахующей фигуры и перекрытие луча шаха.
+        Создаются сразу только эти ходы - от клеток-целей ищутся фигуры, которые на них ходят
+        """
+        check_row, check_col, d_row, d_col = check  # для дальнобойной фигуры d_row, d_col - направление от короля
+        # связанная фигура шах не снимает: уйдя с линии связки, она откроет короля
+        pinned = {(pin[0], pin[1]) for pin in self.pins}
+        self.addMovesTo(check_row, check_col, pinned, moves)
+        if self.board[check_row][check_col][1] not in ("N", "p"):
+            row, col = king_row + d_row, king_col + d_col
+            while row != check_row or col != check_col:
+                self.addMovesTo(row, col, pinned, moves)
+                row += d_row
+                col += d_col
+        if self.enpassant_possible != () and self.move_kinds & TACTICAL_MOVES:
+            self.addEvasionEnpassantMoves(king_row, king_col, pinned, moves)
+
+    def addMovesTo(self, row, col, pinned, moves):
+        """
+        Ходы несвязанных фигур, кроме короля, на клетку (row, col): взятие, если там фигура противника,
+        иначе ход на пустую клетку. Фигуры ищутся из клетки в обратную сторону, как в isSquareAttacked
+        """
+        board = self.board
+        ally_color = "w" if self.white_to_move else "b"
+        move_amount = -1 if self.white_to_move else 1
+        pawn = ally_color + "p"
+        pawn_row = row - move_amount  # откуда пешка приходит на эту клетку
+        capture = board[row][col] != "--"
+        if capture:
+            if not self.move_kinds & TACTICAL_MOVES:
+                return
+            if 0 <= pawn_row <= 7:
+                for pawn_col in (col - 1, col + 1):
+                    if 0 <= pawn_col <= 7 and board[pawn_row][pawn_col] == pawn and (pawn_row, pawn_col) not in pinned:
+                        self.addPawnMove((pawn_row, pawn_col), (row, col), moves)
         else:
-            self.checkmate = False
-            self.stalemate = False
+            # ход пешкой на последнюю горизонталь - превращение, в одной порции со взятиями
+            if 0 <= pawn_row <= 7 and self.move_kinds & (TACTICAL_MOVES if row in (0, 7) else QUIET_MOVES):
+                if board[pawn_row][col] == pawn:
+                    if (pawn_row, col) not in pinned:
+                        self.addPawnMove((pawn_row, col), (row, col), moves)
+                elif board[pawn_row][col] == "--" and pawn_row == (5 if self.white_to_move else 2):
+                    start_row = pawn_row - move_amount  # ход на 2 клетки с начальной горизонтали
+                    if board[start_row][col] == pawn and (start_row, col) not in pinned:
+                        moves.append(encodeMove(start_row, col, row, col, board))
+            if not self.move_kinds & QUIET_MOVES:
+                return
+        knight = ally_color + "N"
+        for start_row, start_col in KNIGHT_SQUARES[row][col]:
+            if board[start_row][start_col] == knight and (start_row, start_col) not in pinned:
+                moves.append(encodeMove(start_row, start_col, row, col, board))
+        square_rays = RAYS[row][col]
+        for j in range(8):
+            slider = "R" if j < 4 else "B"
+            for start_row, start_col in square_rays[j]:
+                piece = board[start_row][start_col]
+                if piece != "--":
+                    if piece[0] == ally_color and (piece[1] == slider or piece[1] == "Q") and (
+                            start_row, start_col) not in pinned:
+                        moves.append(encodeMove(start_row, start_col, row, col, board))
+                    break
 
-        self.current_castling_rights = temp_castle_rights
-        return moves
+    def addEvasionEnpassantMoves(self, king_row, king_col, pinned, moves):
+        """
+        Взятие на проходе под шахом: снимает шах, если шах ставит взятая пешка или клетка взятия закрывает луч.
+        Проверяем прямо на доске - переставляем пешки, смотрим, атакован ли король, и возвращаем как было
+        """
+        board = self.board
+        ep_row, ep_col = self.enpassant_possible
+        move_amount = -1 if self.white_to_move else 1
+        pawn = "wp" if self.white_to_move else "bp"
+        enemy_color = "b" if self.white_to_move else "w"
+        pawn_row = ep_row - move_amount
+        captured = board[pawn_row][ep_col]
+        for pawn_col in (ep_col - 1, ep_col + 1):
+            if 0 <= pawn_col <= 7 and board[pawn_row][pawn_col] == pawn and (pawn_row, pawn_col) not in pinned:
+                board[pawn_row][pawn_col] = board[pawn_row][ep_col] = "--"
+                board[ep_row][ep_col] = pawn
+                legal = not self.isSquareAttacked(king_row, king_col, enemy_color)
+                board[ep_row][ep_col] = "--"
+                board[pawn_row][pawn_col] = pawn
+                board[pawn_row][ep_col] = captured
+                if legal:
+                    moves.append(encodeMove(pawn_row, pawn_col, ep_row, ep_col, board, ENPASSANT_FLAG)
+                                 | PIECE_CODES[enemy_color + "p"] << CAPTURED_SHIFT)
+
+    def countValidMoves(self):
+        """
+        Количество легальных ходов (листья perft)
+        """
+        return len(self.getValidMoveCodes())
 
     def inCheck(self):
         """
@@ -230,17 +819,111 @@ class GameState:
         """
         Проверка на то, может ли атаковать эту клетку противник
         """
-        self.white_to_move = not self.white_to_move  # смена на pov противника
-        opponents_moves = self.getAllPossibleMoves()
-        self.white_to_move = not self.white_to_move
-        for move in opponents_moves:
-            if move.end_row == row and move.end_col == col:  # клетка под атакой
+        return self.isSquareAttacked(row, col, "b" if self.white_to_move else "w")
+
+    def isSquareAttacked(self, row, col, attacker_color):
+        """
+        Атакует ли клетку хоть одна фигура цвета attacker_color.
+        Смотрим из клетки в обратную сторону: лучи для дальнобойных фигур, прыжки коня и короля, пешки -
+        ходы при этом не создаются
+        """
+        board = self.board
+        # пешки: белая пешка бьёт вверх по доске, поэтому стоит на строку ниже атакуемой клетки
+        pawn_row = row + 1 if attacker_color == "w" else row - 1
+        if 0 <= pawn_row <= 7:
+            pawn = attacker_color + "p"
+            if (col > 0 and board[pawn_row][col - 1] == pawn) or (col < 7 and board[pawn_row][col + 1] == pawn):
                 return True
+        knight = attacker_color + "N"
+        for end_row, end_col in KNIGHT_SQUARES[row][col]:
+            if board[end_row][end_col] == knight:
+                return True
+        king = attacker_color + "K"
+        for end_row, end_col in KING_SQUARES[row][col]:
+            if board[end_row][end_col] == king:
+                return True
+        square_rays = RAYS[row][col]
+        for j in range(8):
+            # по вертикали и горизонтали бьют ладья и ферзь, по диагонали - слон и ферзь
+            slider = "R" if j < 4 else "B"
+            for end_row, end_col in square_rays[j]:
+                end_piece = board[end_row][end_col]
+                if end_piece != "--":
+                    if end_piece[0] == attacker_color and (end_piece[1] == slider or end_piece[1] == "Q"):
+                        return True
+                    break
         return False
 
+    def see(self, move):
+        """
+        Статическая оценка размена (static exchange evaluation): сколько выиграет сторона, которая ходит,
+        если после хода move обе стороны будут бить на его конечной клетке, начиная с самой дешёвой фигуры,
+        и каждая может остановиться. Фигуры за ладьёй, слоном или ферзём (рентген) вступают по очереди.
+        Ходы не делаются и не создаются - только обход доски. move - упакованный ход или Move
+        """
+        code = move if type(move) is int else move.code
+        start, end, flags = code & 63, code >> TO_SHIFT & 63, code >> FLAGS_SHIFT & 15
+        row, col = end >> 3, end & 7
+        board = self.board
+        gain = [SEE_VALUES[code >> CAPTURED_SHIFT & 15]]
+        on_square = SEE_VALUES[code >> MOVED_SHIFT & 15]  # фигура, которую можно побить следующей
+        if flags >= PROMOTION_FLAG:
+            on_square = SEE_PIECE_VALUES[Move.promotion_choices[flags - PROMOTION_FLAG]]
+            gain[0] += on_square - SEE_PIECE_VALUES["p"]
+        # клетки, которые после хода пусты: откуда пошла фигура и, при взятии на проходе, взятая пешка
+        vacated = (start >> 3, start & 7), (start >> 3, col) if flags == ENPASSANT_FLAG else None
+
+        # по каждому лучу от клетки - фигуры, которые бьют вдоль него по очереди, ближняя в конце списка
+        rays = []
+        for j in range(8):
+            slider = "R" if j < 4 else "B"
+            pawn = "wp" if j >= 6 else "bp" if j >= 4 else None  # пешка бьёт по диагонали вперёд
+            attackers = []
+            for i, (end_row, end_col) in enumerate(RAYS[row][col][j]):
+                piece = board[end_row][end_col]
+                if piece == "--" or (end_row, end_col) in vacated:
+                    continue
+                if piece[1] == slider or piece[1] == "Q" or (i == 0 and (piece[1] == "K" or piece == pawn)):
+                    attackers.append(piece)
+                else:
+                    break  # фигура, которая не бьёт вдоль луча, закрывает всё, что за ней
+            if attackers:
+                attackers.reverse()
+                rays.append(attackers)
+        knights = [board[end_row][end_col] for end_row, end_col in KNIGHT_SQUARES[row][col]
+                   if board[end_row][end_col][1] == "N" and (end_row, end_col) not in vacated]
+
+        color = "b" if self.white_to_move else "w"  # кто бьёт следующим
+        while True:
+            # самая дешёвая фигура этого цвета: ближние фигуры лучей и кони
+            best_value, best_ray = None, None
+            for ray in rays:
+                if ray and ray[-1][0] == color and (best_value is None or SEE_PIECE_VALUES[ray[-1][1]] < best_value):
+                    best_value, best_ray = SEE_PIECE_VALUES[ray[-1][1]], ray
+            knight = color + "N"
+            if knight in knights and (best_value is None or SEE_PIECE_VALUES["N"] < best_value):
+                best_value, best_ray = SEE_PIECE_VALUES["N"], None
+            if best_value is None:
+                break
+            if best_ray is not None:
+                best_ray.pop()
+            else:
+                knights.remove(knight)
+            if best_value == SEE_PIECE_VALUES["K"]:  # королём можно бить, только если клетку больше никто не бьёт
+                enemy = "w" if color == "b" else "b"
+                if any(ray and ray[-1][0] == enemy for ray in rays) or enemy + "N" in knights:
+                    break
+            gain.append(on_square - gain[-1])
+            on_square = best_value
+            color = "w" if color == "b" else "b"
+        # с конца: каждая сторона бьёт, только если это ей выгодно
+        for i in range(len(gain) - 1, 0, -1):
+            gain[i - 1] = -max(-gain[i - 1], gain[i])
+        return gain[0]
+
     def getAllPossibleMoves(self):
         """
-        Все ходы не учитывая шах
+        Все ходы не учитывая шах, упакованными числами
         """
         moves = []
         for row in range(len(self.board)):
@@ -342,14 +1025,20 @@ class GameState:
             king_row, king_col = self.black_king_location
 
         if self.board[row + move_amount][col] == "--":
-            if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((row, col), (row + move_amount, col), self.board))
-                if row == start_row and self.board[row + 2 * move_amount][col] == "--":
-                    moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
+            if not piece_pinned or pin_direction == (move_amount, 0) or pin_direction == (-move_amount, 0):
+                if row + move_amount in (0, 7):  # превращение - в одной порции со взятиями
+                    if self.move_kinds & TACTICAL_MOVES:
+                        self.addPawnMove((row, col), (row + move_amount, col), moves)
+                elif self.move_kinds & QUIET_MOVES:
+                    self.addPawnMove((row, col), (row + move_amount, col), moves)
+                    if row == start_row and self.board[row + 2 * move_amount][col] == "--":
+                        moves.append(encodeMove(row, col, row + 2 * move_amount, col, self.board))
+        if not self.move_kinds & TACTICAL_MOVES:
+            return  # дальше только взятия
         if col - 1 >= 0:  # съесть слева
             if not piece_pinned or pin_direction == (move_amount, -1):
                 if self.board[row + move_amount][col - 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board))
+                    self.addPawnMove((row, col), (row + move_amount, col - 1), moves)
                 if (row + move_amount, col - 1) == self.enpassant_possible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -368,14 +1057,17 @@ class GameState:
                             square = self.board[row][i]
                             if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
                                 attacking_piece = True
-                            elif square != "--":
+                                break
+                            elif square != "--":  # ближайшая к пешке фигура закрывает линию
                                 blocking_piece = True
+                                break
                     if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col - 1), self.board, is_enpassant_move=True))
+                        moves.append(encodeMove(row, col, row + move_amount, col - 1, self.board, ENPASSANT_FLAG)
+                                     | PIECE_CODES[enemy_color + "p"] << CAPTURED_SHIFT)
         if col + 1 <= 7:  # съесть справа
             if not piece_pinned or pin_direction == (move_amount, +1):
                 if self.board[row + move_amount][col + 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board))
+                    self.addPawnMove((row, col), (row + move_amount, col + 1), moves)
                 if (row + move_amount, col + 1) == self.enpassant_possible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -392,10 +1084,24 @@ class GameState:
                             square = self.board[row][i]
                             if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
                                 attacking_piece = True
-                            elif square != "--":
+                                break
+                            elif square != "--":  # ближайшая к пешке фигура закрывает линию
                                 blocking_piece = True
+                                break
                     if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col + 1), self.board, is_enpassant_move=True))
+                        moves.append(encodeMove(row, col, row + move_amount, col + 1, self.board, ENPASSANT_FLAG)
+                                     | PIECE_CODES[enemy_color + "p"] << CAPTURED_SHIFT)
+
+    def addPawnMove(self, start_square, end_square, moves):
+        """
+        Добавляет ход пешки, а на последней горизонтали - все варианты превращения
+        """
+        code = encodeMove(start_square[0], start_square[1], end_square[0], end_square[1], self.board)
+        if end_square[0] == 0 or end_square[0] == 7:
+            for i in range(len(Move.promotion_choices)):
+                moves.append(code | (PROMOTION_FLAG + i) << FLAGS_SHIFT)
+        else:
+            moves.append(code)
 
     def getRookMoves(self, row, col, moves):
         """
@@ -414,6 +1120,7 @@ class GameState:
 
         directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
         enemy_color = "b" if self.white_to_move else "w"
+        tactical, quiet = self.move_kinds & TACTICAL_MOVES, self.move_kinds & QUIET_MOVES
         for direction in directions:
             for i in range(1, 8):
                 end_row = row + direction[0] * i
@@ -423,9 +1130,11 @@ class GameState:
                             -direction[0], -direction[1]):
                         end_piece = self.board[end_row][end_col]
                         if end_piece == "--":  # пустая клетка считается "хорошей"
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            if quiet:
+                                moves.append(encodeMove(row, col, end_row, end_col, self.board))
                         elif end_piece[0] == enemy_color:  # съесть вражескую фигуру
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            if tactical:
+                                moves.append(encodeMove(row, col, end_row, end_col, self.board))
                             break
                         else:  # союзная фигура
                             break
@@ -452,8 +1161,10 @@ class GameState:
             if 0 <= end_row <= 7 and 0 <= end_col <= 7:
                 if not piece_pinned:
                     end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally_color:  # т.е. это либо пустая клетка, либо вражеская фигура
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
+                    # т.е. это либо пустая клетка, либо вражеская фигура - если такие ходы сейчас нужны
+                    if end_piece[0] != ally_color and self.move_kinds & (
+                            QUIET_MOVES if end_piece == "--" else TACTICAL_MOVES):
+                        moves.append(encodeMove(row, col, end_row, end_col, self.board))
 
     def getBishopMoves(self, row, col, moves):
         """
@@ -470,6 +1181,7 @@ class GameState:
 
         directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))
         enemy_color = "b" if self.white_to_move else "w"
+        tactical, quiet = self.move_kinds & TACTICAL_MOVES, self.move_kinds & QUIET_MOVES
         for direction in directions:
             for i in range(1, 8):
                 end_row = row + direction[0] * i
@@ -479,9 +1191,11 @@ class GameState:
                             -direction[0], -direction[1]):
                         end_piece = self.board[end_row][end_col]
                         if end_piece == "--":  # пустые клетки подходят
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            if quiet:
+                                moves.append(encodeMove(row, col, end_row, end_col, self.board))
                         elif end_piece[0] == enemy_color:  # съесть фигуру
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            if tactical:
+                                moves.append(encodeMove(row, col, end_row, end_col, self.board))
                             break
                         else:  # friendly piece
                             break
@@ -492,35 +1206,27 @@ class GameState:
         """
         Получение всех ходов ферзя
         """
+        self.getRookMoves(row, col, moves)  # ладья не снимает связку ферзя, её снимает getBishopMoves
         self.getBishopMoves(row, col, moves)
-        self.getRookMoves(row, col, moves)
 
     def getKingMoves(self, row, col, moves):
         """
         Получение всех ходов короля и добавление их в лист
         """
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally_color = "w" if self.white_to_move else "b"
-        for i in range(8):
-            end_row = row + row_moves[i]
-            end_col = col + col_moves[i]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:  # если не союзная фигура - пусто или враг
-                    # помещение короля и проверка на шах
-                    if ally_color == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.checkForPinsAndChecks()
-                    if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                    # возвращение короля в изначальную позицию
-                    if ally_color == "w":
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
+        enemy_color = "b" if self.white_to_move else "w"
+        king = self.board[row][col]
+        # убираем короля с доски, чтобы он не закрывал собой луч шахующей фигуры
+        self.board[row][col] = "--"
+        for end_row, end_col in KING_SQUARES[row][col]:
+            end_piece = self.board[end_row][end_col]
+            # если не союзная фигура - пусто или враг, и такие ходы сейчас нужны
+            if end_piece[0] != ally_color and self.move_kinds & (QUIET_MOVES if end_piece == "--" else TACTICAL_MOVES):
+                if not self.isSquareAttacked(end_row, end_col, enemy_color):
+                    self.board[row][col] = king
+                    moves.append(encodeMove(row, col, end_row, end_col, self.board))
+                    self.board[row][col] = "--"
+        self.board[row][col] = king
 
     def getCastleMoves(self, row, col, moves):
         """
@@ -528,30 +1234,20 @@ class GameState:
         """
         if self.squareUnderAttack(row, col):
             return  # если королю стоит шах, то рокировка невозможна
-        if (self.white_to_move and self.current_castling_rights.wks) or (
-                not self.white_to_move and self.current_castling_rights.bks):
+        if self.castling_rights & (WHITE_KINGSIDE if self.white_to_move else BLACK_KINGSIDE):
             self.getKingsideCastleMoves(row, col, moves)
-        if (self.white_to_move and self.current_castling_rights.wqs) or (
-                not self.white_to_move and self.current_castling_rights.bqs):
+        if self.castling_rights & (WHITE_QUEENSIDE if self.white_to_move else BLACK_QUEENSIDE):
             self.getQueensideCastleMoves(row, col, moves)
 
     def getKingsideCastleMoves(self, row, col, moves):
         if self.board[row][col + 1] == '--' and self.board[row][col + 2] == '--':
             if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
-                moves.append(Move((row, col), (row, col + 2), self.board, is_castle_move=True))
+                moves.append(encodeMove(row, col, row, col + 2, self.board, CASTLE_FLAG))
 
     def getQueensideCastleMoves(self, row, col, moves):
         if self.board[row][col - 1] == '--' and self.board[row][col - 2] == '--' and self.board[row][col - 3] == '--':
             if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
-                moves.append(Move((row, col), (row, col - 2), self.board, is_castle_move=True))
-
-
-class CastleRights:
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+                moves.append(encodeMove(row, col, row, col - 2, self.board, CASTLE_FLAG))
 
 
 class Move:
@@ -562,8 +1258,13 @@ class Move:
     files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3,
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
+    promotion_choices = ("Q", "R", "B", "N")  # фигуры, в которые может превратиться пешка
+    # ходов создаётся много, поэтому без __dict__
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_captured", "is_pawn_promotion",
+                 "promotion_choice", "is_enpassant_move", "is_castle_move", "is_capture", "moveID", "code")
 
-    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False):
+    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False,
+                 promotion_choice="Q"):
         self.start_row = start_square[0]
         self.start_col = start_square[1]
         self.end_row = end_square[0]
@@ -573,6 +1274,7 @@ class Move:
         # превращение пешки
         self.is_pawn_promotion = (self.piece_moved == "wp" and self.end_row == 0) or (
                 self.piece_moved == "bp" and self.end_row == 7)
+        self.promotion_choice = promotion_choice if self.is_pawn_promotion else None
         # en passant
         self.is_enpassant_move = is_enpassant_move
         if self.is_enpassant_move:
@@ -582,6 +1284,38 @@ class Move:
 
         self.is_capture = self.piece_captured != "--"
         self.moveID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        if self.is_pawn_promotion:
+            self.moveID += 10000 * self.promotion_choices.index(promotion_choice)
+        # упакованный ход (см. encodeMove)
+        if self.is_pawn_promotion:
+            flags = PROMOTION_FLAG + self.promotion_choices.index(promotion_choice)
+        else:
+            flags = ENPASSANT_FLAG if is_enpassant_move else CASTLE_FLAG if is_castle_move else 0
+        self.code = (self.start_row * 8 + self.start_col | (self.end_row * 8 + self.end_col) << TO_SHIFT
+                     | flags << FLAGS_SHIFT | PIECE_CODES[self.piece_moved] << MOVED_SHIFT
+                     | PIECE_CODES[self.piece_captured] << CAPTURED_SHIFT)
+
+    @classmethod
+    def fromCode(cls, code):
+        """
+        Move из упакованного хода. Генератор и поиск работают с числами, объект нужен только для отображения
+        """
+        move = cls.__new__(cls)
+        start, end, flags = code & 63, code >> TO_SHIFT & 63, code >> FLAGS_SHIFT & 15
+        move.start_row, move.start_col = start >> 3, start & 7
+        move.end_row, move.end_col = end >> 3, end & 7
+        move.piece_moved = PIECES[code >> MOVED_SHIFT & 15]
+        move.piece_captured = PIECES[code >> CAPTURED_SHIFT & 15]
+        move.is_pawn_promotion = flags >= PROMOTION_FLAG
+        move.promotion_choice = cls.promotion_choices[flags - PROMOTION_FLAG] if move.is_pawn_promotion else None
+        move.is_enpassant_move = flags == ENPASSANT_FLAG
+        move.is_castle_move = flags == CASTLE_FLAG
+        move.is_capture = move.piece_captured != "--"
+        move.moveID = move.start_row * 1000 + move.start_col * 100 + move.end_row * 10 + move.end_col
+        if move.is_pawn_promotion:
+            move.moveID += 10000 * (flags - PROMOTION_FLAG)
+        move.code = code
+        return move
 
     def __eq__(self, other):
         if isinstance(other, Move):
@@ -590,7 +1324,7 @@ class Move:
 
     def getChessNotation(self):
         if self.is_pawn_promotion:
-            return self.getRankFile(self.end_row, self.end_col) + "Q"
+            return self.getRankFile(self.end_row, self.end_col) + self.promotion_choice
         if self.is_castle_move:
             if self.end_col == 1:
                 return "0-0-0"
@@ -615,6 +1349,15 @@ class Move:
     def getRankFile(self, row, col):
         return self.cols_to_files[col] + self.rows_to_ranks[row]
 
+    def getUciNotation(self):
+        """
+        Ход в координатной нотации, например e2e4 или e7e8q
+        """
+        uci = self.getRankFile(self.start_row, self.start_col) + self.getRankFile(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            uci += self.promotion_choice.lower()
+        return uci
+
     def __str__(self):
         if self.is_castle_move:
             return "0-0" if self.end_col == 6 else "0-0-0"
@@ -625,7 +1368,7 @@ class Move:
             if self.is_capture:
                 return self.cols_to_files[self.start_col] + "x" + end_square
             else:
-                return end_square + "Q" if self.is_pawn_promotion else end_square
+                return end_square + self.promotion_choice if self.is_pawn_promotion else end_square
 
         move_string = self.piece_moved[1]
         if self.is_capture:
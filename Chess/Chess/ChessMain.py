@@ -4,58 +4,88 @@
 Отображает текущий игровой статус
 """
 import pygame as p
-import ChessEngine
+from . import ChessEngine
+from . import ChessMoveCache
+from . import ChessRender
+from . import ChessSearch
+from . import ChessSprites
+from . import ChessWorker
 import sys
+import time
 
 BOARD_WIDTH = BOARD_HEIGHT = 512 # разрешение доски
 MOVE_LOG_PANEL_WIDTH = 250 # разрешение нотации
-MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT # разрешение нотации
 DIMENSION = 8 # размерность
 SQUARE_SIZE = BOARD_HEIGHT // DIMENSION # размер одного квадрата
+MIN_SQUARE_SIZE = 32  # меньше окно не сжимается
 MAX_FPS = 15
+ANIMATION_FPS = 60  # частота кадров, пока идёт анимация хода
+SECONDS_PER_SQUARE = 10 / 60  # длительность анимации на клетку пути
+PLAYER_ONE = True  # белыми играет человек, False - движок
+PLAYER_TWO = True  # черными играет человек, False - движок
+ENGINE_TIME_MS = 1000  # время движка на ход
+ANALYSIS_PV_LENGTH = 6  # ходов главного варианта в заголовке окна
+WINDOW_TITLE = "Шахматы"
 IMAGES = {} # изображения фигур
+SPRITES = ChessSprites.SpriteCache()  # атласы фигур по размерам клетки, хранятся в файле кеша между запусками
 
 
-def loadImages():
+def loadImages(square_size=SQUARE_SIZE):
     """
-    Инициализация директории изображений фигур
-    Функция вызывается единажды в main
+    Изображения фигур размера square_size из кеша спрайтов
+    Функция вызывается в main при запуске и при изменении размера окна
     """
-    pieces = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
-    for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
+    IMAGES.update(SPRITES.images(square_size))
 
 
 def main():
-
+    engine = ChessWorker.EngineWorker()  # до p.init: процесс движка не должен наследовать состояние SDL
     p.init()
-    screen = p.display.set_mode((BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT)) # экран
+    screen = p.display.set_mode((BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT), p.RESIZABLE) # экран
+    p.display.set_caption(WINDOW_TITLE)
     clock = p.time.Clock()
     screen.fill(p.Color("white")) # заполняем экран белым цветом
+    move_cache = ChessMoveCache.MoveCache()  # после отмены хода или новой игры ходы берутся из кеша
     game_state = ChessEngine.GameState() # статус игры
+    game_state.move_cache = move_cache
     valid_moves = game_state.getValidMoves() # возможные ходы
     move_made = False # флаг сделанного хода
     animate = False # анимация
     loadImages()  # делаем это 1 раз перед while
+    move_log_font = p.font.SysFont("Arial", 14, False, False) # шрифт нотации
+    renderer = ChessRender.BoardRenderer(IMAGES, move_log_font, SQUARE_SIZE, MOVE_LOG_PANEL_WIDTH)
     running = True # запуск программы
     square_selected = ()  # изначально не выбрана никакая клетка, тут будем отслеживать последнее нажатие мышкой
     player_clicks = []  # тут будем отслеживать клики игрока
     game_over = False # конец игры
-    move_undone = False
-    move_log_font = p.font.SysFont("Arial", 14, False, False) # шрифт нотации
+    animation = None  # (ход, время начала, длительность) - кадры анимации рисует основной цикл
+    engine_thinking = False  # движок ищет ход за свою сторону
+    analysis = False  # непрерывный анализ текущей позиции, результат - в заголовке окна
+    position_changed = True  # нужно заново поставить задание движку
 
     while running:
+        human_turn = isHumanTurn(game_state)
         for e in p.event.get():
             if e.type == p.QUIT: # если выходим
+                engine.close()
                 p.quit()
                 sys.exit()
+            elif e.type == p.VIDEORESIZE:  # доска - наибольший квадрат, который помещается рядом с нотацией
+                square_size = max(min(e.w - MOVE_LOG_PANEL_WIDTH, e.h) // DIMENSION, MIN_SQUARE_SIZE)
+                if square_size != renderer.square_size:
+                    loadImages(square_size)
+                    renderer = ChessRender.BoardRenderer(IMAGES, move_log_font, square_size, MOVE_LOG_PANEL_WIDTH)
+                    animation = None
+                screen = p.display.set_mode((square_size * DIMENSION + MOVE_LOG_PANEL_WIDTH, square_size * DIMENSION),
+                                            p.RESIZABLE)
+                renderer.invalidate()
             # нажатия мыши
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not game_over:
+                if not game_over and human_turn:
                     location = p.mouse.get_pos()  # (x, y) локация мышки
-                    col = location[0] // SQUARE_SIZE
-                    row = location[1] // SQUARE_SIZE
-                    if square_selected == (row, col) or col >= 8:  # пользователь нажал дважды на один и тот же квадрат
+                    col = location[0] // renderer.square_size
+                    row = location[1] // renderer.square_size
+                    if square_selected == (row, col) or col >= 8 or row >= 8:  # пользователь нажал дважды на один и тот же квадрат
                         square_selected = ()  # отменяем выбор
                         player_clicks = []  # чистим player_clicks
                     else:
@@ -76,171 +106,126 @@ def main():
             # нажатие клавиш
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # отмена хода при нажатии 'z'
+                    engine.cancel()  # ход движка считался для прежней позиции
+                    engine_thinking = False
                     game_state.undoMove()
+                    if not isHumanTurn(game_state):  # против движка отменяем и его ответ, чтобы ход вернулся к игроку
+                        game_state.undoMove()
                     move_made = True
                     animate = False
                     game_over = False
-                    move_undone = True
                 if e.key == p.K_r:  # перезапуск игры при нажатии 'r'
+                    engine.cancel()
+                    engine_thinking = False
                     game_state = ChessEngine.GameState()
+                    game_state.move_cache = move_cache
                     valid_moves = game_state.getValidMoves()
                     square_selected = ()
                     player_clicks = []
-                    move_made = False
+                    move_made = True
                     animate = False
                     game_over = False
-                    move_undone = True
+                if e.key == p.K_a:  # анализ позиции при нажатии 'a'
+                    analysis = not analysis
+                    position_changed = True
+                    p.display.set_caption(WINDOW_TITLE)
+
+        # ход движка: забираем из очереди, пока интерфейс продолжает работать
+        for message in engine.poll():
+            if message[0] == "info" and analysis:
+                p.display.set_caption(analysisCaption(game_state, *message[1:]))
+            elif message[0] == "done" and engine_thinking and not game_over:
+                engine_thinking = False
+                # упакованный ход не проверяется в makeMove - делаем только легальный в текущей позиции
+                if message[1] is not None and message[1] in game_state.getValidMoveCodes():
+                    game_state.makeMove(message[1])
+                    move_made = True
+                    animate = True
 
         if move_made:
             if animate:
-                animateMove(game_state.move_log[-1], screen, game_state.board, clock)
+                move = ChessEngine.Move.fromCode(game_state.lastMove())
+                animation = (move, time.perf_counter(), animationSeconds(move))
+            elif animation is not None:
+                animation = None
+                renderer.invalidate()
             valid_moves = game_state.getValidMoves()
             move_made = False
             animate = False
-            move_undone = False
-
-        drawGameState(screen, game_state, valid_moves, square_selected)
-
-        if not game_over:
-            drawMoveLog(screen, game_state, move_log_font)
+            position_changed = True
 
+        end_text = None
         if game_state.checkmate:
             game_over = True
             if game_state.white_to_move:
-                drawEndGameText(screen, "Черные победили через мат")
+                end_text = "Черные победили через мат"
             else:
-                drawEndGameText(screen, "Белые победили через мат>")
+                end_text = "Белые победили через мат>"
 
         elif game_state.stalemate:
             game_over = True
-            drawEndGameText(screen, "Пат")
-
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
-
-def drawGameState(screen, game_state, valid_moves, square_selected):
-    """
-    Этот блок ответственен за всю графику в текущем статусе игры
-    """
-    drawBoard(screen)  # рисует клетки на доске
-    highlightSquares(screen, game_state, valid_moves, square_selected)
-    drawPieces(screen, game_state.board)  # рисует фигуры поверх клеток
+            end_text = "Пат"
 
+        elif game_state.threefold_repetition:
+            game_over = True
+            end_text = "Ничья: троекратное повторение"
 
-def drawBoard(screen):
+        elif game_state.fifty_move_rule:
+            game_over = True
+            end_text = "Ничья: правило 50 ходов"
+
+        if position_changed:
+            # позиция изменилась - прежний поиск или анализ больше не нужен
+            engine.cancel()
+            engine_thinking = False
+            position_changed = False
+            if not game_over and not isHumanTurn(game_state) and valid_moves:
+                engine.search(game_state, ENGINE_TIME_MS)
+                engine_thinking = True
+            elif analysis and not game_over:  # в законченной партии анализировать нечего
+                engine.analyze(game_state)
+
+        if animation is not None and time.perf_counter() - animation[1] >= animation[2]:
+            animation = None
+            renderer.invalidate()  # анимация рисовала в обход кеша - следующий кадр целиком
+        # перерисовываются и выводятся на экран только изменившиеся клетки и строки нотации
+        dirty_rects = renderer.draw(screen, game_state, valid_moves, square_selected, end_text)
+        if animation is not None:
+            move, start, seconds = animation
+            dirty_rects.append(renderer.drawMoveFrame(screen, move, game_state.board,
+                                                      (time.perf_counter() - start) / seconds))
+        clock.tick(ANIMATION_FPS if animation is not None else MAX_FPS)
+        if dirty_rects:
+            p.display.update(dirty_rects)
+
+
+def isHumanTurn(game_state):
     """
-    Рисует клетки на столе
+    Ходит ли сейчас человек (PLAYER_ONE, PLAYER_TWO), а не движок
     """
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            color = colors[((row + column) % 2)]
-            p.draw.rect(screen, color, p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+    return (game_state.white_to_move and PLAYER_ONE) or (not game_state.white_to_move and PLAYER_TWO)
 
 
-def highlightSquares(screen, game_state, valid_moves, square_selected):
+def animationSeconds(move):
     """
-    Подсветка клетки выбранной фигуры и её возможных ходов
+    Длительность анимации хода: по SECONDS_PER_SQUARE на клетку пути
     """
-    if (len(game_state.move_log)) > 0:
-        last_move = game_state.move_log[-1]
-        s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-        s.set_alpha(100)
-        s.fill(p.Color('green'))
-        screen.blit(s, (last_move.end_col * SQUARE_SIZE, last_move.end_row * SQUARE_SIZE))
-    if square_selected != ():
-        row, col = square_selected
-        if game_state.board[row][col][0] == (
-                'w' if game_state.white_to_move else 'b'):  # square_selected фигура которая может быть сделать ход
-            s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            s.set_alpha(100)
-            s.fill(p.Color('blue'))
-            screen.blit(s, (col * SQUARE_SIZE, row * SQUARE_SIZE))
-            s.fill(p.Color('yellow'))
-            for move in valid_moves:
-                if move.start_row == row and move.start_col == col:
-                    screen.blit(s, (move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE))
-
-
-def drawPieces(screen, board):
-    """
-    Рисует фигуры на доске используя текущий статус игры
-    """
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            piece = board[row][column]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+    return max(abs(move.end_row - move.start_row) + abs(move.end_col - move.start_col), 1) * SECONDS_PER_SQUARE
 
 
-def drawMoveLog(screen, game_state, font):
-    """
-    Рисует лог ходов
-    """
-    move_log_rect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
-    p.draw.rect(screen, p.Color('black'), move_log_rect)
-    move_log = game_state.move_log
-    move_texts = []
-    for i in range(0, len(move_log), 2):
-        move_string = str(i // 2 + 1) + '. ' + str(move_log[i]) + " "
-        if i + 1 < len(move_log):
-            move_string += str(move_log[i + 1]) + "  "
-        move_texts.append(move_string)
-
-    moves_per_row = 3
-    padding = 5
-    line_spacing = 2
-    text_y = padding
-    for i in range(0, len(move_texts), moves_per_row):
-        text = ""
-        for j in range(moves_per_row):
-            if i + j < len(move_texts):
-                text += move_texts[i + j]
-
-        text_object = font.render(text, True, p.Color('white'))
-        text_location = move_log_rect.move(padding, text_y)
-        screen.blit(text_object, text_location)
-        text_y += text_object.get_height() + line_spacing
-
-
-def drawEndGameText(screen, text):
-    font = p.font.SysFont("Helvetica", 32, True, False)
-    text_object = font.render(text, False, p.Color("gray"))
-    text_location = p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT).move(BOARD_WIDTH / 2 - text_object.get_width() / 2,
-                                                                 BOARD_HEIGHT / 2 - text_object.get_height() / 2)
-    screen.blit(text_object, text_location)
-    text_object = font.render(text, False, p.Color('black'))
-    screen.blit(text_object, text_location.move(2, 2))
-
-
-def animateMove(move, screen, board, clock):
+def analysisCaption(game_state, depth, score, pv, nodes):
     """
-    Анимация хода
+    Заголовок окна при анализе: оценка с точки зрения белых, глубина и главный вариант
     """
-    global colors
-    d_row = move.end_row - move.start_row
-    d_col = move.end_col - move.start_col
-    frames_per_square = 10
-    frame_count = (abs(d_row) + abs(d_col)) * frames_per_square
-    for frame in range(frame_count + 1):
-        row, col = (move.start_row + d_row * frame / frame_count, move.start_col + d_col * frame / frame_count)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        p.draw.rect(screen, color, end_square)
-        # рисует взятую фигуру на прямоугольнике
-        if move.piece_captured != '--':
-            if move.is_enpassant_move:
-                enpassant_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
-                end_square = p.Rect(move.end_col * SQUARE_SIZE, enpassant_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-            screen.blit(IMAGES[move.piece_captured], end_square)
-        # рисуем двигающийся объект
-        screen.blit(IMAGES[move.piece_moved], p.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        p.display.flip()
-        clock.tick(60)
+    if not game_state.white_to_move:
+        score = -score
+    if abs(score) >= ChessSearch.MATE_SCORE - ChessSearch.MAX_PLY:
+        mate_in = (ChessSearch.MATE_SCORE - abs(score) + 1) // 2
+        score_text = "мат в {}".format(mate_in if score > 0 else -mate_in)
+    else:
+        score_text = "{:+.2f}".format(score / 100)
+    pv_text = " ".join(ChessEngine.Move.fromCode(code).getUciNotation() for code in pv[:ANALYSIS_PV_LENGTH])
+    return "{} - анализ: глубина {}, {}, {} узлов: {}".format(WINDOW_TITLE, depth, score_text, nodes, pv_text)
 
 
 if __name__ == "__main__":
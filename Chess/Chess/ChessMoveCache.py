@@ -0,0 +1,45 @@
+"""
+Кеш легальных ходов по хешу позиции
+Ограниченный размер, вытесняется позиция, к которой дольше всего не обращались (LRU)
+"""
+from collections import OrderedDict
+
+
+class MoveCache:
+    def __init__(self, max_size=4096):
+        """
+        max_size - сколько позиций хранить
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()  # хеш позиции -> запись, последняя - самая свежая
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": round(self.hits / total, 3) if total else 0.0}
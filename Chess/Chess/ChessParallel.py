@@ -0,0 +1,180 @@
+"""
+Параллельный поиск (lazy SMP)
+Несколько процессов считают одну и ту же позицию и делятся результатами через общую таблицу транспозиций
+в multiprocessing.shared_memory. Помощники начинают с разной глубины, поэтому заполняют таблицу для основного
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from multiprocessing import shared_memory
+
+from . import ChessEngine
+from . import ChessPerft
+from . import ChessSearch
+from . import ChessTransposition
+
+DEFAULT_TT_SIZE_MB = 64
+POLL_SECONDS = 0.05  # как часто основной процесс проверяет время и живы ли процессы поиска
+
+
+def attachSharedMemory(name):
+    """
+    Подключение к общей памяти, созданной основным процессом. Дочерние процессы multiprocessing работают
+    с тем же resource_tracker, что и основной, поэтому снимать регистрацию здесь нельзя - память удаляет создатель
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name)
+
+
+def rootHistory(game_state):
+    """
+    FEN позиции после последнего необратимого хода (взятия или хода пешкой) и ходы от неё до текущей.
+    Процесс поиска повторяет эти ходы у себя, чтобы видеть повторения позиций партии.
+    Позиция возвращается на место вместе с флагами конца игры - undoMove их сбрасывает, а makeMove не считает
+    """
+    saved_flags = (game_state.checkmate, game_state.stalemate, game_state.in_check,
+                   game_state.threefold_repetition, game_state.fifty_move_rule)
+    moves = game_state.move_log[max(game_state.ply - game_state.halfmove_clock, 0):]
+    for _ in moves:
+        game_state.undoMove()
+    fen = game_state.to_fen()
+    for move in moves:
+        game_state.makeMove(move)
+    (game_state.checkmate, game_state.stalemate, game_state.in_check,
+     game_state.threefold_repetition, game_state.fifty_move_rule) = saved_flags
+    return fen, moves
+
+
+def _searchWorker(worker_id, fen, history, backend, memory_name, time_ms, max_depth, stop_event, results):
+    """
+    Процесс поиска: свой GameState, общая таблица транспозиций.
+    fen и history - позиция и ходы от неё до корня поиска (см. rootHistory).
+    Нечётные помощники начинают на полуход глубже - так процессы меньше повторяют работу друг друга
+    """
+    memory = attachSharedMemory(memory_name)
+    tt = ChessTransposition.TranspositionTable(buffer=memory.buf)
+    try:
+        game_state = ChessEngine.GameState.from_fen(fen, backend)
+        for move in history:
+            game_state.makeMove(move)
+
+        def info(result):
+            results.put(("depth", worker_id, result.depth, result.score, [move.code for move in result.pv],
+                         result.nodes))
+
+        searcher = ChessSearch.Searcher(game_state, time_ms, None, max_depth, tt, start_depth=1 + worker_id % 2,
+                                        stop_event=stop_event, info=info)
+        result = searcher.search()
+        results.put(("done", worker_id, result.nodes, tt.hits, tt.misses))
+    finally:
+        tt.release()
+        memory.close()
+
+
+def lazy_smp_search(game_state, workers=None, time_ms=None, max_depth=ChessSearch.MAX_PLY,
+                    tt_size_mb=DEFAULT_TT_SIZE_MB):
+    """
+    Лучший ход, найденный workers процессами. Поиск заканчивается, когда один из процессов досчитал max_depth
+    или вышло время. Результат - самая глубокая полностью просчитанная итерация среди всех процессов;
+    nodes - сумма по процессам, seconds - время до этой итерации
+    """
+    workers = workers or os.cpu_count() or 1
+    max_depth = min(max_depth, ChessSearch.MAX_PLY)
+    fen, history = rootHistory(game_state)
+    memory = shared_memory.SharedMemory(create=True, size=int(tt_size_mb * 1024 * 1024))
+    stop_event = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_searchWorker, daemon=True,
+                                         args=(worker_id, fen, history, game_state.backend, memory.name, time_ms,
+                                               max_depth, stop_event, results))
+                 for worker_id in range(workers)]
+    start = time.perf_counter()
+    best = None  # (глубина, -номер процесса, оценка, ходы, секунды)
+    nodes = 0
+    finished = 0
+    try:
+        for process in processes:
+            process.start()
+        deadline = start + time_ms / 1000 if time_ms is not None else None
+        while finished < workers:
+            if deadline is not None and time.perf_counter() >= deadline:
+                stop_event.set()  # время вышло - просим всех закончить и ждём итоговые сообщения
+                deadline = None
+            try:
+                message = results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes) and results.empty():
+                    break  # процесс упал, не прислав итог - ждать больше нечего
+                continue
+            if message[0] == "depth":
+                _, worker_id, depth, score, pv, _ = message
+                candidate = (depth, -worker_id, score, pv, time.perf_counter() - start)
+                if best is None or candidate[:2] > best[:2]:
+                    best = candidate
+                if depth >= max_depth:
+                    stop_event.set()
+            else:
+                finished += 1
+                nodes += message[2]
+        for process in processes:
+            process.join()
+    finally:
+        stop_event.set()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        memory.close()
+        memory.unlink()
+
+    if best is None:  # ни одна итерация не закончилась - берём любой легальный ход
+        moves = game_state.getValidMoves()
+        return ChessSearch.SearchResult(moves[0] if moves else None, 0, 0, nodes, time.perf_counter() - start,
+                                        moves[:1])
+    depth, _, score, pv, seconds = best
+    pv = [ChessEngine.Move.fromCode(code) for code in pv]
+    return ChessSearch.SearchResult(pv[0], score, depth, nodes, seconds, pv)
+
+
+def benchmark(fen, depth, worker_counts=(1, 2, 4, 8), backend="array", tt_size_mb=DEFAULT_TT_SIZE_MB):
+    """
+    Время до глубины depth для разного количества процессов, возвращает строки отчёта
+    """
+    rows = []
+    for workers in worker_counts:
+        game_state = ChessEngine.GameState.from_fen(fen, backend)
+        result = lazy_smp_search(game_state, workers, max_depth=depth, tt_size_mb=tt_size_mb)
+        base = rows[0]["seconds"] if rows else result.seconds
+        rows.append({"workers": workers, "depth": result.depth, "seconds": round(result.seconds, 3),
+                     "speedup": round(base / result.seconds, 2) if result.seconds > 0 else 0.0,
+                     "nodes": result.nodes, "move": result.move.getUciNotation() if result.move else None,
+                     "score": result.score})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Параллельный поиск (lazy SMP) и замер ускорения")
+    parser.add_argument("position", nargs="?", default="initial", help="имя эталонной позиции из ChessPerft или FEN")
+    parser.add_argument("-d", "--depth", type=int, default=5, help="глубина поиска")
+    parser.add_argument("-j", "--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="количество процессов, для каждого значения - отдельный замер")
+    parser.add_argument("--backend", choices=("array", "bitboard"), default="array",
+                        help="представление доски и генератор ходов")
+    parser.add_argument("--tt-size", type=float, default=DEFAULT_TT_SIZE_MB, help="размер общей таблицы в МБ")
+    args = parser.parse_args(argv)
+
+    positions = ChessPerft.REFERENCE_POSITIONS
+    fen = positions[args.position][0] if args.position in positions else args.position
+    print("Ядер: {}, глубина {}".format(os.cpu_count(), args.depth))
+    for row in benchmark(fen, args.depth, args.workers, args.backend, args.tt_size):
+        print("{workers} процесс(ов): depth {depth}, {seconds:.3f} с, ускорение {speedup}x, {nodes} узлов, "
+              "ход {move} ({score})".format(**row))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Perft - подсчёт количества позиций на заданной глубине
+Проверка корректности генератора ходов и замер его скорости
+"""
+import argparse
+import json
+import sys
+import time
+
+from . import ChessEngine
+from . import ChessPositions
+
+# эталонные позиции и количество узлов на каждой глубине
+# https://www.chessprogramming.org/Perft_Results
+REFERENCE_POSITIONS = {
+    "initial": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+                {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    "endgame": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    "promotion": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    "talkchess": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                  {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    "middlegame": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                   {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    # взятие на проходе открывает линию на короля
+    "enpassant_pin": ("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+                      {1: 18, 2: 92, 3: 1670, 4: 10138, 5: 185429}),
+    # взятие на проходе как защита от шаха
+    "enpassant_evasion": ("8/8/8/2k5/3Pp3/8/8/4K3 b - d3 0 1",
+                          {1: 9, 2: 50, 3: 379, 4: 2369, 5: 17879}),
+    # рокировка через битое поле и потеря прав на рокировку
+    "castling": ("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1",
+                 {1: 26, 2: 568, 3: 13744, 4: 314346}),
+    "castling_pawn_attack": ("r3k2r/p6p/8/8/8/8/1p4pP/R3K2R w KQkq - 0 1",
+                             {1: 17, 2: 486, 3: 7609, 4: 215437}),
+    "castling_rights": ("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+                        {1: 26, 2: 1141, 3: 27826, 4: 1274206}),
+    # превращение пешки во все фигуры
+    "underpromotion": ("8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+                       {1: 6, 2: 27, 3: 273, 4: 1329, 5: 18135, 6: 92683}),
+    "promotion_check": ("4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+                        {1: 9, 2: 40, 3: 472, 4: 2661, 5: 38983}),
+}
+
+QUICK_NODE_LIMIT = 100000  # узлы, которые проверяются по умолчанию
+
+
+def divide(game_state, depth):
+    """
+    Количество узлов под каждым ходом из текущей позиции
+    """
+    result = {}
+    for move in game_state.getValidMoves():
+        game_state.makeMove(move)
+        result[move.getUciNotation()] = game_state.perft(depth - 1)
+        game_state.undoMove()
+    return result
+
+
+def stagedPerft(game_state, depth):
+    """
+    Perft через поэтапный генератор GameState.stagedMoves - порции ходов вместе должны дать все ходы
+    """
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in game_state.stagedMoves():
+        game_state.makeMove(move)
+        nodes += stagedPerft(game_state, depth - 1)
+        game_state.undoMove()
+    return nodes
+
+
+def runPerft(fen, max_depth, name=None, backend="array", staged=False):
+    """
+    Запускает perft для глубин 1..max_depth и возвращает замеры по каждой глубине
+    """
+    results = []
+    for depth in range(1, max_depth + 1):
+        game_state = ChessEngine.GameState.from_fen(fen, backend)
+        start = time.perf_counter()
+        nodes = stagedPerft(game_state, depth) if staged else game_state.perft(depth)
+        seconds = time.perf_counter() - start
+        results.append({"position": name or fen, "backend": backend + " staged" * staged, "depth": depth,
+                        "nodes": nodes,
+                        "seconds": round(seconds, 6), "nps": int(nodes / seconds) if seconds > 0 else 0})
+    return results
+
+
+def quickDepth(expected, node_limit=QUICK_NODE_LIMIT):
+    """
+    Максимальная глубина, количество узлов на которой не превышает node_limit
+    """
+    depth = 1
+    for d, nodes in sorted(expected.items()):
+        if nodes <= node_limit:
+            depth = d
+    return depth
+
+
+def verify(names=None, node_limit=QUICK_NODE_LIMIT, max_depth=None, backend="array", staged=False):
+    """
+    Сверяет perft с эталонными значениями, возвращает (замеры, расхождения)
+    """
+    positions = ((name, REFERENCE_POSITIONS[name][0], REFERENCE_POSITIONS[name][1])
+                 for name in names or REFERENCE_POSITIONS)
+    return verifyPositions(positions, node_limit, max_depth, backend, staged)
+
+
+def epdPositions(path):
+    """
+    Позиции из файла EPD в формате perftsuite: операции D1, D2, ... - количество узлов на глубине
+    """
+    for number, (fen, operations) in enumerate(ChessPositions.readPositions(path), 1):
+        expected = {int(opcode[1:]): int(operands) for opcode, operands in operations.items()
+                    if opcode[0] == "D" and opcode[1:].isdigit()}
+        if expected:
+            yield operations.get("id", "{}:{}".format(path, number)), fen, expected
+
+
+def verifyPositions(positions, node_limit=QUICK_NODE_LIMIT, max_depth=None, backend="array", staged=False):
+    """
+    Сверяет perft для позиций (имя, fen, {глубина: узлы}), возвращает (замеры, расхождения)
+    """
+    timings = []
+    failures = []
+    for name, fen, expected in positions:
+        depth = max_depth if max_depth is not None else quickDepth(expected, node_limit)
+        for row in runPerft(fen, min(depth, max(expected)), name, backend, staged):
+            timings.append(row)
+            if row["nodes"] != expected[row["depth"]]:
+                failures.append((name, row["depth"], expected[row["depth"]], row["nodes"]))
+    return timings, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft генератора ходов")
+    parser.add_argument("position", nargs="?", default="initial",
+                        help="имя эталонной позиции или FEN")
+    parser.add_argument("-d", "--depth", type=int, default=3, help="максимальная глубина")
+    parser.add_argument("--divide", action="store_true", help="количество узлов под каждым ходом")
+    parser.add_argument("--verify", action="store_true", help="сверить все эталонные позиции")
+    parser.add_argument("--epd", metavar="FILE", help="сверить позиции из файла EPD с операциями D1, D2, ...")
+    parser.add_argument("--node-limit", type=int, default=QUICK_NODE_LIMIT,
+                        help="максимум узлов на глубину при --verify")
+    parser.add_argument("--backend", choices=("array", "bitboard"), default="array",
+                        help="представление доски и генератор ходов")
+    parser.add_argument("--staged", action="store_true",
+                        help="ходы из поэтапного генератора (хеш-ход, взятия, киллеры, тихие) вместо полного списка")
+    parser.add_argument("--json", metavar="FILE", help="записать замеры в FILE в формате JSON Lines ('-' - stdout)")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        timings, failures = verify(node_limit=args.node_limit, backend=args.backend, staged=args.staged)
+    elif args.epd:
+        timings, failures = verifyPositions(epdPositions(args.epd), args.node_limit, backend=args.backend,
+                                            staged=args.staged)
+    else:
+        name = args.position if args.position in REFERENCE_POSITIONS else None
+        fen = REFERENCE_POSITIONS[name][0] if name else args.position
+        if args.divide:
+            game_state = ChessEngine.GameState.from_fen(fen, args.backend)
+            total = 0
+            for move, nodes in sorted(divide(game_state, args.depth).items()):
+                print(move + ": " + str(nodes))
+                total += nodes
+            print("Всего: " + str(total))
+            return 0
+        timings, failures = runPerft(fen, args.depth, name, args.backend, args.staged), []
+        if name:
+            expected = REFERENCE_POSITIONS[name][1]
+            failures = [(name, row["depth"], expected[row["depth"]], row["nodes"])
+                        for row in timings if row["depth"] in expected and row["nodes"] != expected[row["depth"]]]
+
+    if args.json:
+        out = sys.stdout if args.json == "-" else open(args.json, "a")
+        for row in timings:
+            out.write(json.dumps(row) + "\n")
+        if out is not sys.stdout:
+            out.close()
+    if args.json != "-":
+        for row in timings:
+            print("{position} [{backend}] depth {depth}: {nodes} nodes, {seconds:.3f} s, {nps} nodes/s".format(**row))
+    for name, depth, expected, nodes in failures:
+        print("ОШИБКА {}: depth {} ожидалось {}, получено {}".format(name, depth, expected, nodes), file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Чтение наборов позиций из файлов FEN/EPD
+Файл читается построчно генератором, поэтому в памяти не держится весь набор
+"""
+import gzip
+
+from . import ChessEngine
+
+
+def parseEpd(line):
+    """
+    Разбирает строку FEN или EPD, возвращает (fen, операции).
+    Операции EPD - словарь "код -> операнды", например {"bm": "Nf3", "id": "WAC.001", "D1": "20"}
+    """
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("Некорректная строка EPD: " + line)
+    rest = fields[4] if len(fields) > 4 else ""
+    counters = rest.split(None, 2)
+    # в FEN после позиции идут два счётчика, в EPD - сразу операции
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+        fen = " ".join(fields[:4] + counters[:2])
+        rest = counters[2] if len(counters) > 2 else ""
+    else:
+        fen = " ".join(fields[:4])
+    operations = {}
+    for operation in splitOperations(rest):
+        opcode, _, operands = operation.partition(" ")
+        operations[opcode] = operands.strip().strip('"')
+    return fen, operations
+
+
+def splitOperations(text):
+    """
+    Операции EPD разделены ';', внутри кавычек ';' не считается разделителем
+    """
+    operations = []
+    current = ""
+    quoted = False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        if char == ";" and not quoted:
+            if current.strip():
+                operations.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        operations.append(current.strip())
+    return operations
+
+
+def openPositions(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def readLines(source):
+    """
+    Генератор строк с позициями без разбора. source - путь (можно .gz) или уже открытый файл.
+    Пустые строки и комментарии (#) пропускаются
+    """
+    file = openPositions(source) if isinstance(source, str) else source
+    try:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if file is not source:
+            file.close()
+
+
+def readPositions(source):
+    """
+    Генератор (fen, операции) по строкам файла, см. readLines. Некорректная строка - ValueError
+    """
+    for line in readLines(source):
+        yield parseEpd(line)
+
+
+def readGameStates(source, backend="array"):
+    """
+    Генератор (GameState, операции): каждая позиция расставляется только тогда, когда до неё дошла очередь
+    """
+    for fen, operations in readPositions(source):
+        yield ChessEngine.GameState.from_fen(fen, backend), operations
@@ -0,0 +1,368 @@
+"""
+Отрисовка доски и нотации по изменённым областям
+Фон доски, подсветка клеток и строки нотации рисуются один раз и хранятся готовыми поверхностями.
+За кадр перерисовываются только изменившиеся клетки и строки, и на экран передаются только их прямоугольники
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import pygame as p
+
+from . import ChessEngine
+
+LIGHT_COLOR = "white"
+DARK_COLOR = "gray"
+PANEL_COLOR = "black"
+TEXT_COLOR = "white"
+LAST_MOVE_COLOR = "green"  # клетка, на которую пришёл последний ход
+SELECTED_COLOR = "blue"  # выбранная фигура
+TARGET_COLOR = "yellow"  # клетки, куда она может пойти
+HIGHLIGHT_ALPHA = 100
+MOVES_PER_ROW = 3  # полных ходов в строке нотации
+PLIES_PER_ROW = MOVES_PER_ROW * 2
+PADDING = 5
+LINE_SPACING = 2
+
+
+class BoardRenderer:
+    """
+    Кадр из кешированных поверхностей: draw() рисует только то, что изменилось с прошлого кадра,
+    и возвращает прямоугольники для pygame.display.update
+    """
+
+    def __init__(self, images, font, square_size, panel_width):
+        self.images = images
+        self.font = font
+        self.end_font = p.font.SysFont("Helvetica", 32, True, False)
+        self.square_size = square_size
+        self.board_rect = p.Rect(0, 0, square_size * 8, square_size * 8)
+        self.panel_rect = p.Rect(self.board_rect.width, 0, panel_width, self.board_rect.height)
+        self.background = self.buildBackground()
+        self.overlays = {color: self.buildOverlay(color) for color in (LAST_MOVE_COLOR, SELECTED_COLOR, TARGET_COLOR)}
+        self.square_rects = [p.Rect(square % 8 * square_size, square // 8 * square_size, square_size, square_size)
+                             for square in range(64)]
+        self.line_height = font.get_linesize() + LINE_SPACING  # шаг строк постоянный, не зависит от текста
+        self.max_lines = (self.panel_rect.height - PADDING) // self.line_height  # ниже панели строки не видны
+        self.line_cache = {}  # номер строки нотации -> (текст, надпись); переживает invalidate()
+        self.end_texts = {}  # текст конца игры -> (надпись, прямоугольник)
+        self.invalidate()
+
+    def buildBackground(self):
+        """
+        Клетки доски и пустая панель нотации - рисуются один раз
+        """
+        background = p.Surface((self.board_rect.width + self.panel_rect.width, self.board_rect.height))
+        background.fill(p.Color(PANEL_COLOR))
+        colors = [p.Color(LIGHT_COLOR), p.Color(DARK_COLOR)]
+        for row in range(8):
+            for col in range(8):
+                p.draw.rect(background, colors[(row + col) % 2], p.Rect(col * self.square_size, row * self.square_size,
+                                                                        self.square_size, self.square_size))
+        return background
+
+    def buildOverlay(self, color):
+        overlay = p.Surface((self.square_size, self.square_size))
+        overlay.set_alpha(HIGHLIGHT_ALPHA)
+        overlay.fill(p.Color(color))
+        return overlay
+
+    def invalidate(self):
+        """
+        Следующий draw() перерисует весь экран - нужно, если на экране рисовали в обход (анимация хода)
+        """
+        self.squares = [None] * 64  # что сейчас на клетке: (фигура, подсветки)
+        self.log_codes = None
+        self.log_key = None  # (полуход, последний ход, хеш) позиции, для которой нарисована нотация
+        self.log_lines = []  # тексты строк нотации на экране
+        self.end_text = None
+        self.full_redraw = True
+
+    def draw(self, screen, game_state, valid_moves, square_selected, end_text=None):
+        """
+        Кадр для текущего статуса игры, end_text - надпись поверх доски в конце игры.
+        Возвращает изменённые прямоугольники экрана (пустой список, если ничего не изменилось)
+        """
+        full_redraw = self.full_redraw
+        if full_redraw:
+            screen.blit(self.background, (0, 0))
+            self.full_redraw = False
+        if end_text != self.end_text and self.end_text is not None:
+            old_rect = self.end_texts[self.end_text][1]
+            for square, rect in enumerate(self.square_rects):
+                if rect.colliderect(old_rect):
+                    self.squares[square] = None  # надпись убрали - клетки под ней рисуются заново
+        rects = self.drawSquares(screen, game_state, valid_moves, square_selected)
+        rects += self.drawMoveLog(screen, game_state)
+        if end_text is not None:
+            text_object, text_rect = self.renderEndText(end_text)
+            if end_text != self.end_text or text_rect.collidelist(rects) != -1:
+                screen.blit(text_object, text_rect)
+                rects.append(text_rect)
+        self.end_text = end_text
+        return [screen.get_rect()] if full_redraw else rects
+
+    def drawSquares(self, screen, game_state, valid_moves, square_selected):
+        """
+        Клетки, у которых с прошлого кадра сменились фигура или подсветка
+        """
+        highlights = {}
+        if game_state.ply > 0:
+            highlights[game_state.lastMove() >> ChessEngine.TO_SHIFT & 63] = [LAST_MOVE_COLOR]
+        if square_selected != ():
+            row, col = square_selected
+            if game_state.board[row][col][0] == ('w' if game_state.white_to_move else 'b'):
+                highlights.setdefault(row * 8 + col, []).append(SELECTED_COLOR)
+                for move in valid_moves:
+                    if move.start_row == row and move.start_col == col:
+                        highlights.setdefault(move.end_row * 8 + move.end_col, []).append(TARGET_COLOR)
+        rects = []
+        square = 0
+        for board_row in game_state.board:
+            for piece in board_row:
+                state = (piece, tuple(highlights[square])) if square in highlights else (piece, ())
+                if state != self.squares[square]:
+                    self.squares[square] = state
+                    rect = self.square_rects[square]
+                    screen.blit(self.background, rect, rect)
+                    for color in state[1]:
+                        screen.blit(self.overlays[color], rect)
+                    if piece != "--":
+                        screen.blit(self.images[piece], rect)
+                    rects.append(rect)
+                square += 1
+        return rects
+
+    def drawMoveLog(self, screen, game_state):
+        """
+        Строки нотации, начиная с первой, в которой изменился ход. Отрисованные строки берутся из кеша.
+        Пока не сменились полуход и последний ход, список ходов даже не собирается - кадр без хода не стоит O(ply)
+        """
+        key = (game_state.ply, game_state.lastMove(), game_state.zobrist_key)
+        if key == self.log_key:
+            return []
+        self.log_key = key
+        codes = game_state.move_log
+        if codes == self.log_codes:
+            return []
+        first = 0
+        if self.log_codes is not None:
+            common = min(len(codes), len(self.log_codes))
+            while first < common and codes[first] == self.log_codes[first]:
+                first += 1
+        self.log_codes = codes
+        line_count = min((len(codes) + PLIES_PER_ROW - 1) // PLIES_PER_ROW, self.max_lines)
+        lines = self.log_lines[:line_count] + [None] * (line_count - len(self.log_lines))
+        rects = []
+        for line in range(first // PLIES_PER_ROW, max(line_count, len(self.log_lines))):
+            text = self.lineText(codes, line) if line < line_count else None
+            if line < len(self.log_lines) and self.log_lines[line] == text:
+                continue
+            rect = p.Rect(self.panel_rect.x, PADDING + line * self.line_height, self.panel_rect.width,
+                          self.line_height)
+            screen.blit(self.background, rect, rect)
+            if text is not None:
+                screen.blit(self.renderLine(line, text), rect.move(PADDING, 0))
+                lines[line] = text
+            rects.append(rect)
+        self.log_lines = lines
+        return rects
+
+    @staticmethod
+    def lineText(codes, line):
+        """
+        Текст строки нотации: MOVES_PER_ROW полных ходов вида "1. e4 e5  "
+        """
+        text = ""
+        start = line * PLIES_PER_ROW
+        for i in range(start, min(start + PLIES_PER_ROW, len(codes)), 2):
+            text += str(i // 2 + 1) + '. ' + str(ChessEngine.Move.fromCode(codes[i])) + " "
+            if i + 1 < len(codes):
+                text += str(ChessEngine.Move.fromCode(codes[i + 1])) + "  "
+        return text
+
+    def renderLine(self, line, text):
+        cached = self.line_cache.get(line)
+        if cached is None or cached[0] != text:
+            cached = self.line_cache[line] = (text, self.font.render(text, True, p.Color(TEXT_COLOR)))
+        return cached[1]
+
+    def drawMoveFrame(self, screen, move, board, progress):
+        """
+        Кадр анимации хода: фигура прошла долю progress (0..1) пути, board - доска уже после хода.
+        Рисуется вся доска поверх кешированных клеток - после анимации нужен invalidate().
+        Возвращает прямоугольник доски
+        """
+        size = self.square_size
+        screen.blit(self.background, self.board_rect, self.board_rect)
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece != "--" and (row != move.end_row or col != move.end_col):
+                    screen.blit(self.images[piece], self.square_rects[row * 8 + col])
+        # взятая фигура стоит, пока на её клетку не придёт ходящая
+        if move.piece_captured != '--':
+            captured_row = move.end_row
+            if move.is_enpassant_move:
+                captured_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
+            screen.blit(self.images[move.piece_captured], self.square_rects[captured_row * 8 + move.end_col])
+        row = move.start_row + (move.end_row - move.start_row) * progress
+        col = move.start_col + (move.end_col - move.start_col) * progress
+        screen.blit(self.images[move.piece_moved], (round(col * size), round(row * size)))
+        return self.board_rect
+
+    def renderEndText(self, text):
+        """
+        Надпись конца игры с тенью и её место по центру доски
+        """
+        if text not in self.end_texts:
+            shadow = self.end_font.render(text, False, p.Color("gray"))
+            text_object = p.Surface((shadow.get_width() + 2, shadow.get_height() + 2), p.SRCALPHA)
+            text_object.blit(shadow, (0, 0))
+            text_object.blit(self.end_font.render(text, False, p.Color("black")), (2, 2))
+            text_rect = text_object.get_rect(topleft=(self.board_rect.width // 2 - shadow.get_width() // 2,
+                                                      self.board_rect.height // 2 - shadow.get_height() // 2))
+            self.end_texts[text] = (text_object, text_rect)
+        return self.end_texts[text]
+
+
+def _fullFrame(screen, game_state, valid_moves, square_selected, images, font, square_size, panel_width):
+    """
+    Прежняя полная перерисовка кадра без кешей - для сравнения в benchmark:
+    все клетки, подсветка, все фигуры и вся нотация заново
+    """
+    colors = [p.Color(LIGHT_COLOR), p.Color(DARK_COLOR)]
+    for row in range(8):
+        for column in range(8):
+            color = colors[((row + column) % 2)]
+            p.draw.rect(screen, color, p.Rect(column * square_size, row * square_size, square_size, square_size))
+    if game_state.ply > 0:
+        last_move = ChessEngine.Move.fromCode(game_state.lastMove())
+        s = p.Surface((square_size, square_size))
+        s.set_alpha(HIGHLIGHT_ALPHA)
+        s.fill(p.Color(LAST_MOVE_COLOR))
+        screen.blit(s, (last_move.end_col * square_size, last_move.end_row * square_size))
+    if square_selected != ():
+        row, col = square_selected
+        if game_state.board[row][col][0] == ('w' if game_state.white_to_move else 'b'):
+            s = p.Surface((square_size, square_size))
+            s.set_alpha(HIGHLIGHT_ALPHA)
+            s.fill(p.Color(SELECTED_COLOR))
+            screen.blit(s, (col * square_size, row * square_size))
+            s.fill(p.Color(TARGET_COLOR))
+            for move in valid_moves:
+                if move.start_row == row and move.start_col == col:
+                    screen.blit(s, (move.end_col * square_size, move.end_row * square_size))
+    for row in range(8):
+        for column in range(8):
+            piece = game_state.board[row][column]
+            if piece != "--":
+                screen.blit(images[piece], p.Rect(column * square_size, row * square_size, square_size, square_size))
+
+    move_log_rect = p.Rect(square_size * 8, 0, panel_width, square_size * 8)
+    p.draw.rect(screen, p.Color(PANEL_COLOR), move_log_rect)
+    move_log = [ChessEngine.Move.fromCode(code) for code in game_state.move_log]
+    move_texts = []
+    for i in range(0, len(move_log), 2):
+        move_string = str(i // 2 + 1) + '. ' + str(move_log[i]) + " "
+        if i + 1 < len(move_log):
+            move_string += str(move_log[i + 1]) + "  "
+        move_texts.append(move_string)
+    text_y = PADDING
+    for i in range(0, len(move_texts), MOVES_PER_ROW):
+        text = "".join(move_texts[i:i + MOVES_PER_ROW])
+        text_object = font.render(text, True, p.Color(TEXT_COLOR))
+        screen.blit(text_object, move_log_rect.move(PADDING, text_y))
+        text_y += text_object.get_height() + LINE_SPACING
+
+
+def randomGame(plies, seed=0):
+    """
+    Упакованные ходы случайной партии до plies полуходов или до конца игры
+    """
+    rng = random.Random(seed)
+    game_state = ChessEngine.GameState()
+    codes = []
+    for _ in range(plies):
+        moves = game_state.getValidMoveCodes()
+        if not moves:
+            break
+        codes.append(rng.choice(moves))
+        game_state.makeMove(codes[-1])
+    return codes
+
+
+def benchmark(codes, idle_frames=4, segment=50):
+    """
+    Время кадра по ходу длинной партии: прежняя полная перерисовка (_fullFrame и pygame.display.flip) против BoardRenderer и pygame.display.update. На каждый полуход - кадр после хода,
+    кадр с выбранной фигурой и idle_frames кадров без изменений, как при ожидании хода на MAX_FPS.
+    Возвращает строки (первый полуход, последний полуход, мс на кадр полностью, мс на кадр по изменениям)
+    """
+    from . import ChessMain  # размеры окна и изображения фигур
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    p.init()
+    screen = p.display.set_mode((ChessMain.BOARD_WIDTH + ChessMain.MOVE_LOG_PANEL_WIDTH, ChessMain.BOARD_HEIGHT))
+    ChessMain.loadImages()
+    font = p.font.SysFont("Arial", 14, False, False)
+    renderer = BoardRenderer(ChessMain.IMAGES, font, ChessMain.SQUARE_SIZE, ChessMain.MOVE_LOG_PANEL_WIDTH)
+
+    def fullFrame(game_state, valid_moves, square_selected):
+        _fullFrame(screen, game_state, valid_moves, square_selected, ChessMain.IMAGES, font, ChessMain.SQUARE_SIZE,
+                   ChessMain.MOVE_LOG_PANEL_WIDTH)
+        p.display.flip()
+
+    def dirtyFrame(game_state, valid_moves, square_selected):
+        rects = renderer.draw(screen, game_state, valid_moves, square_selected)
+        if rects:
+            p.display.update(rects)
+
+    timings = []
+    for frame in (fullFrame, dirtyFrame):
+        game_state = ChessEngine.GameState()
+        segment_times = []
+        for index, code in enumerate(codes):
+            valid_moves = game_state.getValidMoves()
+            start_square = (code & 63) // 8, code & 7
+            start = time.perf_counter()
+            frame(game_state, valid_moves, ())
+            for _ in range(idle_frames + 1):
+                frame(game_state, valid_moves, start_square)
+            if index % segment == 0:
+                segment_times.append(0.0)
+            segment_times[-1] += time.perf_counter() - start
+            game_state.makeMove(code)
+        timings.append(segment_times)
+    p.quit()
+
+    frames_per_ply = idle_frames + 2
+    rows = []
+    for number, (full_seconds, dirty_seconds) in enumerate(zip(*timings)):
+        first = number * segment
+        last = min(first + segment, len(codes))
+        frames = (last - first) * frames_per_ply
+        rows.append((first + 1, last, full_seconds * 1000 / frames, dirty_seconds * 1000 / frames))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер времени кадра: полная перерисовка против изменённых областей")
+    parser.add_argument("--plies", type=int, default=300, help="длина случайной партии в полуходах")
+    parser.add_argument("--idle-frames", type=int, default=4, help="кадров без изменений на каждый полуход")
+    parser.add_argument("--segment", type=int, default=50, help="полуходов в строке отчёта")
+    parser.add_argument("--seed", type=int, default=0, help="зерно случайной партии")
+    args = parser.parse_args(argv)
+
+    codes = randomGame(args.plies, args.seed)
+    rows = benchmark(codes, args.idle_frames, args.segment)
+    print("Полуходов: {}, кадров на полуход: {}".format(len(codes), args.idle_frames + 2))
+    for first, last, full_ms, dirty_ms in rows:
+        print("полуходы {:>4}-{:<4} полностью {:7.3f} мс/кадр, по изменениям {:7.3f} мс/кадр, ускорение {:5.1f}x".format(
+            first, last, full_ms, dirty_ms, full_ms / dirty_ms if dirty_ms else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
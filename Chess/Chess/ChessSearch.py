@@ -0,0 +1,299 @@
+"""
+Поиск лучшего хода
+Negamax с альфа-бета отсечением, итеративное углубление, поиск взятий (quiescence) и ограничение по времени и узлам
+"""
+import time
+
+from . import ChessEngine
+from . import ChessTransposition
+from .ChessEngine import FLAGS_SHIFT, MOVED_SHIFT, CAPTURED_SHIFT, PROMOTION_FLAG, SEE_VALUES
+from .ChessTransposition import EXACT, LOWER, UPPER
+
+PIECE_VALUES = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}  # стоимость фигур для сортировки взятий
+# стоимость по коду фигуры в упакованном ходе и по индексу превращения
+CODE_VALUES = [PIECE_VALUES[piece[1]] if piece != "--" else 0 for piece in ChessEngine.PIECES]
+PROMOTION_VALUES = [PIECE_VALUES[piece] for piece in ChessEngine.Move.promotion_choices]
+MATE_SCORE = 100000  # оценка мата, из неё вычитается число полуходов до мата
+DRAW_SCORE = 0  # повторение позиции или правило 50 ходов
+INFINITY = 1000000
+MAX_PLY = 64  # максимальная глубина поиска
+CHECK_EVERY = 128  # как часто (в узлах) проверять время и stop_event - несколько миллисекунд поиска
+
+
+class SearchTimeout(Exception):
+    """
+    Закончилось время или лимит узлов - поиск прерывается
+    """
+
+
+class SearchResult:
+    def __init__(self, move, score, depth, nodes, seconds, pv):
+        self.move = move  # лучший ход (Move) или None, если ходов нет
+        self.score = score  # оценка с точки зрения стороны, которая ходит
+        self.depth = depth  # последняя полностью просчитанная глубина
+        self.nodes = nodes
+        self.seconds = seconds
+        self.pv = pv  # главный вариант - список ходов
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def __str__(self):
+        pv = " ".join(move.getUciNotation() for move in self.pv)
+        return "depth {} score {} nodes {} nps {} pv {}".format(self.depth, self.score, self.nodes, self.nps, pv)
+
+
+class Searcher:
+    def __init__(self, game_state, time_ms=None, max_nodes=None, max_depth=MAX_PLY, tt=None, start_depth=1,
+                 stop_event=None, info=None):
+        """
+        start_depth - с какой глубины начинать итеративное углубление (помощники в ChessParallel начинают глубже),
+        stop_event - событие (threading/multiprocessing), по которому поиск прерывается извне,
+        info(SearchResult) - вызывается после каждой полностью просчитанной глубины
+        """
+        self.game_state = game_state
+        # таблицу транспозиций стоит передавать между поисками одной партии - позиции повторяются
+        self.tt = tt if tt is not None else ChessTransposition.TranspositionTable()
+        self.time_ms = time_ms
+        self.max_nodes = max_nodes
+        self.max_depth = min(max_depth, MAX_PLY)
+        self.start_depth = max(1, min(start_depth, self.max_depth))
+        self.stop_event = stop_event
+        self.info = info
+        self.nodes = 0
+        self.deadline = None
+        # ходы внутри поиска - упакованные числа (ChessEngine.encodeMove), Move создаются только для результата
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]  # 2 тихих хода на полуход, давших отсечение
+        self.history = {}  # ход -> насколько часто тихий ход давал отсечение (цвет входит в код фигуры)
+        self.pv = [[] for _ in range(MAX_PLY + 2)]  # главные варианты по полуходам
+        self.previous_pv = []  # главный вариант прошлой итерации - его ходы считаем первыми
+
+    def search(self):
+        """
+        Итеративное углубление: считаем глубины 1, 2, 3... пока не кончится время, узлы или глубина
+        """
+        game_state = self.game_state
+        start = time.perf_counter()
+        if self.time_ms is not None:
+            self.deadline = start + self.time_ms / 1000
+        saved_flags = (game_state.checkmate, game_state.stalemate, game_state.in_check,
+                       game_state.threefold_repetition, game_state.fifty_move_rule)
+        self.tt.newSearch()
+        root_ply = game_state.ply
+        result = SearchResult(None, 0, 0, 0, 0.0, [])
+        root_moves = game_state.getValidMoveCodes()
+        if root_moves:
+            result.move = ChessEngine.Move.fromCode(root_moves[0])
+            result.pv = [result.move]
+        try:
+            for depth in range(self.start_depth, self.max_depth + 1) if root_moves else ():
+                score = self.negamax(depth, 0, -INFINITY, INFINITY)
+                self.previous_pv = list(self.pv[0])
+                pv = [ChessEngine.Move.fromCode(move) for move in self.previous_pv]
+                result = SearchResult(pv[0], score, depth, self.nodes, time.perf_counter() - start, pv)
+                if self.info is not None:
+                    self.info(result)
+                if abs(score) >= MATE_SCORE - MAX_PLY:  # мат найден - глубже считать незачем
+                    break
+                # следующая итерация займёт в несколько раз больше времени - не начинаем её, если не успеем
+                if self.deadline is not None and time.perf_counter() - start > (self.deadline - start) / 2:
+                    break
+        except SearchTimeout:
+            while game_state.ply > root_ply:  # возвращаем позицию, на которой прервались
+                game_state.undoMove()
+        (game_state.checkmate, game_state.stalemate, game_state.in_check,
+         game_state.threefold_repetition, game_state.fifty_move_rule) = saved_flags
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def startClock(self, time_ms):
+        """
+        Ограничение времени с текущего момента для поиска, начатого без него (ponderhit в UCI).
+        Вызывается из другого потока, пока поиск идёт
+        """
+        self.deadline = time.perf_counter() + time_ms / 1000
+
+    def checkLimits(self):
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchTimeout()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchTimeout()
+
+    def negamax(self, depth, ply, alpha, beta):
+        """
+        Оценка позиции с точки зрения стороны, которая ходит
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self.checkLimits()
+        self.pv[ply] = []
+        game_state = self.game_state
+        # внутри поиска достаточно одного повторения: если позиция повторилась, лучше, чем ничья, не станет
+        if ply > 0 and game_state.isRepetition(2):
+            return DRAW_SCORE
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(ply, alpha, beta)
+
+        key = game_state.zobrist_key
+        hash_move = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            hash_move, score, stored_depth, bound = entry
+            if stored_depth >= depth and ply > 0:
+                score = scoreFromTable(score, ply)
+                if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score
+
+        if ply > 0 and game_state.halfmove_clock >= 100:  # правило 50 ходов, если только это не мат
+            return -MATE_SCORE + ply if not game_state.getValidMoveCodes() and game_state.in_check else DRAW_SCORE
+
+        pv_move = self.previous_pv[ply] if ply < len(self.previous_pv) else 0
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        # ходы генерируются по порциям: после отсечения на первых ходах тихие ходы не генерируются вовсе.
+        # Первым без генерации идёт только ход из таблицы - ход главного варианта может быть из другой позиции
+        moves = game_state.stagedMoves(hash_move, self.killers[ply], self.orderKey(ply, pv_move, hash_move))
+        for move in moves:
+            game_state.makeMove(move)
+            score = -self.negamax(depth - 1, ply + 1, -beta, -alpha)
+            game_state.undoMove()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        if not move >> CAPTURED_SHIFT & 15:
+                            self.storeKiller(move, ply)
+                            self.history[move] = self.history.get(move, 0) + depth * depth
+                        break
+        if best_score == -INFINITY:  # ходов нет
+            return -MATE_SCORE + ply if game_state.in_check else DRAW_SCORE
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, bound, scoreToTable(best_score, ply), best_move)
+        return best_score
+
+    def quiescence(self, ply, alpha, beta):
+        """
+        Досчитываем только взятия, чтобы не оценивать позицию посреди размена
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self.checkLimits()
+        self.pv[ply] = []
+        if ply >= MAX_PLY:
+            return self.evaluate()
+        game_state = self.game_state
+        stages = game_state.moveStages()
+        moves = next(stages)  # взятия и превращения
+        in_check = game_state.in_check
+        if in_check:  # от шаха нужно защищаться любым ходом, а не только взятием
+            moves = moves + next(stages)
+            if not moves:
+                return -MATE_SCORE + ply
+            best_score = -INFINITY
+        else:  # пат здесь не ищем: без шаха всегда можно остаться при текущей оценке
+            best_score = self.evaluate()  # можно ничего не брать и остаться при текущей оценке
+            if best_score >= beta:
+                return best_score
+            alpha = max(alpha, best_score)
+        key = self.orderKey(ply, 0, 0)
+        for score, move in sorted([(key(move), move) for move in moves], reverse=True):
+            if score < 0 and not in_check:
+                break  # дальше только проигрывающие размены (see < 0) - их не считаем
+            game_state.makeMove(move)
+            score = -self.quiescence(ply + 1, -beta, -alpha)
+            game_state.undoMove()
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        break
+        return best_score
+
+    def orderKey(self, ply, pv_move, hash_move):
+        """
+        Оценка хода для сортировки - больше значит раньше. Сначала ход из главного варианта и ход из таблицы
+        транспозиций, потом взятия (MVV-LVA: самая ценная жертва самой дешёвой фигурой), потом киллеры и тихие ходы
+        по истории отсечений, последними - взятия, которые проигрывают размен (GameState.see < 0, оценка отрицательная)
+        """
+        killers = self.killers[ply]
+        history = self.history
+        game_state = self.game_state
+
+        def score(move):
+            if move == pv_move:
+                return 2000000
+            if move == hash_move:
+                return 1000000
+            captured = move >> CAPTURED_SHIFT & 15
+            flags = move >> FLAGS_SHIFT & 15
+            if captured or flags >= PROMOTION_FLAG:
+                victim = CODE_VALUES[captured]
+                if flags >= PROMOTION_FLAG:
+                    victim += PROMOTION_VALUES[flags - PROMOTION_FLAG]
+                # дешёвая фигура берёт дорогую - размен не проигрышный, иначе считаем его до конца
+                elif SEE_VALUES[captured] < SEE_VALUES[move >> MOVED_SHIFT & 15]:
+                    exchange = game_state.see(move)
+                    if exchange < 0:
+                        return exchange
+                return 100000 + victim * 10 - CODE_VALUES[move >> MOVED_SHIFT & 15] // 10
+            if move == killers[0]:
+                return 90000
+            if move == killers[1]:
+                return 80000
+            return history.get(move, 0)
+
+        return score
+
+    def storeKiller(self, move, ply):
+        killers = self.killers[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+
+    def evaluate(self):
+        """
+        Оценка с точки зрения стороны, которая ходит - её ведёт сам GameState
+        """
+        return self.game_state.evaluate()
+
+
+def scoreToTable(score, ply):
+    """
+    Оценка мата в таблице хранится относительно текущей позиции, а не корня поиска
+    """
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+def best_move(game_state, time_ms, max_nodes=None, max_depth=MAX_PLY, tt=None):
+    """
+    Лучший ход в текущей позиции за time_ms миллисекунд.
+    Возвращает SearchResult: ход, оценку, глубину, количество узлов, скорость (nps) и главный вариант
+    """
+    return Searcher(game_state, time_ms, max_nodes, max_depth, tt).search()
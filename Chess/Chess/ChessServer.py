@@ -0,0 +1,507 @@
+"""
+Сервер партий на asyncio
+Один процесс держит тысячи партий и принимает ходы по простому строковому протоколу поверх TCP.
+Цикл событий только читает и пишет строки: проверка ходов (getValidMoves), ответы движка и FEN считаются
+в пуле процессов, поэтому цикл не останавливается на генерации ходов или поиске.
+Партия между ходами хранится компактно: снимок позиции после последнего необратимого хода (взятия или хода пешкой)
+и ходы от него упакованными числами - как раз то, что нужно для проверки повторений.
+
+Протокол: одна команда - одна строка, ответы и обновления тоже строками.
+  new <white|black|both> [<мс движка> [<FEN>]]  новая партия; с временем движка он играет за другую сторону
+  join <id> <white|black|both|watch>            подключиться к партии
+  move <id> <ход>                               ход в координатной нотации, например e2e4 или e7e8q
+  state <id>                                    текущее состояние партии
+  quit
+Ответы:
+  game <id> <сторона>
+  state <id> <полуход> <последний ход или -> <ongoing|checkmate|stalemate|repetition|fifty> <FEN>
+  error <id или -> <сообщение>
+state рассылается всем подключённым к партии после каждого хода
+"""
+import argparse
+import array
+import asyncio
+import functools
+import os
+import pathlib
+import random
+import signal
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from . import ChessEngine
+from . import ChessSearch
+from . import ChessTransposition
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_CHUNK_SIZE = 32  # ходов в одном задании пулу - меньше накладных расходов на передачу между процессами
+DEFAULT_TT_SIZE_MB = 16  # таблица транспозиций движка в каждом процессе пула
+SNAPSHOT_FLAGS = 64  # байт снимка GameState.snapshot с ходом белых (бит 0)
+SEATS = {"watch": 0, "white": 1, "black": 2, "both": 3}  # места за доской битами: 1 - белые, 2 - черные
+PACKAGE_PARENT = pathlib.Path(__file__).resolve().parent.parent  # откуда запускать python -m для сервера нагрузки
+
+# состояние процесса пула: один GameState на все партии, позиция каждый раз восстанавливается из снимка
+_worker = {}
+
+
+def _initWorker(backend, tt_size_mb):
+    _worker["game_state"] = ChessEngine.GameState(backend)
+    _worker["tt"] = ChessTransposition.TranspositionTable(tt_size_mb)
+
+
+def gameStatus(game_state):
+    """
+    Состояние партии словом для протокола. Флаги обновляет getValidMoveCodes
+    """
+    game_state.getValidMoveCodes()
+    if game_state.checkmate:
+        return "checkmate"
+    if game_state.stalemate:
+        return "stalemate"
+    if game_state.threefold_repetition:
+        return "repetition"
+    if game_state.fifty_move_rule:
+        return "fifty"
+    return "ongoing"
+
+
+def _position(root, moves):
+    game_state = _worker["game_state"]
+    game_state.restore(root)
+    for code in array.array("I", moves):
+        game_state.makeMove(code)
+    return game_state
+
+
+def _played(game_state, code):
+    """
+    Ход на восстановленной позиции: (ход, ход в нотации, новый снимок или None, состояние, FEN).
+    Снимок меняется после необратимого хода - раньше него позиция уже не повторится
+    """
+    game_state.makeMove(code)
+    root = game_state.snapshot() if game_state.halfmove_clock == 0 else None
+    return (code, ChessEngine.Move.fromCode(code).getUciNotation(), root, gameStatus(game_state),
+            game_state.to_fen())
+
+
+def _applyMoves(chunk):
+    """
+    Выполняется в процессе пула: проверка пачки ходов (снимок, ходы от снимка, ход в нотации).
+    Для каждого - результат _played или None, если хода нет среди легальных
+    """
+    results = []
+    for root, moves, uci in chunk:
+        game_state = _position(root, moves)
+        for code in game_state.getValidMoveCodes():
+            if ChessEngine.Move.fromCode(code).getUciNotation() == uci:
+                results.append(_played(game_state, code))
+                break
+        else:
+            results.append(None)
+    return results
+
+
+def _engineMove(root, moves, time_ms):
+    game_state = _position(root, moves)
+    result = ChessSearch.best_move(game_state, time_ms, tt=_worker["tt"])
+    return _played(game_state, result.move.code) if result.move else None
+
+
+def _describe(root, moves):
+    game_state = _position(root, moves)
+    return gameStatus(game_state), game_state.to_fen()
+
+
+def _newGame(fen):
+    game_state = _worker["game_state"]
+    game_state.loadFen(fen)
+    return game_state.snapshot(), gameStatus(game_state)
+
+
+class ServerGame:
+    """
+    Партия на сервере. Без __dict__ и без GameState - между ходами занимает несколько сотен байт
+    """
+    __slots__ = ("game_id", "root", "moves", "ply", "last_move", "status", "engine_seat", "engine_ms", "seats",
+                 "watchers", "busy")
+
+    def __init__(self, game_id, root, status="ongoing", engine_seat=0, engine_ms=0):
+        self.game_id = game_id
+        self.root = root  # снимок позиции после последнего необратимого хода (GameState.snapshot)
+        self.moves = array.array("I")  # ходы от снимка упакованными числами
+        self.ply = 0  # полуходов с начала партии на сервере
+        self.last_move = "-"
+        self.status = status
+        self.engine_seat = engine_seat  # за какие стороны играет движок (биты как в SEATS)
+        self.engine_ms = engine_ms
+        self.seats = engine_seat  # занятые места
+        self.watchers = []  # потоки записи подключённых соединений
+        self.busy = False  # ход уже считается в пуле - следующий ждёт результата
+
+    @property
+    def white_to_move(self):
+        return bool(self.root[SNAPSHOT_FLAGS] & 1) != bool(len(self.moves) & 1)
+
+    def stateLine(self, fen):
+        return "state {} {} {} {} {}\n".format(self.game_id, self.ply, self.last_move, self.status, fen).encode()
+
+
+class MoveBatcher:
+    """
+    Ходы, пришедшие примерно одновременно, уходят в пул пачками по chunk_size - одна передача между процессами
+    на пачку. В работе не больше max_in_flight пачек: пока пул занят, ходы копятся и следующая пачка больше
+    """
+
+    def __init__(self, executor, chunk_size=DEFAULT_CHUNK_SIZE, max_in_flight=2):
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.pending = []  # (задание, future)
+        self.in_flight = 0
+        self.scheduled = False
+
+    def submit(self, root, moves, uci):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append(((root, moves, uci), future))
+        if not self.scheduled:  # отправка на следующей итерации цикла - ходы этой итерации попадут в одну пачку
+            self.scheduled = True
+            loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        self.scheduled = False
+        loop = asyncio.get_running_loop()
+        while self.pending and self.in_flight < self.max_in_flight:
+            chunk, self.pending = self.pending[:self.chunk_size], self.pending[self.chunk_size:]
+            self.in_flight += 1
+            done = loop.run_in_executor(self.executor, _applyMoves, [task for task, _ in chunk])
+            done.add_done_callback(functools.partial(self.distribute, [future for _, future in chunk]))
+
+    def distribute(self, futures, done):
+        self.in_flight -= 1
+        error = done.exception()
+        for i, future in enumerate(futures):
+            if future.cancelled():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(done.result()[i])
+        self.flush()
+
+
+class GameServer:
+    """
+    Партии и соединения. Весь сервер работает в одном потоке цикла событий, тяжёлое - в пуле процессов
+    """
+
+    def __init__(self, workers=None, backend="array", chunk_size=DEFAULT_CHUNK_SIZE, tt_size_mb=DEFAULT_TT_SIZE_MB):
+        workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(backend, tt_size_mb))
+        self.batcher = MoveBatcher(self.executor, chunk_size, workers * 2)
+        self.games = {}
+        self.next_id = 1
+        initial = ChessEngine.GameState(backend)
+        self.initial_root = initial.snapshot()  # начальная позиция - без обращения к пулу
+        self.initial_fen = initial.to_fen()
+        self.tasks = set()  # выполняющиеся ходы и ответы движка - ссылки, чтобы задачи не собрал сборщик мусора
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        """
+        Приём соединений до отмены. ready(порт) вызывается, когда сервер начал слушать
+        """
+        # процессы пула создаются до открытия сокета, иначе при fork они унаследуют его и будут держать порт
+        await asyncio.get_running_loop().run_in_executor(self.executor, _describe, self.initial_root, b"")
+        server = await asyncio.start_server(self.handleClient, host, port)
+        try:
+            if ready is not None:
+                ready(server.sockets[0].getsockname()[1])
+            await server.serve_forever()
+        finally:
+            server.close()
+            self.executor.shutdown(cancel_futures=True)
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handleClient(self, reader, writer):
+        seats = {}  # id партии -> места этого соединения
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode("utf-8", "replace").split()
+                if words == ["quit"]:
+                    break
+                if words:
+                    self.spawn(self.command(words, writer, seats))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for game_id, seat in seats.items():
+                game = self.games.get(game_id)
+                if game is not None:
+                    game.seats &= ~seat
+                    game.watchers.remove(writer)
+                    if not game.watchers:  # к партии больше никто не подключён - вернуться в неё нельзя
+                        del self.games[game_id]
+            writer.close()
+
+    async def command(self, words, writer, seats):
+        """
+        Одна команда соединения. Команды выполняются задачами, поэтому ходы в разных партиях одного соединения
+        проверяются одной пачкой
+        """
+        game_id = "-"
+        try:
+            name, args = words[0], words[1:]
+            if name == "new":
+                await self.newGame(args, writer, seats)
+                return
+            if not args or not args[0].isdigit() or int(args[0]) not in self.games:
+                raise ValueError("нет такой партии")
+            game_id = args[0]
+            game = self.games[int(game_id)]
+            if name == "join" and len(args) == 2 and args[1] in SEATS:
+                self.join(game, SEATS[args[1]], writer, seats)
+                writer.write("game {} {}\n".format(game.game_id, args[1]).encode())
+                await self.sendState(game, writer)
+            elif name == "state" and len(args) == 1:
+                await self.sendState(game, writer)
+            elif name == "move" and len(args) == 2:
+                await self.move(game, args[1], seats.get(game.game_id, 0))
+            else:
+                raise ValueError("неизвестная команда: " + " ".join(words))
+        except ValueError as error:  # ошибки протокола и некорректный FEN (loadFen)
+            writer.write("error {} {}\n".format(game_id, error).encode())
+        except Exception as error:  # всё остальное, в том числе из пула, - тоже ответ клиенту, а не упавшая задача
+            writer.write("error {} {}: {}\n".format(game_id, type(error).__name__, error).encode())
+
+    async def newGame(self, args, writer, seats):
+        if not args or args[0] not in SEATS or args[0] == "watch":
+            raise ValueError("new <white|black|both> [<мс движка> [<FEN>]]")
+        seat = SEATS[args[0]]
+        engine_ms = int(args[1]) if len(args) > 1 else 0
+        if len(args) > 2:
+            root, status = await asyncio.get_running_loop().run_in_executor(self.executor, _newGame,
+                                                                            " ".join(args[2:]))
+        else:
+            root, status = self.initial_root, "ongoing"
+        game = ServerGame(self.next_id, root, status, SEATS["both"] & ~seat if engine_ms > 0 else 0, engine_ms)
+        self.games[game.game_id] = game
+        self.next_id += 1
+        self.join(game, seat, writer, seats)
+        writer.write("game {} {}\n".format(game.game_id, args[0]).encode())
+        if len(args) > 2:
+            await self.sendState(game, writer)
+        else:
+            writer.write(game.stateLine(self.initial_fen))
+        self.engineReply(game)
+
+    def join(self, game, seat, writer, seats):
+        if game.seats & seat:
+            raise ValueError("место занято")
+        game.seats |= seat
+        if game.game_id not in seats:
+            game.watchers.append(writer)
+        seats[game.game_id] = seats.get(game.game_id, 0) | seat
+
+    async def sendState(self, game, writer):
+        status, fen = await asyncio.get_running_loop().run_in_executor(self.executor, _describe, game.root,
+                                                                       game.moves.tobytes())
+        writer.write(game.stateLine(fen))
+
+    async def move(self, game, uci, seat):
+        if game.status != "ongoing":
+            raise ValueError("партия окончена")
+        if not seat & (1 if game.white_to_move else 2):
+            raise ValueError("сейчас не ваш ход")
+        if game.busy:
+            raise ValueError("предыдущий ход ещё проверяется")
+        game.busy = True
+        try:
+            result = await self.batcher.submit(game.root, game.moves.tobytes(), uci)
+        finally:
+            game.busy = False
+        if result is None:
+            raise ValueError("нет такого хода: " + uci)
+        self.played(game, result)
+        self.engineReply(game)
+
+    def played(self, game, result):
+        code, game.last_move, root, game.status, fen = result
+        if root is not None:
+            game.root = root
+            game.moves = array.array("I")
+        else:
+            game.moves.append(code)
+        game.ply += 1
+        line = game.stateLine(fen)
+        for writer in game.watchers:
+            writer.write(line)  # без ожидания drain: медленный клиент не задерживает остальных
+        if game.status != "ongoing" and not game.watchers:  # ответ движка пришёл, когда все уже отключились
+            self.games.pop(game.game_id, None)
+
+    def engineReply(self, game):
+        if game.status == "ongoing" and game.engine_seat & (1 if game.white_to_move else 2):
+            self.spawn(self.engineMove(game))
+
+    async def engineMove(self, game):
+        game.busy = True
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, _engineMove, game.root,
+                                                                      game.moves.tobytes(), game.engine_ms)
+        except Exception as error:  # задачу никто не ждёт - без этого ошибка пула потерялась бы молча
+            line = "error {} {}: {}\n".format(game.game_id, type(error).__name__, error).encode()
+            for writer in game.watchers:
+                writer.write(line)
+            return
+        finally:
+            game.busy = False
+        if result is not None:
+            self.played(game, result)
+
+
+def memoryPerGame(count=1000):
+    """
+    Байт на партию в памяти сервера: ServerGame против полного GameState
+    """
+    root = ChessEngine.GameState().snapshot()
+    sizes = []
+    for create in (lambda i: ServerGame(i, root), lambda i: ChessEngine.GameState()):
+        tracemalloc.start()
+        games = [create(i) for i in range(count)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        sizes.append(size / len(games))
+    return sizes
+
+
+async def _loadConnection(host, port, games, engine_ms, deadline, latencies, counts, seed):
+    """
+    Одно соединение нагрузки: games партий, в каждой - случайные легальные ходы, один ход в ожидании на партию.
+    Задержка - от отправки хода до прихода его state. Законченные партии заменяются новыми
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    rng = random.Random(seed)
+    game_state = ChessEngine.GameState()  # ход выбирается по FEN из state
+    new_game = "new white {}\n".format(engine_ms).encode() if engine_ms else b"new both\n"
+    writer.write(new_game * games)
+    sent = {}  # id партии -> время отправки хода
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        words = line.decode().split(" ", 5)
+        now = time.perf_counter()
+        if words[0] == "error":
+            counts["errors"] += 1
+            sent.pop(words[1], None)
+        elif words[0] == "state":
+            _, game_id, _, _, status, fen = words
+            start = sent.pop(game_id, None)
+            if start is not None:
+                latencies.append(now - start)
+                counts["moves"] += 1
+            if now >= deadline:
+                if not sent:
+                    break
+            elif status != "ongoing":
+                counts["games"] += 1
+                writer.write(new_game)
+            elif not engine_ms or fen.split()[1] == "w":  # с движком ходим только за белых
+                game_state.loadFen(fen)
+                uci = ChessEngine.Move.fromCode(rng.choice(game_state.getValidMoveCodes())).getUciNotation()
+                sent[game_id] = time.perf_counter()
+                writer.write("move {} {}\n".format(game_id, uci).encode())
+        await writer.drain()
+    writer.write(b"quit\n")
+    writer.close()
+
+
+async def loadTest(host=DEFAULT_HOST, port=DEFAULT_PORT, connections=8, games=32, seconds=10.0, engine_ms=0, seed=0):
+    """
+    Нагрузка на запущенный сервер. Возвращает (ходов в секунду, задержки в секундах по возрастанию, счётчики)
+    """
+    latencies = []
+    counts = {"moves": 0, "games": 0, "errors": 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(_loadConnection(host, port, games, engine_ms, start + seconds, latencies, counts,
+                                           seed + i) for i in range(connections)))
+    elapsed = time.perf_counter() - start
+    return counts["moves"] / elapsed, sorted(latencies), counts
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def spawnServer(args):
+    """
+    Сервер в отдельном процессе для нагрузочного теста, возвращает процесс после того, как сервер начал слушать
+    """
+    command = [sys.executable, "-m", __spec__.name, "--host", args.host, "--port", str(args.port),
+               "--backend", args.backend, "--chunk-size", str(args.chunk_size)]
+    if args.workers:
+        command += ["-j", str(args.workers)]
+    server = subprocess.Popen(command, cwd=PACKAGE_PARENT, stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервер партий на asyncio и нагрузочный клиент к нему")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="процессов в пуле (по умолчанию - ядра)")
+    parser.add_argument("--backend", choices=("array", "bitboard"), default="array",
+                        help="представление доски и генератор ходов")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="ходов в одном задании пулу")
+    parser.add_argument("--load-test", action="store_true", help="нагрузочный клиент вместо сервера")
+    parser.add_argument("--spawn", action="store_true", help="для --load-test: запустить сервер в отдельном процессе")
+    parser.add_argument("--connections", type=int, default=8, help="соединений нагрузочного клиента")
+    parser.add_argument("--games", type=int, default=32, help="партий одновременно на соединение")
+    parser.add_argument("--seconds", type=float, default=10.0, help="длительность нагрузки")
+    parser.add_argument("--engine-ms", type=int, default=0, help="время ответа движка; 0 - клиент ходит за обе стороны")
+    parser.add_argument("--memory", type=int, metavar="N", help="только замерить память на N партий")
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        server_game, game_state = memoryPerGame(args.memory)
+        print("Память на партию: ServerGame {:.0f} байт, GameState {:.0f} байт".format(server_game, game_state))
+        return 0
+    if not args.load_test:
+        try:
+            asyncio.run(GameServer(args.workers, args.backend, args.chunk_size).serve(
+                args.host, args.port, lambda port: print("Сервер слушает {}:{}".format(args.host, port), flush=True)))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    server = spawnServer(args) if args.spawn else None
+    try:
+        moves_per_second, latencies, counts = asyncio.run(loadTest(args.host, args.port, args.connections, args.games,
+                                                                   args.seconds, args.engine_ms))
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT)  # сервер закрывает пул процессов
+            server.wait()
+    print("Соединений {}, партий {}, ходов {}, законченных партий {}, ошибок {}".format(
+        args.connections, args.connections * args.games, counts["moves"], counts["games"], counts["errors"]))
+    print("{:.0f} ходов/с, задержка p50 {:.2f} мс, p99 {:.2f} мс, максимум {:.2f} мс".format(
+        moves_per_second, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+        (latencies[-1] if latencies else 0.0) * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
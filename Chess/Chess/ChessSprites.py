@@ -0,0 +1,219 @@
+"""
+Кеш изображений фигур
+Все 12 фигур нужного размера лежат в одной заранее отмасштабированной поверхности (атласе). Атлас каждого размера
+клетки хранится в памяти и в файле кеша, поэтому при запуске PNG не декодируются и не масштабируются.
+Кеш устаревает, если изображения в пакете новее него. При изменении размера окна новый атлас масштабируется
+из уже декодированных изображений
+"""
+import argparse
+import importlib.resources
+import os
+import pathlib
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import pygame as p
+
+from . import ChessEngine
+
+IMAGES_DIRECTORY = "images"
+SPRITE_PIECES = ChessEngine.PIECES[1:]  # порядок фигур в атласе
+CACHE_MAGIC = b"CSPR"
+CACHE_HEADER = struct.Struct("<4sHHq")  # метка, размер клетки, фигур в атласе, время изменения изображений (нс)
+PACKAGE_PARENT = pathlib.Path(__file__).resolve().parent.parent  # откуда запускать python -m для замера
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                                 "chess_project")
+
+
+def sourceDirectory():
+    """
+    Каталог изображений внутри пакета
+    """
+    return importlib.resources.files(__package__) / IMAGES_DIRECTORY
+
+
+def decodeImages(source):
+    """
+    Декодированные PNG фигур исходного размера: фигура -> поверхность
+    """
+    images = {}
+    for piece in SPRITE_PIECES:
+        with (source / (piece + ".png")).open("rb") as file:
+            images[piece] = p.image.load(file, piece + ".png")
+    return images
+
+
+class SpriteCache:
+    """
+    Атласы фигур по размерам клетки. cache_dir=None - без файла кеша, только в памяти
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, source=None):
+        self.cache_dir = cache_dir
+        self.source = source if source is not None else sourceDirectory()
+        self.sources = None  # декодированные PNG - только если атласа нужного размера нет в кеше
+        self.atlases = {}  # размер клетки -> атлас
+        self.stamp = None
+
+    def images(self, square_size):
+        """
+        Фигура -> поверхность square_size x square_size, все - части одного атласа
+        """
+        atlas = self.atlases.get(square_size)
+        if atlas is None:
+            atlas = self.loadAtlas(square_size)
+            if atlas is None:
+                atlas = self.buildAtlas(square_size)
+                self.saveAtlas(square_size, atlas)
+            if p.display.get_surface() is not None:
+                atlas = atlas.convert_alpha()  # формат экрана - быстрее рисовать
+            self.atlases[square_size] = atlas
+        return {piece: atlas.subsurface((i * square_size, 0, square_size, square_size))
+                for i, piece in enumerate(SPRITE_PIECES)}
+
+    def buildAtlas(self, square_size):
+        if self.sources is None:
+            self.sources = decodeImages(self.source)
+        atlas = p.Surface((square_size * len(SPRITE_PIECES), square_size), p.SRCALPHA, 32)
+        for i, piece in enumerate(SPRITE_PIECES):
+            # BLEND_RGBA_MAX на прозрачный атлас копирует пиксели как есть, без смешивания полупрозрачных краёв
+            atlas.blit(p.transform.scale(self.sources[piece], (square_size, square_size)), (i * square_size, 0),
+                       special_flags=p.BLEND_RGBA_MAX)
+        return atlas
+
+    def sourceStamp(self):
+        """
+        Время изменения самого нового изображения в наносекундах, None - изображения не в файлах (например, в zip)
+        """
+        if self.stamp is None and isinstance(self.source, pathlib.Path):
+            self.stamp = max(os.stat(self.source / (piece + ".png")).st_mtime_ns for piece in SPRITE_PIECES)
+        return self.stamp
+
+    def cachePath(self, square_size):
+        return os.path.join(self.cache_dir, "sprites_{}.bin".format(square_size))
+
+    def loadAtlas(self, square_size):
+        """
+        Атлас из файла кеша или None, если файла нет или он устарел
+        """
+        stamp = self.sourceStamp()
+        if self.cache_dir is None or stamp is None:
+            return None
+        try:
+            with open(self.cachePath(square_size), "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        size = (square_size * len(SPRITE_PIECES), square_size)
+        if len(data) != CACHE_HEADER.size + size[0] * size[1] * 4:
+            return None
+        if CACHE_HEADER.unpack_from(data) != (CACHE_MAGIC, square_size, len(SPRITE_PIECES), stamp):
+            return None
+        return p.image.frombytes(data[CACHE_HEADER.size:], size, "RGBA")
+
+    def saveAtlas(self, square_size, atlas):
+        """
+        Запись атласа в кеш. Кеш необязателен: если записать нельзя, просто работаем без него
+        """
+        stamp = self.sourceStamp()
+        if self.cache_dir is None or stamp is None:
+            return
+        path = self.cachePath(square_size)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as file:
+                file.write(CACHE_HEADER.pack(CACHE_MAGIC, square_size, len(SPRITE_PIECES), stamp))
+                file.write(p.image.tobytes(atlas, "RGBA"))
+            os.replace(path + ".tmp", path)  # другой процесс не увидит недописанный файл
+        except OSError:
+            pass
+
+
+def firstFrame(mode, square_size, cache_dir):
+    """
+    Запуск интерфейса до первого кадра на экране, возвращает секунды на изображения фигур.
+    mode: png - декодировать и масштабировать каждый PNG, как раньше; cache - через SpriteCache
+    """
+    from . import ChessMain  # размеры панели и импорт интерфейса - часть запуска
+    from . import ChessRender
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    p.init()
+    screen = p.display.set_mode((square_size * 8 + ChessMain.MOVE_LOG_PANEL_WIDTH, square_size * 8))
+    start = time.perf_counter()
+    if mode == "png":
+        images = {piece: p.transform.scale(image, (square_size, square_size))
+                  for piece, image in decodeImages(sourceDirectory()).items()}
+    else:
+        images = SpriteCache(cache_dir).images(square_size)
+    seconds = time.perf_counter() - start
+    renderer = ChessRender.BoardRenderer(images, p.font.SysFont("Arial", 14, False, False), square_size,
+                                         ChessMain.MOVE_LOG_PANEL_WIDTH)
+    game_state = ChessEngine.GameState()
+    p.display.update(renderer.draw(screen, game_state, game_state.getValidMoves(), ()))
+    p.quit()
+    return seconds
+
+
+def benchmark(square_size=64, runs=5, sizes=(48, 64, 80, 96, 128)):
+    """
+    Время до первого кадра в отдельных процессах (запуск интерпретатора, импорт, окно, изображения, кадр):
+    PNG каждый раз, кеш ещё не создан, кеш готов. И время атласа нового размера, как при изменении размера окна.
+    Возвращает строки (название, секунд до первого кадра, секунд на изображения)
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name, mode, clear in (("PNG + масштабирование", "png", False), ("кеш создаётся", "cache", True),
+                                  ("кеш готов", "cache", False)):
+            totals = []
+            loads = []
+            for _ in range(runs):
+                if clear:
+                    for file_name in os.listdir(cache_dir):
+                        os.remove(os.path.join(cache_dir, file_name))
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, "-m", __spec__.name, "--first-frame", mode, "--size",
+                                         str(square_size), "--cache-dir", cache_dir], cwd=PACKAGE_PARENT,
+                                        capture_output=True, text=True, check=True).stdout
+                totals.append(time.perf_counter() - start)
+                loads.append(float(output.split()[-1]))
+            rows.append((name, statistics.median(totals), statistics.median(loads)))
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    p.init()
+    p.display.set_mode((1, 1))
+    sprites = SpriteCache(None)
+    sprites.images(square_size)
+    start = time.perf_counter()
+    for size in sizes:
+        if size != square_size:
+            sprites.images(size)
+    rows.append(("новые размеры {} без декодирования".format(len(sizes) - 1), None, time.perf_counter() - start))
+    p.quit()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Кеш изображений фигур и замер времени до первого кадра")
+    parser.add_argument("--size", type=int, default=64, help="размер клетки в пикселях")
+    parser.add_argument("--runs", type=int, default=5, help="запусков на каждый вариант, берётся медиана")
+    parser.add_argument("--first-frame", choices=("png", "cache"), help=argparse.SUPPRESS)  # один запуск для замера
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="каталог файлов кеша")
+    args = parser.parse_args(argv)
+
+    if args.first_frame:
+        print(firstFrame(args.first_frame, args.size, args.cache_dir))
+        return 0
+    print("Размер клетки {}, медиана {} запусков".format(args.size, args.runs))
+    for name, total, load in benchmark(args.size, args.runs):
+        first_frame = "до первого кадра {:7.1f} мс, ".format(total * 1000) if total is not None else ""
+        print("{:<36} {}изображения {:6.2f} мс".format(name, first_frame, load * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Таблица транспозиций
+Фиксированный размер, записи упакованы в массив 64-битных слов и выделяются один раз при создании
+"""
+from array import array
+
+# тип оценки в записи: точная, нижняя граница (было отсечение по beta), верхняя граница (ни один ход не улучшил alpha)
+EXACT, LOWER, UPPER = 1, 2, 3
+
+ENTRY_BYTES = 16  # 2 слова по 8 байт: ключ XOR данные и данные
+BUCKET_SIZE = 2  # 0 - запись с приоритетом глубины, 1 - запись, которая заменяется всегда
+
+# раскладка слова данных: ход (32 бита), оценка (20), глубина (8), тип оценки (2), поколение (2)
+SCORE_SHIFT, DEPTH_SHIFT, BOUND_SHIFT, AGE_SHIFT = 32, 52, 60, 62
+SCORE_OFFSET = 1 << 19  # оценка хранится со смещением, чтобы быть неотрицательной
+MOVE_MASK = (1 << 32) - 1
+SCORE_MASK = (1 << 20) - 1
+
+
+class TranspositionTable:
+    def __init__(self, size_mb=16, buffer=None):
+        """
+        size_mb - объём таблицы в мегабайтах, количество корзин округляется вниз.
+        buffer - готовая память (например, multiprocessing.shared_memory.SharedMemory.buf): таблица работает
+        прямо в ней, размер берётся из буфера. Так несколько процессов пользуются одной таблицей
+        """
+        if buffer is not None:
+            view = memoryview(buffer)
+            self.bucket_count = len(view) // (ENTRY_BYTES * BUCKET_SIZE)
+            self.table = view[:self.bucket_count * BUCKET_SIZE * ENTRY_BYTES].cast("Q")
+            view.release()
+        else:
+            self.bucket_count = max(1, int(size_mb * 1024 * 1024) // (ENTRY_BYTES * BUCKET_SIZE))
+            self.table = array("Q", bytes(self.bucket_count * BUCKET_SIZE * ENTRY_BYTES))
+        self.age = 0  # поколение - номер поиска, чтобы старые записи вытеснялись первыми
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0  # в корзине лежали записи других позиций
+        self.stores = 0
+
+    @property
+    def size_mb(self):
+        return self.bucket_count * BUCKET_SIZE * ENTRY_BYTES / (1024 * 1024)
+
+    def newSearch(self):
+        self.age = (self.age + 1) & 3
+
+    def clear(self):
+        self.table[:] = array("Q", bytes(len(self.table) * 8))  # на месте - буфер может быть общим
+        self.age = 0
+        self.hits = self.misses = self.collisions = self.stores = 0
+
+    def release(self):
+        """
+        Отпускает внешний буфер, после этого его можно закрыть (SharedMemory.close)
+        """
+        if isinstance(self.table, memoryview):
+            self.table.release()
+
+    def probe(self, key):
+        """
+        Запись для позиции с хешем key: (ход, оценка, глубина, тип оценки) или None
+        """
+        table = self.table
+        index = (key % self.bucket_count) * BUCKET_SIZE * 2
+        occupied = False
+        for slot in range(index, index + BUCKET_SIZE * 2, 2):
+            data = table[slot + 1]
+            if data:
+                # ключ хранится как key ^ data: запись, которую частично перезаписали, не пройдёт проверку
+                if table[slot] ^ data == key:
+                    self.hits += 1
+                    return (data & MOVE_MASK, ((data >> SCORE_SHIFT) & SCORE_MASK) - SCORE_OFFSET,
+                            (data >> DEPTH_SHIFT) & 0xFF, (data >> BOUND_SHIFT) & 3)
+                occupied = True
+        self.misses += 1
+        if occupied:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, bound, score, move=0):
+        """
+        Сохраняет результат поиска. Первая запись корзины заменяется, только если новая глубина не меньше
+        или запись устарела, иначе результат пишется во вторую запись, которая заменяется всегда
+        """
+        table = self.table
+        index = (key % self.bucket_count) * BUCKET_SIZE * 2
+        data = ((move & MOVE_MASK) | ((score + SCORE_OFFSET) & SCORE_MASK) << SCORE_SHIFT
+                | min(max(depth, 0), 0xFF) << DEPTH_SHIFT | bound << BOUND_SHIFT | self.age << AGE_SHIFT)
+        old_data = table[index + 1]
+        slot = index + 2
+        if (not old_data or table[index] ^ old_data == key or (old_data >> AGE_SHIFT) != self.age
+                or depth >= (old_data >> DEPTH_SHIFT) & 0xFF):
+            slot = index
+        old_data = table[slot + 1]
+        if not move and old_data and table[slot] ^ old_data == key:
+            data |= old_data & MOVE_MASK  # не теряем лучший ход, если у нового результата его нет
+        self.stores += 1
+        table[slot] = key ^ data
+        table[slot + 1] = data
+
+    def hashfull(self):
+        """
+        Заполненность таблицы текущим поиском в промилле (по первой тысяче записей)
+        """
+        sample = min(1000, len(self.table) // 2)
+        filled = 0
+        for slot in range(0, sample * 2, 2):
+            data = self.table[slot + 1]
+            if data and data >> AGE_SHIFT == self.age:
+                filled += 1
+        return filled * 1000 // sample if sample else 0
+
+    def stats(self):
+        return {"size_mb": round(self.size_mb, 2), "hits": self.hits, "misses": self.misses,
+                "collisions": self.collisions, "stores": self.stores, "hashfull": self.hashfull()}
@@ -0,0 +1,239 @@
+"""
+Движок по протоколу UCI через stdin/stdout - для турнирных менеджеров и своих скриптов
+Поиск идёт в отдельном потоке, поток ввода остаётся свободным: stop, ponderhit и isready обрабатываются,
+пока движок думает, поиск замечает stop через несколько миллисекунд (ChessSearch.CHECK_EVERY).
+position с теми же ходами плюс новыми, как его присылают менеджеры каждый ход, доигрывает только новые ходы
+"""
+import argparse
+import sys
+import threading
+
+from . import ChessEngine
+from . import ChessSearch
+from . import ChessTransposition
+
+ENGINE_NAME = "chess_project"
+ENGINE_AUTHOR = "DragonLich"
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 1024
+MOVES_TO_GO = 30  # на сколько ходов делить оставшееся время, если movestogo не задан
+MOVE_OVERHEAD_MS = 30  # запас на задержки менеджера и запуск потока
+SWITCH_INTERVAL = 0.001  # как часто интерпретатор переключает потоки - поток ввода не ждёт поиск дольше
+GO_VALUES = ("wtime", "btime", "winc", "binc", "movestogo", "depth", "nodes", "movetime")
+
+
+def moveTime(params, white_to_move):
+    """
+    Время на ход в миллисекундах по параметрам go или None, если время не ограничено
+    """
+    if "movetime" in params:
+        return max(params["movetime"] - MOVE_OVERHEAD_MS, 1)
+    remaining = params.get("wtime" if white_to_move else "btime")
+    if remaining is None:
+        return None
+    increment = params.get("winc" if white_to_move else "binc", 0)
+    budget = remaining / params.get("movestogo", MOVES_TO_GO) + increment * 3 // 4
+    return int(max(min(budget, remaining - MOVE_OVERHEAD_MS), 1))
+
+
+def scoreText(score):
+    """
+    Оценка для info: cp в сантипешках или mate в ходах (отрицательное - мат нам)
+    """
+    if abs(score) >= ChessSearch.MATE_SCORE - ChessSearch.MAX_PLY:
+        plies = ChessSearch.MATE_SCORE - abs(score)
+        return "mate {}".format((plies + 1) // 2 if score > 0 else -((plies + 1) // 2))
+    return "cp {}".format(score)
+
+
+class UciEngine:
+    """
+    Состояние UCI-сессии: позиция, таблица транспозиций и поток поиска. command() вызывается из потока ввода
+    """
+
+    def __init__(self, output=sys.stdout, backend="array"):
+        self.output = output
+        self.output_lock = threading.Lock()  # строки info из потока поиска и ответы на команды не перемешиваются
+        self.backend = backend
+        self.hash_mb = DEFAULT_HASH_MB
+        self.tt = ChessTransposition.TranspositionTable(self.hash_mb)
+        self.game_state = ChessEngine.GameState(backend)
+        self.position_base = "startpos"  # startpos или FEN текущей позиции
+        self.position_moves = []  # ходы от неё, уже сделанные на game_state
+        self.thread = None
+        self.searcher = None
+        self.stop_event = threading.Event()
+        self.release = threading.Event()  # при ponder и infinite bestmove ждёт stop или ponderhit
+        self.ponder_time_ms = None  # время на ход после ponderhit
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def command(self, line):
+        """
+        Одна строка от менеджера, False - quit
+        """
+        words = line.split()
+        if not words:
+            return True
+        name = words[0]
+        if name == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default {} min 1 max {}".format(DEFAULT_HASH_MB, MAX_HASH_MB))
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif name == "isready":
+            self.send("readyok")
+        elif name == "setoption":
+            self.setOption(words)
+        elif name == "ucinewgame":
+            self.stop()
+            self.tt.clear()
+            self.setPosition("startpos", [])
+        elif name == "position":
+            self.stop()
+            self.position(words)
+        elif name == "go":
+            self.stop()
+            self.go(words[1:])
+        elif name == "stop":
+            self.stop()
+        elif name == "ponderhit":
+            self.ponderhit()
+        elif name == "quit":
+            self.stop()
+            return False
+        return True
+
+    def setOption(self, words):
+        # setoption name <имя> [value <значение>]
+        if "name" not in words:
+            return
+        end = words.index("value") if "value" in words else len(words)
+        name = " ".join(words[words.index("name") + 1:end]).lower()
+        value = " ".join(words[end + 1:])
+        if name == "hash" and value.isdigit():
+            self.stop()
+            self.hash_mb = max(1, min(int(value), MAX_HASH_MB))
+            self.tt = ChessTransposition.TranspositionTable(self.hash_mb)
+
+    def position(self, words):
+        # position startpos|fen <FEN> [moves <ход> ...]
+        moves = words[words.index("moves") + 1:] if "moves" in words else []
+        words = words[:words.index("moves")] if "moves" in words else words
+        if words[1:2] == ["startpos"]:
+            base = "startpos"
+        elif words[1:2] == ["fen"]:
+            base = " ".join(words[2:])
+        else:
+            self.send("info string position startpos|fen <FEN> [moves ...]")
+            return
+        self.setPosition(base, moves)
+
+    def setPosition(self, base, moves):
+        """
+        Позиция base и ходы от неё. Если это продолжение текущей позиции, делаются только новые ходы
+        """
+        done = self.position_moves
+        if base != self.position_base or moves[:len(done)] != done:
+            try:
+                self.game_state = (ChessEngine.GameState(self.backend) if base == "startpos"
+                                   else ChessEngine.GameState.from_fen(base, self.backend))
+            except ValueError as error:
+                self.send("info string " + str(error))
+                return
+            self.position_base = base
+            done = self.position_moves = []
+        for uci in moves[len(done):]:
+            for move in self.game_state.getValidMoves():
+                if move.getUciNotation() == uci:
+                    self.game_state.makeMove(move)
+                    done.append(uci)
+                    break
+            else:
+                self.send("info string нет такого хода: " + uci)
+                return
+
+    def go(self, words):
+        params = {}
+        for i, word in enumerate(words[:-1]):
+            if word in GO_VALUES and words[i + 1].lstrip("-").isdigit():
+                params[word] = int(words[i + 1])
+        ponder = "ponder" in words
+        hold = ponder or "infinite" in words
+        time_ms = moveTime(params, self.game_state.white_to_move)
+        self.ponder_time_ms = time_ms if ponder else None
+        self.stop_event.clear()
+        self.release.clear()
+        self.searcher = ChessSearch.Searcher(self.game_state, None if hold else time_ms, params.get("nodes"),
+                                             params.get("depth", ChessSearch.MAX_PLY), self.tt,
+                                             stop_event=self.stop_event, info=self.info)
+        self.thread = threading.Thread(target=self.search, args=(self.searcher, hold), daemon=True)
+        self.thread.start()
+
+    def search(self, searcher, hold):
+        """
+        Поток поиска. При ponder и infinite bestmove отправляется только после stop или ponderhit
+        """
+        result = searcher.search()
+        if hold:
+            self.release.wait()
+        if result.move is None:
+            self.send("bestmove 0000")
+        elif len(result.pv) > 1:
+            self.send("bestmove {} ponder {}".format(result.move.getUciNotation(), result.pv[1].getUciNotation()))
+        else:
+            self.send("bestmove " + result.move.getUciNotation())
+
+    def info(self, result):
+        self.send("info depth {} score {} nodes {} nps {} time {} hashfull {} pv {}".format(
+            result.depth, scoreText(result.score), result.nodes, result.nps, int(result.seconds * 1000),
+            self.tt.hashfull(), " ".join(move.getUciNotation() for move in result.pv)))
+
+    def stop(self):
+        """
+        Остановка поиска и ожидание bestmove
+        """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.release.set()
+        self.thread.join()
+        self.thread = None
+
+    def ponderhit(self):
+        """
+        Соперник сделал ожидаемый ход: поиск продолжается уже с ограничением времени
+        """
+        if self.thread is None:
+            return
+        if self.ponder_time_ms is not None:
+            self.searcher.startClock(self.ponder_time_ms)
+        self.release.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Движок по протоколу UCI через stdin/stdout")
+    parser.add_argument("--backend", choices=("array", "bitboard"), default="array",
+                        help="представление доски и генератор ходов")
+    args = parser.parse_args(argv)
+
+    sys.setswitchinterval(SWITCH_INTERVAL)
+    engine = UciEngine(backend=args.backend)
+    while True:
+        line = sys.stdin.readline()
+        if not line:  # менеджер закрыл ввод
+            engine.stop()
+            return 0
+        try:
+            if not engine.command(line):
+                return 0
+        except Exception as error:  # ошибка в одной команде не должна завершать движок - менеджер засчитает сбой
+            engine.send("info string {}: {}".format(type(error).__name__, error))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Движок в фоновом процессе для интерфейса
+Главный цикл отправляет задание (поиск хода или непрерывный анализ) и сразу продолжает обрабатывать ввод и рисовать,
+результаты забирает из очереди без ожидания. Новое задание или cancel() отменяет текущее: поиск останавливается,
+а его сообщения, которые уже успели попасть в очередь, отбрасываются
+"""
+import multiprocessing
+import queue
+
+from . import ChessEngine
+from . import ChessParallel
+from . import ChessSearch
+from . import ChessTransposition
+
+DEFAULT_TT_SIZE_MB = 32
+CLOSE_TIMEOUT = 1.0  # сколько секунд ждать завершения процесса при закрытии
+
+
+class _Cancellation:
+    """
+    Вместо stop_event для Searcher: задание отменено, как только сменился номер текущего задания
+    """
+
+    def __init__(self, generation, request_generation):
+        self.generation = generation
+        self.request_generation = request_generation
+
+    def is_set(self):
+        return self.generation.value != self.request_generation
+
+
+def _workerLoop(backend, tt_size_mb, generation, requests, results):
+    """
+    Процесс движка: задания по одному из очереди, таблица транспозиций общая для всей партии
+    """
+    tt = ChessTransposition.TranspositionTable(tt_size_mb)
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_generation, fen, history, time_ms = request
+        stop = _Cancellation(generation, request_generation)
+        if stop.is_set():
+            continue  # задание отменили, пока оно ждало в очереди
+        game_state = ChessEngine.GameState.from_fen(fen, backend)
+        for move in history:
+            game_state.makeMove(move)
+
+        def info(result):
+            results.put((request_generation, "info", result.depth, result.score,
+                         [move.code for move in result.pv], result.nodes))
+
+        result = ChessSearch.Searcher(game_state, time_ms, None, ChessSearch.MAX_PLY, tt, stop_event=stop,
+                                      info=info).search()
+        results.put((request_generation, "done", result.move.code if result.move else None, result.score,
+                     result.depth))
+
+
+class EngineWorker:
+    """
+    Процесс движка и очереди к нему. Создавать до pygame.init - дочерний процесс не должен наследовать SDL.
+    poll() возвращает сообщения текущего задания:
+    ("info", глубина, оценка, главный вариант кодами, узлы) после каждой глубины и ("done", ход или None, оценка, глубина)
+    """
+
+    def __init__(self, backend="array", tt_size_mb=DEFAULT_TT_SIZE_MB):
+        self.generation = multiprocessing.Value("i", 0)  # номер текущего задания, сменился - прежнее отменено
+        self.requests = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_workerLoop, daemon=True,
+                                               args=(backend, tt_size_mb, self.generation, self.requests,
+                                                     self.results))
+        self.process.start()
+
+    def search(self, game_state, time_ms):
+        """
+        Лучший ход за time_ms миллисекунд, итог - сообщение "done"
+        """
+        self.submit(game_state, time_ms)
+
+    def analyze(self, game_state):
+        """
+        Непрерывный анализ: глубины считаются, пока задание не отменят, каждая - сообщение "info"
+        """
+        self.submit(game_state, None)
+
+    def submit(self, game_state, time_ms):
+        # процесс повторяет ходы от последнего необратимого хода, чтобы видеть повторения позиций партии
+        fen, history = ChessParallel.rootHistory(game_state)
+        self.requests.put((self.cancel(), fen, history, time_ms))
+
+    def cancel(self):
+        """
+        Отмена текущего задания, возвращает номер следующего
+        """
+        with self.generation.get_lock():
+            self.generation.value += 1
+            return self.generation.value
+
+    def poll(self):
+        """
+        Сообщения текущего задания, пришедшие с прошлого вызова, без ожидания
+        """
+        messages = []
+        while True:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                return messages
+            if message[0] == self.generation.value:
+                messages.append(message[1:])
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.process.join(CLOSE_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
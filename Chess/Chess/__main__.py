@@ -0,0 +1,176 @@
+"""
+Командная строка движка: python -m Chess <команда>
+perft, bench, analyse, uci и play --headless работают без pygame и дисплея - интерфейс импортируется только для play
+"""
+import argparse
+import sys
+import time
+
+from . import ChessEngine
+from . import ChessPerft
+from . import ChessSearch
+from . import ChessTransposition
+from . import ChessUci
+
+BENCH_DEPTH = 3
+ANALYSE_TIME_MS = 3000  # время анализа, если не задана глубина
+PLAY_TIME_MS = 1000  # время движка на ход в play
+# кто играет за человека: белые, черные, обе стороны или никто (движок против себя)
+HUMAN_COLORS = {"white": (True, False), "black": (False, True), "both": (True, True), "none": (False, False)}
+
+
+def positionFen(position):
+    """
+    FEN по имени эталонной позиции из ChessPerft или сам FEN
+    """
+    positions = ChessPerft.REFERENCE_POSITIONS
+    return positions[position][0] if position in positions else position
+
+
+def boardText(game_state):
+    """
+    Доска текстом: белые - заглавными буквами, как в FEN, пустые клетки - точки
+    """
+    lines = []
+    for row in range(8):
+        pieces = [piece[1].upper() if piece[0] == "w" else piece[1].lower() if piece[0] == "b" else "."
+                  for piece in game_state.board[row]]
+        lines.append(ChessEngine.Move.rows_to_ranks[row] + " " + " ".join(pieces))
+    lines.append("  a b c d e f g h")
+    return "\n".join(lines)
+
+
+def resultText(game_state):
+    """
+    Итог партии или None, если она продолжается. Флаги обновляет getValidMoves
+    """
+    if game_state.checkmate:
+        return "Черные победили через мат" if game_state.white_to_move else "Белые победили через мат"
+    if game_state.stalemate:
+        return "Пат"
+    if game_state.threefold_repetition:
+        return "Ничья: троекратное повторение"
+    if game_state.fifty_move_rule:
+        return "Ничья: правило 50 ходов"
+    return None
+
+
+def perft(args):
+    return ChessPerft.main(args.args)
+
+
+def bench(args):
+    """
+    Поиск на фиксированную глубину во всех эталонных позициях - узлы и скорость для сравнения версий
+    """
+    nodes = 0
+    start = time.perf_counter()
+    for name, (fen, _) in ChessPerft.REFERENCE_POSITIONS.items():
+        result = ChessSearch.best_move(ChessEngine.GameState.from_fen(fen, args.backend), None,
+                                       max_depth=args.depth)
+        nodes += result.nodes
+        print("{:<12} {}".format(name, result))
+    seconds = time.perf_counter() - start
+    print("Всего: {} узлов, {:.3f} с, {} узлов/с".format(nodes, seconds, int(nodes / seconds) if seconds else 0))
+    return 0
+
+
+def analyse(args):
+    """
+    Анализ позиции: строка на каждую просчитанную глубину, в конце лучший ход
+    """
+    game_state = ChessEngine.GameState.from_fen(positionFen(args.position), args.backend)
+    time_ms = args.time_ms if args.time_ms is not None or args.depth is not None else ANALYSE_TIME_MS
+    max_depth = args.depth if args.depth is not None else ChessSearch.MAX_PLY
+    result = ChessSearch.Searcher(game_state, time_ms, None, max_depth, info=print).search()
+    print("bestmove " + (result.move.getUciNotation() if result.move else "(none)"))
+    return 0
+
+
+def uci(args):
+    return ChessUci.main(["--backend", args.backend])
+
+
+def play(args):
+    human_white, human_black = HUMAN_COLORS[args.human]
+    if not args.headless:
+        from . import ChessMain  # pygame нужен только здесь
+
+        ChessMain.PLAYER_ONE, ChessMain.PLAYER_TWO = human_white, human_black
+        ChessMain.ENGINE_TIME_MS = args.time_ms
+        ChessMain.main()
+        return 0
+
+    game_state = ChessEngine.GameState.from_fen(positionFen(args.position), args.backend)
+    tt = ChessTransposition.TranspositionTable()  # одна таблица на всю партию
+    while True:
+        moves = {move.getUciNotation(): move for move in game_state.getValidMoves()}
+        print(boardText(game_state))
+        result = resultText(game_state)
+        if result is not None:
+            print(result)
+            return 0
+        if human_white if game_state.white_to_move else human_black:
+            print("Ваш ход (undo, quit): ", end="", flush=True)
+            line = sys.stdin.readline()
+            if not line or line.strip() == "quit":  # конец ввода - тоже выход
+                return 0
+            line = line.strip()
+            if line == "undo":
+                game_state.undoMove()
+                # против движка отменяем и его ответ, чтобы ход вернулся к человеку
+                if not (human_white if game_state.white_to_move else human_black):
+                    game_state.undoMove()
+            elif line in moves:
+                game_state.makeMove(moves[line])
+            else:
+                print("Нет такого хода. Возможные: " + " ".join(sorted(moves)))
+        else:
+            search = ChessSearch.best_move(game_state, args.time_ms, tt=tt)
+            print("Ход движка: {} ({})".format(search.move.getUciNotation(), search))
+            game_state.makeMove(search.move)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m Chess", description="Шахматный движок из командной строки")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("perft", add_help=False, help="perft генератора ходов (аргументы ChessPerft)")
+    command.add_argument("args", nargs=argparse.REMAINDER)
+    command.set_defaults(run=perft)
+
+    command = commands.add_parser("bench", help="поиск на фиксированную глубину в эталонных позициях")
+    command.add_argument("-d", "--depth", type=int, default=BENCH_DEPTH, help="глубина поиска")
+    command.set_defaults(run=bench)
+
+    command = commands.add_parser("analyse", help="анализ позиции с выводом каждой глубины")
+    command.add_argument("position", nargs="?", default="initial", help="имя эталонной позиции из ChessPerft или FEN")
+    command.add_argument("-d", "--depth", type=int, default=None, help="глубина поиска")
+    command.add_argument("--time-ms", type=int, default=None,
+                         help="время поиска в миллисекундах (по умолчанию {}, если не задана глубина)".format(
+                             ANALYSE_TIME_MS))
+    command.set_defaults(run=analyse)
+
+    command = commands.add_parser("uci", help="движок по протоколу UCI для турнирных менеджеров")
+    command.set_defaults(run=uci)
+
+    command = commands.add_parser("play", help="партия против движка: окно pygame или текст в терминале")
+    command.add_argument("--headless", action="store_true", help="без pygame: ходы в координатной нотации из stdin")
+    command.add_argument("--human", choices=sorted(HUMAN_COLORS), default="white",
+                         help="за кого играет человек (none - движок против себя)")
+    command.add_argument("--position", default="initial", help="начальная позиция для --headless: имя или FEN")
+    command.add_argument("--time-ms", type=int, default=PLAY_TIME_MS, help="время движка на ход")
+    command.set_defaults(run=play)
+
+    for command in (commands.choices[name] for name in ("bench", "analyse", "uci", "play")):
+        command.add_argument("--backend", choices=("array", "bitboard"), default="array",
+                             help="представление доски и генератор ходов")
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["perft"]:  # аргументы целиком разбирает ChessPerft - argparse не передаёт ключи через REMAINDER
+        return perft(argparse.Namespace(args=argv[1:]))
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Perft эталонных позиций ChessPerft для обоих представлений доски и поэтапного генератора.
+Глубина каждой позиции ограничена NODE_LIMIT узлами, чтобы набор проходил за секунды
+"""
+import pytest
+
+from Chess import ChessEngine
+from Chess import ChessPerft
+
+NODE_LIMIT = 20000
+BACKENDS = ("array", "bitboard")
+CASES = [(name, depth) for name, (_, expected) in ChessPerft.REFERENCE_POSITIONS.items()
+         for depth in range(1, ChessPerft.quickDepth(expected, NODE_LIMIT) + 1)]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("name, depth", CASES)
+def test_perft(name, depth, backend):
+    fen, expected = ChessPerft.REFERENCE_POSITIONS[name]
+    assert ChessEngine.GameState.from_fen(fen, backend).perft(depth) == expected[depth]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("name, depth", CASES)
+def test_staged_perft(name, depth, backend):
+    fen, expected = ChessPerft.REFERENCE_POSITIONS[name]
+    assert ChessPerft.stagedPerft(ChessEngine.GameState.from_fen(fen, backend), depth) == expected[depth]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("name", ChessPerft.REFERENCE_POSITIONS)
+def test_perft_restores_position(name, backend):
+    # после perft позиция, хеш и оценка те же - ходы полностью отменяются через стек отмены
+    fen, expected = ChessPerft.REFERENCE_POSITIONS[name]
+    game_state = ChessEngine.GameState.from_fen(fen, backend)
+    before = (game_state.to_fen(), game_state.zobrist_key, game_state.snapshot())
+    game_state.perft(ChessPerft.quickDepth(expected, NODE_LIMIT))
+    assert (game_state.to_fen(), game_state.zobrist_key, game_state.snapshot()) == before
+    assert game_state.zobrist_key == game_state.computeZobristKey()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_divide_sums_to_perft(backend):
+    fen, expected = ChessPerft.REFERENCE_POSITIONS["kiwipete"]
+    assert sum(ChessPerft.divide(ChessEngine.GameState.from_fen(fen, backend), 2).values()) == expected[2]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_agree_on_moves(backend):
+    # одинаковые списки ходов у двух представлений - в том числе права рокировки без ладьи на месте
+    for fen in ("r3k2r/8/8/8/8/8/8/4K3 w KQkq - 0 1", "8/8/8/8/8/8/8/K6k w KQkq - 0 1",
+                *(fen for fen, _ in ChessPerft.REFERENCE_POSITIONS.values())):
+        moves = sorted(move.getUciNotation() for move in ChessEngine.GameState.from_fen(fen, backend).getValidMoves())
+        array_moves = sorted(move.getUciNotation() for move in ChessEngine.GameState.from_fen(fen).getValidMoves())
+        assert moves == array_moves, fen
+
+
+@pytest.mark.parametrize("fen", [
+    "8/8/8/8/8/8/8/K6k w - e9 0 1",
+    "8/8/8/8/8/8/8/K6k w - z3 0 1",
+    "8/8/8/8/8/8/8/K6k w - e 0 1",
+    "8/8/8/8/8/8/8/K6k w - e1 0 1",
+    "8/8/8/8/8/8/8/K6k w - e3 0 1",
+    "8/8/8/8/8/8/8/K6k w KX - 0 1",
+    "8/8/8/8/8/8/8/K6k w - - -1 1",
+    "8/8/8/8/8/8/8/K6k w - - 0 -1",
+    "8/8/8/8/8/8/8/K7 w - - 0 1",
+    "8/8/8/8/8/8/8/K6k x - - 0 1",
+])
+def test_invalid_fen(fen):
+    with pytest.raises(ValueError):
+        ChessEngine.GameState.from_fen(fen)